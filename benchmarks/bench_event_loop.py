@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускной способности event loop при обращениях к БД
+
+Поднимает локальную заглушку PostgREST с искусственной задержкой и
+прогоняет 100 одновременных "пользователей", каждый из которых отправляет
+несколько апдейтов (одно чтение подписки на апдейт).
+
+before - синхронный клиент Supabase внутри корутины (блокирует event loop)
+after  - асинхронный слой данных из models/
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _PostgrestStub(BaseHTTPRequestHandler):
+    """
+    Отвечает пустым результатом на любой запрос с задержкой сети
+    """
+    latency = 0.02
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _reply(self):
+        time.sleep(self.latency)
+        body = json.dumps([]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Range", "*/0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PATCH = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(latency: float) -> ThreadingHTTPServer:
+    """
+    Запускает заглушку PostgREST в отдельном потоке
+    """
+    _PostgrestStub.latency = latency
+    ThreadingHTTPServer.request_queue_size = 256
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _PostgrestStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def run_users(handle_update, users: int, updates_per_user: int) -> float:
+    """
+    Запускает пользователей параллельно и возвращает число апдейтов в секунду
+    """
+    async def user(chat_id: int):
+        for _ in range(updates_per_user):
+            await handle_update(chat_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(1000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    return users * updates_per_user / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка PostgREST, сек")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ["SUPABASE_URL"] = url
+    os.environ["SUPABASE_KEY"] = "bench.bench.bench"
+
+    from supabase import create_client
+    from models.subscription import subscription_cache
+    from models.user import get_user_subscription_info
+
+    sync_client = create_client(url, os.environ["SUPABASE_KEY"])
+
+    async def legacy_update(chat_id: int):
+        # Так выглядели модели до перехода на асинхронный клиент
+        sync_client.table("subscriptions").select("*").eq("user_id", chat_id).eq("is_active", True).execute()
+
+    async def async_update(chat_id: int):
+        # Замеряется запрос к БД, а не попадание в кэш подписок
+        subscription_cache.clear()
+        await get_user_subscription_info(chat_id)
+
+    # Прогрев соединений
+    await async_update(1)
+    await legacy_update(1)
+
+    before = await run_users(legacy_update, args.users, args.updates)
+    after = await run_users(async_update, args.users, args.updates)
+
+    print(f"users={args.users} updates/user={args.updates} latency={args.latency * 1000:.0f}ms")
+    print(f"before (sync client):  {before:8.1f} updates/sec")
+    print(f"after  (async client): {after:8.1f} updates/sec")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
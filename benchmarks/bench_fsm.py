@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест хранилищ состояний FSM
+
+Каждый пользователь проходит сценарий оплаты: чтение состояния,
+update_data(subscription_type), set_state(waiting_for_payment),
+чтение состояния и данных, clear(). Пользователи работают параллельно.
+
+Redis-бэкенд проверяется на сервере из --redis-url; без него поднимается
+встроенный fakeredis (pip install fakeredis) на TCP-порту.
+Сравниваются:
+redis  - aiogram RedisStorage и RedisFSMStorage (пачка операций за один round-trip)
+sqlite - SQLiteFSMStorage по одной операции в транзакции и пачками
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+
+from states.payment import PaymentStates
+
+BOT_ID = 42
+
+
+async def checkout(storage, user_id: int):
+    state = FSMContext(storage, StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id))
+    await state.get_state()
+    await state.update_data(subscription_type="1_month")
+    await state.set_state(PaymentStates.waiting_for_payment)
+    assert await state.get_state() == PaymentStates.waiting_for_payment.state
+    assert (await state.get_data())["subscription_type"] == "1_month"
+    await state.clear()
+
+
+async def run(storage, users: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def user(user_id: int):
+        async with semaphore:
+            await checkout(storage, user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(1000 + i) for i in range(users)))
+    return time.perf_counter() - started
+
+
+def serve_fake_redis(port: int):
+    from fakeredis import TcpFakeServer
+    from fakeredis._clients._tcp_server import TCPFakeRequestHandler
+
+    # fakeredis пишет каждый ответ отдельно: без TCP_NODELAY ответы
+    # на пачку команд задерживаются алгоритмом Нейгла
+    TCPFakeRequestHandler.disable_nagle_algorithm = True
+    TcpFakeServer(("127.0.0.1", port), server_type="redis").serve_forever()
+
+
+def start_fake_redis() -> str:
+    # Сервер в отдельном процессе, чтобы не делить GIL с клиентом
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    multiprocessing.Process(target=serve_fake_redis, args=(port,), daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return f"redis://127.0.0.1:{port}/0"
+
+
+def report(name: str, users: int, elapsed: float, storage=None):
+    line = f"{name:26s} {users * 7 / elapsed:8.0f} оп./с"
+    if getattr(storage, "batches", 0):
+        line += f"  обращений к бэкенду: {storage.batches} на {storage.operations} операций"
+    print(line)
+
+
+async def bench_redis(url: str, users: int, concurrency: int):
+    from aiogram.fsm.storage.redis import RedisStorage
+    from redis.asyncio import Redis
+    from fsm.redis_storage import RedisFSMStorage
+
+    storages = (
+        ("redis: aiogram RedisStorage", RedisStorage(Redis.from_url(url), state_ttl=3600, data_ttl=3600)),
+        ("redis: RedisFSMStorage", RedisFSMStorage.from_url(url, state_ttl=3600)),
+    )
+    for name, storage in storages:
+        try:
+            report(name, users, await run(storage, users, concurrency), storage)
+        finally:
+            await storage.close()
+
+
+async def bench_sqlite(users: int, concurrency: int):
+    from fsm.sqlite_storage import SQLiteFSMStorage
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, max_batch in (("sqlite: по одной операции", 1), ("sqlite: пачками", 256)):
+            storage = SQLiteFSMStorage(os.path.join(directory, f"fsm{max_batch}.sqlite3"),
+                                       state_ttl=3600, max_batch=max_batch)
+            try:
+                report(name, users, await run(storage, users, concurrency), storage)
+            finally:
+                await storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--redis-url", help="адрес Redis; по умолчанию встроенный fakeredis")
+    args = parser.parse_args()
+
+    print(f"users={args.users} concurrency={args.concurrency}")
+    asyncio.run(bench_redis(args.redis_url or start_fake_redis(), args.users, args.concurrency))
+    asyncio.run(bench_sqlite(args.users, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк процессорного времени хендлеров колбэков
+
+Апдейты прогоняются через настоящий диспетчер (middleware и роутеры),
+сессия бота вместо сети собирает тело запроса и разбирает готовый ответ,
+хранилище - InMemoryStorage без задержки. Замеряется время CPU на апдейт.
+
+before - клавиатура собирается заново на каждый вызов и сериализуется сессией
+after  - готовые клавиатуры с закэшированным JSON (keyboards.inline)
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ["STORAGE_BACKEND"] = "memory"
+# Анти-флуд не должен отклонять повторяющиеся колбэки бенчмарка
+os.environ["THROTTLE_LIMITS"] = "*=1000000000/1"
+
+CALLBACKS = ("about", "help", "website", "main_menu", "connect_vpn", "extend")
+
+KEYBOARD_GETTERS = (
+    "get_main_menu_keyboard", "get_subscription_keyboard", "get_back_keyboard",
+    "get_cancel_keyboard", "get_payment_keyboard"
+)
+
+
+def make_session_class():
+    from utils.telegram_session import TracedAiohttpSession
+
+    class OfflineSession(TracedAiohttpSession):
+        """
+        Собирает и кодирует тело запроса, как перед отправкой, и возвращает готовый ответ
+        """
+
+        async def make_request(self, bot, method, timeout=None):
+            form = self.build_form_data(bot=bot, method=method)
+            form()
+            if method.__api_method__ == "editMessageText":
+                result = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "ok"}
+            else:
+                result = True
+            content = json.dumps({"ok": True, "result": result})
+            return self.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+    return OfflineSession
+
+
+def keyboard_getters() -> dict:
+    """
+    Функции клавиатур для каждого режима:
+    before - новое дерево InlineKeyboardMarkup на каждый вызов (прежнее поведение)
+    """
+    from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+    import keyboards.inline
+
+    getters = {"before": {}, "after": {}}
+    for name in KEYBOARD_GETTERS:
+        prebuilt = getattr(keyboards.inline, name)
+        rows = [[button.model_dump(exclude_none=True) for button in row] for row in prebuilt().inline_keyboard]
+
+        def rebuild(rows=rows):
+            return InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(**button) for button in row] for row in rows
+            ])
+
+        getters["before"][name] = rebuild
+        getters["after"][name] = prebuilt
+    return getters
+
+
+def install(getters: dict):
+    import handlers.menu
+    import handlers.payments
+    import handlers.referral
+    import handlers.start
+    import keyboards.inline
+
+    for module in (keyboards.inline, handlers.menu, handlers.payments, handlers.referral, handlers.start):
+        for name, getter in getters.items():
+            if hasattr(module, name):
+                setattr(module, name, getter)
+
+
+def make_update(update_id: int, data: str):
+    from aiogram.types import Update
+
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "bench",
+            "data": data,
+            "from": {"id": 1000 + update_id % 100, "is_bot": False, "first_name": "Bench"},
+            "message": {
+                "message_id": 1, "date": 0, "text": "menu",
+                "chat": {"id": 1000 + update_id % 100, "type": "private"}
+            }
+        }
+    })
+
+
+async def run(iterations: int, rounds: int) -> dict:
+    """
+    Режимы чередуются по раундам, берется лучший раунд (меньше шума от соседей по CPU)
+    """
+    from aiogram import Bot
+
+    from bot import create_dispatcher
+    from storage.memory_storage import InMemoryStorage
+    from utils.database import set_storage
+
+    set_storage(InMemoryStorage())
+    getters = keyboard_getters()
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=make_session_class()())
+    dp = create_dispatcher()
+
+    results = {mode: {data: float("inf") for data in CALLBACKS} for mode in getters}
+    for _ in range(rounds):
+        for mode in getters:
+            install(getters[mode])
+            for data in CALLBACKS:
+                updates = [make_update(index, data) for index in range(iterations)]
+                for update in updates[:50]:
+                    await dp.feed_update(bot, update)
+
+                started = time.process_time()
+                for update in updates:
+                    await dp.feed_update(bot, update)
+                elapsed = (time.process_time() - started) / iterations
+                results[mode][data] = min(results[mode][data], elapsed)
+    await bot.session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    # bot.py настраивает логирование на INFO, для замера оставляем только ошибки
+    import bot  # noqa: F401
+    logging.getLogger().setLevel(logging.ERROR)
+    results = asyncio.run(run(args.iterations, args.rounds))
+
+    print(f"iterations={args.iterations} rounds={args.rounds}, CPU на апдейт (лучший раунд)")
+    for data in CALLBACKS:
+        before, after = results["before"][data], results["after"][data]
+        print(f"{data:12s} before={before * 1e6:7.1f}us after={after * 1e6:7.1f}us "
+              f"({(after / before - 1) * 100:+.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк задержки start_command
+
+Хендлер /start прогоняется на InMemoryStorage с искусственной задержкой
+каждого обращения к хранилищу (имитация round-trip до БД).
+
+before - SELECT + UPDATE/INSERT пользователя (прежняя реализация)
+after  - один upsert по chat_id
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+
+class FakeState:
+    async def clear(self):
+        pass
+
+
+class FakeMessage:
+    """
+    Минимальная замена aiogram Message для вызова хендлера напрямую
+    """
+
+    def __init__(self, chat_id: int):
+        self.from_user = SimpleNamespace(
+            id=chat_id, username=f"user{chat_id}", first_name="Bench", last_name=None
+        )
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+class ErrorCounter(logging.Handler):
+    """
+    Считает ошибки хендлера (например, гонку на дубликате chat_id)
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(start_command, requests: int, users: int, concurrency: int) -> list:
+    """
+    Выполняет requests вызовов /start от users разных пользователей
+    """
+    from middlewares.context import UserContext
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    rng = random.Random(42)
+
+    async def one(chat_id: int):
+        async with semaphore:
+            message = FakeMessage(chat_id)
+            started = time.perf_counter()
+            await start_command(message, FakeState(), UserContext(message.from_user))
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(rng.randint(1, users)) for _ in range(requests)))
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка хранилища, сек")
+    args = parser.parse_args()
+
+    from datetime import datetime
+    from handlers import start
+    from middlewares import context
+    from storage.memory_storage import InMemoryStorage
+    from utils.database import get_storage, set_storage
+
+    original = context.create_or_get_user
+
+    async def legacy_create_or_get_user(chat_id, username=None, first_name=None, last_name=None):
+        storage = await get_storage()
+        user = await storage.get_user(chat_id)
+        now = datetime.utcnow().isoformat()
+        if user:
+            return await storage.update_user(chat_id, {
+                "username": username, "first_name": first_name,
+                "last_name": last_name, "last_activity": now
+            })
+        return await storage.insert_user({
+            "chat_id": chat_id, "username": username, "first_name": first_name,
+            "last_name": last_name, "created_at": now, "last_activity": now
+        })
+
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+
+    results = {}
+    for name, implementation in (("before", legacy_create_or_get_user), ("after", original)):
+        storage = InMemoryStorage(latency=args.latency)
+        set_storage(storage)
+        context.create_or_get_user = implementation
+        errors.count = 0
+        latencies = await run(start.start_command, args.requests, args.users, args.concurrency)
+        results[name] = (latencies, storage.roundtrips, errors.count // 2)
+
+    context.create_or_get_user = original
+
+    print(f"requests={args.requests} users={args.users} concurrency={args.concurrency} "
+          f"latency={args.latency * 1000:.0f}ms")
+    for name, (latencies, roundtrips, failed) in results.items():
+        print(f"{name:6s} p50={percentile(latencies, 0.5) * 1000:6.1f}ms "
+              f"p99={percentile(latencies, 0.99) * 1000:6.1f}ms "
+              f"mean={statistics.mean(latencies) * 1000:6.1f}ms "
+              f"roundtrips={roundtrips} failed={failed}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест webhook-режима
+
+Поднимает бота в отдельном процессе (webhook-сервер, InMemoryStorage
+с задержкой на каждое обращение к хранилищу), заглушку Bot API в потоке
+и отправляет синтетические апдейты /start с заданной параллельностью.
+
+Сравниваются режимы обработчика:
+inline   - ответ Telegram после завершения хендлера
+fast-ack - ответ сразу, хендлер выполняется в фоне (режим бота по умолчанию)
+sharded  - супервизор и --workers процессов-обработчиков (WORKERS > 1)
+
+ack/s       - сколько апдейтов в секунду принимает процесс
+processed/s - сколько апдейтов в секунду полностью обрабатывается
+              (по числу sendMessage в заглушке Bot API)
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECRET = "bench-secret"
+PATH = "/webhook"
+
+
+class _BotApiStub(BaseHTTPRequestHandler):
+    """
+    Отвечает на sendMessage успешным результатом и считает вызовы
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    lock = threading.Lock()
+    sent = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.endswith("/sendMessage"):
+            with self.lock:
+                _BotApiStub.sent += 1
+            result = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "ok"}
+        else:
+            result = True
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_bot_api_stub() -> ThreadingHTTPServer:
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _BotApiStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(port: int, api_url: str, background: bool, latency: float):
+    """
+    Процесс бота: webhook-сервер с настоящими роутерами и middleware
+    """
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ["STORAGE_BACKEND"] = "memory"
+
+    import logging
+    from aiohttp import web
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+
+    from bot import create_dispatcher
+    from storage.memory_storage import InMemoryStorage
+    from utils.database import set_storage
+    from utils.webhook import create_webhook_app
+
+    # bot.py настраивает логирование на INFO, для замера оставляем только предупреждения
+    logging.getLogger().setLevel(logging.WARNING)
+    set_storage(InMemoryStorage(latency=latency))
+
+    bot = Bot(
+        token=os.environ["BOT_TOKEN"],
+        session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    app = create_webhook_app(create_dispatcher(), bot, PATH, SECRET, handle_in_background=background)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def _bench_worker_init(latency: float):
+    import logging
+    import bot  # noqa: F401 - настраивает логирование на INFO
+    from storage.memory_storage import InMemoryStorage
+    from utils.database import set_storage
+
+    logging.getLogger().setLevel(logging.WARNING)
+    set_storage(InMemoryStorage(latency=latency))
+
+
+def serve_sharded(port: int, api_url: str, workers: int, latency: float):
+    """
+    Процесс супервизора: прием webhook и workers процессов-обработчиков
+    """
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["TELEGRAM_API_URL"] = api_url
+
+    import functools
+    import logging
+    from aiohttp import web
+
+    from utils.workers import Supervisor, create_ingress_app
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def app_factory():
+        supervisor = Supervisor(workers, initializer=functools.partial(_bench_worker_init, latency))
+        await supervisor.start()
+        app = create_ingress_app(supervisor, PATH, SECRET)
+
+        async def stop(app):
+            await supervisor.stop()
+
+        app.on_cleanup.append(stop)
+        return app
+
+    web.run_app(app_factory(), host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def make_update(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}]
+        }
+    }
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def wait_ready(session, base: str):
+    for _ in range(600):
+        try:
+            async with session.get(f"{base}/health") as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError("webhook-сервер не запустился")
+
+
+async def load(base: str, requests: int, users: int, concurrency: int) -> dict:
+    import aiohttp
+
+    latencies = []
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    queue = asyncio.Queue()
+    for update_id in range(1, requests + 1):
+        queue.put_nowait(make_update(update_id, 1000 + update_id % users))
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_ready(session, base)
+
+        async with session.post(base + PATH, json=make_update(0, 1),
+                                headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+            assert response.status == 401, "апдейт с неверным секретом должен отклоняться"
+
+        sent_before = _BotApiStub.sent
+
+        async def worker():
+            while not queue.empty():
+                update = queue.get_nowait()
+                started = time.perf_counter()
+                async with session.post(base + PATH, json=update, headers=headers) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        acked = time.perf_counter() - started
+
+        while _BotApiStub.sent - sent_before < requests and time.perf_counter() - started < 120:
+            await asyncio.sleep(0.01)
+        processed = time.perf_counter() - started
+
+    return {
+        "ack_rate": requests / acked,
+        "processed_rate": (_BotApiStub.sent - sent_before) / processed,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "mean": statistics.mean(latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка хранилища, сек")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="процессов-обработчиков в режиме sharded")
+    args = parser.parse_args()
+
+    api = start_bot_api_stub()
+    api_url = f"http://127.0.0.1:{api.server_address[1]}"
+
+    print(f"requests={args.requests} users={args.users} concurrency={args.concurrency} "
+          f"latency={args.latency * 1000:.0f}ms workers={args.workers}")
+
+    modes = (
+        ("inline", serve, (False, args.latency)),
+        ("fast-ack", serve, (True, args.latency)),
+        ("sharded", serve_sharded, (args.workers, args.latency)),
+    )
+    for name, target, options in modes:
+        port = free_port()
+        process = multiprocessing.Process(target=target, args=(port, api_url, *options))
+        process.start()
+        try:
+            result = asyncio.run(load(f"http://127.0.0.1:{port}", args.requests, args.users, args.concurrency))
+        finally:
+            process.terminate()
+            process.join()
+
+        print(f"{name:8s} ack/s={result['ack_rate']:7.1f} processed/s={result['processed_rate']:7.1f} "
+              f"ack p50={result['p50'] * 1000:6.1f}ms p99={result['p99'] * 1000:6.1f}ms")
+
+    api.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,13 +8,28 @@ import logging
 import os
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import Config
+from config import Config, config
+from fsm import ExpiringMemoryStorage, create_fsm_storage
 from handlers import start, payments, menu
-from utils.database import init_database
+from middlewares import (
+    EarlyCallbackAnswerMiddleware, HandlerMetricsMiddleware, TelegramApiMetrics, ThrottlingMiddleware,
+    UserContextMiddleware
+)
+from models.subscription import subscription_cache
+from models.user import activity_buffer, blocked_buffer
+from utils.database import init_database, close_storage, read_flight, run_subscription_cleanup
+from utils.leader import create_leader_elector
+from utils.metrics import (
+    fsm_bytes, fsm_states, singleflight_calls, singleflight_collapsed, start_metrics_server,
+    subscription_cache_hits, subscription_cache_misses, throttle_buckets
+)
 from utils.notifications import start_notification_scheduler
+from utils.telegram_session import TracedAiohttpSession
+from utils.webhook import run_webhook
+from utils.workers import run_supervisor
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,6 +38,113 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Фоновые задачи процесса (останавливаются в stop_services)
+background_tasks = []
+
+
+def create_dispatcher() -> Dispatcher:
+    """
+    Диспетчер с middleware и роутерами (общий для polling и webhook)
+    """
+    # Создание диспетчера с хранилищем состояний
+    fsm_storage = create_fsm_storage(config)
+    dp = Dispatcher(storage=fsm_storage)
+    if isinstance(fsm_storage, ExpiringMemoryStorage):
+        fsm_states.collect = lambda: [((), len(fsm_storage))]
+        fsm_bytes.collect = lambda: [((), fsm_storage.live_bytes)]
+    
+    subscription_cache_hits.collect = lambda: [((), subscription_cache.hits)]
+    subscription_cache_misses.collect = lambda: [((), subscription_cache.misses)]
+    singleflight_calls.collect = lambda: [((), read_flight.calls)]
+    singleflight_collapsed.collect = lambda: [((), read_flight.collapsed)]
+    
+    # Анти-флуд раньше контекста пользователя: ограниченный запрос не обращается к БД
+    throttling_middleware = ThrottlingMiddleware(config.THROTTLE_LIMITS)
+    dp.message.outer_middleware(throttling_middleware)
+    dp.callback_query.outer_middleware(throttling_middleware)
+    throttle_buckets.collect = lambda: [((), len(throttling_middleware))]
+    
+    # Контекст пользователя (строка пользователя и подписка) на каждый апдейт
+    user_context_middleware = UserContextMiddleware()
+    dp.message.outer_middleware(user_context_middleware)
+    dp.callback_query.outer_middleware(user_context_middleware)
+    
+    # Ответ на колбэк сразу, параллельно с работой хендлера
+    dp.callback_query.middleware(EarlyCallbackAnswerMiddleware())
+    
+    # Время и ошибки хендлеров для /metrics
+    metrics_middleware = HandlerMetricsMiddleware()
+    dp.message.middleware(metrics_middleware)
+    dp.callback_query.middleware(metrics_middleware)
+    dp.pre_checkout_query.middleware(metrics_middleware)
+    
+    # Регистрация роутеров
+    dp.include_router(start.router)
+    dp.include_router(payments.router)
+    dp.include_router(menu.router)
+    
+    return dp
+
+
+def create_bot() -> Bot:
+    """
+    Экземпляр бота (TELEGRAM_API_URL - свой сервер Bot API)
+    """
+    session_options = {}
+    if config.TELEGRAM_API_URL:
+        session_options["api"] = TelegramAPIServer.from_base(config.TELEGRAM_API_URL)
+    session = TracedAiohttpSession(
+        limit=config.TELEGRAM_POOL_SIZE,
+        keepalive_timeout=config.TELEGRAM_KEEPALIVE,
+        dns_cache_ttl=config.TELEGRAM_DNS_CACHE_TTL,
+        slow_call_threshold=config.TELEGRAM_SLOW_CALL,
+        **session_options
+    )
+    bot = Bot(
+        token=config.BOT_TOKEN,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    # Время вызовов Bot API для /metrics
+    bot.session.middleware(TelegramApiMetrics())
+    return bot
+
+
+async def start_services(bot: Bot, background: bool = True):
+    """
+    Подключение к БД, буферы отложенной записи и фоновые задачи
+    """
+    # Инициализация базы данных
+    await init_database()
+    
+    # Запуск отложенной записи last_activity и блокировок
+    activity_buffer.start()
+    blocked_buffer.start()
+    
+    # Планировщик уведомлений и очистка подписок - только на реплике-лидере
+    if background:
+        elector = create_leader_elector("background_jobs", jobs=[
+            lambda: start_notification_scheduler(bot),
+            run_subscription_cleanup
+        ])
+        background_tasks.append(asyncio.create_task(elector.run()))
+
+
+async def stop_services(bot: Bot):
+    """
+    Дописывает накопленные записи и закрывает соединения
+    """
+    # Остановка фоновых задач освобождает аренду лидера
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    
+    await activity_buffer.stop()
+    await blocked_buffer.stop()
+    await close_storage()
+    await bot.session.close()
+
 
 async def main():
     """
@@ -32,34 +154,52 @@ async def main():
     config = Config()
     
     # Создание экземпляра бота
-    bot = Bot(
-        token=config.BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
+    bot = create_bot()
     
-    # Создание диспетчера с хранилищем состояний
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = create_dispatcher()
     
-    # Инициализация базы данных
-    await init_database()
+    if config.WORKERS > 1:
+        # Прием апдейтов в этом процессе, обработка - в config.WORKERS процессах
+        logger.info(f"Бот запущен в режиме супервизора: {config.WORKERS} процессов")
+        try:
+            await run_supervisor(bot, config, allowed_updates=dp.resolve_used_update_types())
+        except Exception as e:
+            logger.error(f"Ошибка при запуске бота: {e}")
+        finally:
+            await bot.session.close()
+        return
     
-    # Регистрация роутеров
-    dp.include_router(start.router)
-    dp.include_router(payments.router)
-    dp.include_router(menu.router)
+    await start_services(bot)
     
-    # Запуск планировщика уведомлений
-    asyncio.create_task(start_notification_scheduler(bot))
+    metrics_runner = None
+    if config.METRICS_PORT:
+        metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
     
     logger.info("Бот запущен успешно!")
     
     try:
-        # Запуск бота
-        await dp.start_polling(bot)
+        if config.RUN_MODE == "webhook":
+            await run_webhook(
+                dp, bot,
+                url=config.WEBHOOK_URL,
+                path=config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET,
+                host=config.WEBHOOK_HOST,
+                port=config.WEBHOOK_PORT,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+        else:
+            # После работы в режиме webhook Telegram не отдает апдейты через
+            # getUpdates, пока webhook не снят. Накопленные апдейты сохраняются
+            await bot.delete_webhook(drop_pending_updates=False)
+            await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
-        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        # Дописываем накопленные записи перед остановкой
+        await stop_services(bot)
 
 
 if __name__ == "__main__":
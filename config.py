@@ -4,7 +4,7 @@
 """
 
 import os
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from dotenv import load_dotenv
 
 # Загружаем переменные из .env файла
@@ -22,12 +22,117 @@ class Config:
         if not self.BOT_TOKEN:
             raise ValueError("BOT_TOKEN не найден в переменных окружения")
         
+        # Хранилище данных: supabase, postgres (asyncpg напрямую) или memory (без сети)
+        self.STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "supabase").lower()
+        if self.STORAGE_BACKEND not in ("supabase", "postgres", "memory"):
+            raise ValueError(f"Неизвестный STORAGE_BACKEND: {self.STORAGE_BACKEND}")
+        
         # Настройки Supabase
         self.SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
         self.SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
-        if not self.SUPABASE_URL or not self.SUPABASE_KEY:
+        if self.STORAGE_BACKEND == "supabase" and (not self.SUPABASE_URL or not self.SUPABASE_KEY):
             raise ValueError("SUPABASE_URL или SUPABASE_KEY не найдены в переменных окружения")
         
+        # Прямое подключение к PostgreSQL (для STORAGE_BACKEND=postgres)
+        self.DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+        if self.STORAGE_BACKEND == "postgres" and not self.DATABASE_URL:
+            raise ValueError("DATABASE_URL не найден в переменных окружения")
+        self.DATABASE_POOL_MIN_SIZE: int = int(os.getenv("DATABASE_POOL_MIN_SIZE", "2"))
+        self.DATABASE_POOL_MAX_SIZE: int = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+        # 0 - для pgbouncer в режиме transaction (пулер Supabase)
+        self.DATABASE_STATEMENT_CACHE_SIZE: int = int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", "100"))
+        
+        # Хранилище состояний FSM: memory (теряется при перезапуске), redis или sqlite
+        self.FSM_STORAGE: str = os.getenv("FSM_STORAGE", "memory").lower()
+        if self.FSM_STORAGE not in ("memory", "redis", "sqlite"):
+            raise ValueError(f"Неизвестный FSM_STORAGE: {self.FSM_STORAGE}")
+        self.FSM_REDIS_URL: str = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+        self.FSM_SQLITE_PATH: str = os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3")
+        # Состояние без изменений дольше N секунд удаляется
+        self.FSM_STATE_TTL: float = float(os.getenv("FSM_STATE_TTL", "86400"))
+        # Время жизни отдельных состояний (для FSM_STORAGE=memory): "состояние=секунды,..."
+        # Брошенная оплата удаляется через час, сама оплата определяется по payload счета
+        self.FSM_STATE_TTLS: Dict[str, float] = {
+            state.strip(): float(ttl)
+            for state, ttl in (
+                item.rsplit("=", 1)
+                for item in os.getenv("FSM_STATE_TTLS", "PaymentStates:waiting_for_payment=3600").split(",")
+                if item.strip()
+            )
+        }
+        # Как часто удалять истекшие состояния из памяти, сек
+        self.FSM_SWEEP_INTERVAL: float = float(os.getenv("FSM_SWEEP_INTERVAL", "60"))
+        
+        # Анти-флуд: "префикс=запросов/секунд,...", префикс сравнивается с callback_data
+        # или командой (побеждает самый длинный), * - для остальных колбэков и сообщений
+        self.THROTTLE_LIMITS: Dict[str, Tuple[float, float]] = {
+            prefix.strip(): (float(limit.split("/")[0]), float(limit.split("/")[1]))
+            for prefix, limit in (
+                item.rsplit("=", 1)
+                for item in os.getenv(
+                    "THROTTLE_LIMITS", "buy_=3/10,connect_vpn=3/10,main_menu=5/5,*=10/5"
+                ).split(",")
+                if item.strip()
+            )
+        }
+        
+        # Режим получения апдейтов: polling (long polling) или webhook (встроенный aiohttp-сервер)
+        self.RUN_MODE: str = os.getenv("RUN_MODE", "polling").lower()
+        if self.RUN_MODE not in ("polling", "webhook"):
+            raise ValueError(f"Неизвестный RUN_MODE: {self.RUN_MODE}")
+        
+        # Настройки webhook (для RUN_MODE=webhook)
+        self.WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")  # Публичный адрес, например https://bot.example.com
+        self.WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+        self.WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+        self.WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+        self.WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+        if self.RUN_MODE == "webhook" and (not self.WEBHOOK_URL or not self.WEBHOOK_SECRET):
+            raise ValueError("Для RUN_MODE=webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+        
+        # Число процессов-обработчиков. Больше 1 - режим супервизора: один процесс
+        # принимает апдейты и распределяет их по процессам по id пользователя
+        self.WORKERS: int = int(os.getenv("WORKERS", "1"))
+        # Порт /health супервизора в режиме polling (0 - не поднимать)
+        self.HEALTH_PORT: int = int(os.getenv("HEALTH_PORT", "0"))
+        
+        # Выбор лидера для фоновых задач (уведомления, очистка подписок) среди реплик:
+        # время аренды и период ее продления, сек
+        self.LEADER_LEASE_TTL: float = float(os.getenv("LEADER_LEASE_TTL", "15"))
+        self.LEADER_RENEW_INTERVAL: float = float(os.getenv("LEADER_RENEW_INTERVAL", "5"))
+        
+        # Сервер метрик Prometheus (GET /metrics), 0 - не поднимать
+        self.METRICS_HOST: str = os.getenv("METRICS_HOST", "0.0.0.0")
+        self.METRICS_PORT: int = int(os.getenv("METRICS_PORT", "0"))
+        
+        # Сессия Bot API: размер пула соединений, сколько держать простаивающее
+        # соединение (сек), время кэша DNS (сек) и порог записи медленного вызова в лог (сек)
+        self.TELEGRAM_POOL_SIZE: int = int(os.getenv("TELEGRAM_POOL_SIZE", "100"))
+        self.TELEGRAM_KEEPALIVE: float = float(os.getenv("TELEGRAM_KEEPALIVE", "60"))
+        self.TELEGRAM_DNS_CACHE_TTL: int = int(os.getenv("TELEGRAM_DNS_CACHE_TTL", "300"))
+        self.TELEGRAM_SLOW_CALL: float = float(os.getenv("TELEGRAM_SLOW_CALL", "1.0"))
+        
+        # Свой сервер Bot API (по умолчанию api.telegram.org)
+        self.TELEGRAM_API_URL: str = os.getenv("TELEGRAM_API_URL", "")
+        
+        # Отложенная запись last_activity: сброс раз в N секунд или по M пользователям
+        self.ACTIVITY_FLUSH_INTERVAL: float = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))
+        self.ACTIVITY_FLUSH_SIZE: int = int(os.getenv("ACTIVITY_FLUSH_SIZE", "500"))
+        
+        # Кэш активных подписок (LRU с TTL)
+        self.SUBSCRIPTION_CACHE_SIZE: int = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "10000"))
+        self.SUBSCRIPTION_CACHE_TTL: float = float(os.getenv("SUBSCRIPTION_CACHE_TTL", "60"))
+        
+        # Как часто планировщик истечения перечитывает подписки из БД, сек:
+        # изменения из других процессов и реплик он видит с этой задержкой
+        self.EXPIRY_RESYNC_INTERVAL: float = float(os.getenv("EXPIRY_RESYNC_INTERVAL", "900"))
+        
+        # Массовые рассылки: общий лимит сообщений в секунду, пауза между
+        # сообщениями в один чат и число параллельных отправок
+        self.BROADCAST_RATE: float = float(os.getenv("BROADCAST_RATE", "30"))
+        self.BROADCAST_PER_CHAT_INTERVAL: float = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1"))
+        self.BROADCAST_WORKERS: int = int(os.getenv("BROADCAST_WORKERS", "16"))
+        
         # Токен для Telegram Payments (опционально - для Stars не нужен)
         self.PAYMENT_TOKEN: str = os.getenv("PAYMENT_TOKEN", "")
         
@@ -55,6 +160,8 @@ class Config:
         
         # Реферальные награды
         self.REFERRAL_REWARD_RUBLES = 100  # 100 рублей за каждого приглашенного
+        # Автоматическое начисление наград раз в 12 часов (по умолчанию выключено)
+        self.REFERRAL_AUTO_SETTLE: bool = os.getenv("REFERRAL_AUTO_SETTLE", "false").lower() == "true"
         
         # URL сайта
         self.WEBSITE_URL: str = os.getenv("WEBSITE_URL", "https://youvpn.com")
@@ -54,6 +54,29 @@ CREATE TABLE IF NOT EXISTS referrals (
     UNIQUE(referrer_id, referred_id)
 );
 
+-- Служебное состояние бота (ключ-значение), например позиция планировщика уведомлений
+CREATE TABLE IF NOT EXISTS bot_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Журнал отправленных уведомлений: каждое уведомление о подписке отправляется один раз
+CREATE TABLE IF NOT EXISTS notification_log (
+    user_id BIGINT NOT NULL,
+    subscription_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    sent_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (user_id, subscription_id, kind)
+);
+
+-- Аренды для выбора лидера: фоновые задачи выполняет только держатель аренды
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
 -- Индексы для оптимизации
 CREATE INDEX IF NOT EXISTS idx_users_chat_id ON users(chat_id);
 CREATE INDEX IF NOT EXISTS idx_subscriptions_user_id ON subscriptions(user_id);
@@ -61,14 +84,237 @@ CREATE INDEX IF NOT EXISTS idx_subscriptions_active ON subscriptions(is_active,
 CREATE INDEX IF NOT EXISTS idx_payments_user_id ON payments(user_id);
 CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_id);
 
+-- Keyset-пагинация потоковых выборок (iter_expiring_subscriptions,
+-- iter_subscriptions_created_after, iter_payments_by_period)
+CREATE INDEX IF NOT EXISTS idx_subscriptions_active_expire ON subscriptions(expire_at, id) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_subscriptions_active_created ON subscriptions(created_at, id) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_payments_completed_created ON payments(created_at, id) WHERE status = 'completed';
+
+-- Не более одной активной подписки на пользователя.
+-- На существующей БД сначала оставляем активной только последнюю подписку
+UPDATE subscriptions s SET is_active = FALSE
+WHERE s.is_active AND EXISTS (
+    SELECT 1 FROM subscriptions n
+    WHERE n.user_id = s.user_id AND n.is_active AND n.id > s.id
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_subscriptions_one_active ON subscriptions(user_id) WHERE is_active;
+
+-- Атомарная активация подписки: деактивация текущей и вставка новой в одной транзакции.
+-- p_days - продлить от текущего expire_at (или от NOW(), если подписки нет или она истекла),
+-- p_expire_at - установить дату окончания явно.
+-- p_subscription_type NULL - сохранить тип текущей подписки
+CREATE OR REPLACE FUNCTION activate_subscription(
+    p_user_id BIGINT,
+    p_subscription_type TEXT DEFAULT NULL,
+    p_days INTEGER DEFAULT NULL,
+    p_expire_at TIMESTAMPTZ DEFAULT NULL
+)
+RETURNS SETOF subscriptions
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_current subscriptions%ROWTYPE;
+    v_expire_at TIMESTAMPTZ;
+BEGIN
+    -- Параллельные активации одного пользователя выполняются по очереди
+    PERFORM pg_advisory_xact_lock(p_user_id);
+
+    SELECT * INTO v_current FROM subscriptions WHERE user_id = p_user_id AND is_active;
+
+    IF p_days IS NOT NULL THEN
+        v_expire_at := GREATEST(NOW(), COALESCE(v_current.expire_at, NOW())) + make_interval(days => p_days);
+    ELSE
+        v_expire_at := p_expire_at;
+    END IF;
+
+    UPDATE subscriptions SET is_active = FALSE WHERE user_id = p_user_id AND is_active;
+
+    RETURN QUERY
+    INSERT INTO subscriptions (user_id, subscription_type, expire_at, is_active)
+    VALUES (p_user_id, COALESCE(p_subscription_type, v_current.subscription_type, 'premium'), v_expire_at, TRUE)
+    RETURNING *;
+END;
+$$;
+
+-- Реферальный учет. Таблица referrals - журнал приглашений: строка создается один раз
+-- при регистрации по ссылке, награда фиксируется в ней же (reward_amount, is_paid).
+-- Счетчики users.invited_count и users.referral_balance меняются только атомарно на стороне БД
+CREATE INDEX IF NOT EXISTS idx_referrals_unpaid ON referrals(id) WHERE NOT is_paid;
+
+-- Регистрация приглашения: привязка к рефереру, запись в журнал и +1 к invited_count.
+-- Возвращает пустой результат, если пользователь уже был приглашен или пригласил сам себя
+CREATE OR REPLACE FUNCTION register_referral(p_referrer_id BIGINT, p_referred_id BIGINT)
+RETURNS SETOF referrals
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE users SET referred_by = p_referrer_id
+    WHERE chat_id = p_referred_id AND referred_by IS NULL AND chat_id <> p_referrer_id;
+
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    UPDATE users SET invited_count = invited_count + 1 WHERE chat_id = p_referrer_id;
+
+    RETURN QUERY
+    INSERT INTO referrals (referrer_id, referred_id)
+    VALUES (p_referrer_id, p_referred_id)
+    ON CONFLICT (referrer_id, referred_id) DO NOTHING
+    RETURNING *;
+END;
+$$;
+
+-- Атомарное начисление на реферальный баланс, возвращает новый баланс
+CREATE OR REPLACE FUNCTION add_referral_reward(p_chat_id BIGINT, p_amount NUMERIC)
+RETURNS NUMERIC
+LANGUAGE sql
+AS $$
+    UPDATE users SET referral_balance = referral_balance + p_amount
+    WHERE chat_id = p_chat_id
+    RETURNING referral_balance;
+$$;
+
+-- Пакетное начисление наград одним запросом: приглашения, по которым у друга есть завершенный платеж,
+-- помечаются оплаченными, а суммы по каждому рефереру добавляются к его балансу.
+-- Возвращает начисленные награды (для уведомлений)
+CREATE OR REPLACE FUNCTION settle_referral_rewards(p_amount NUMERIC, p_limit INTEGER DEFAULT 1000)
+RETURNS TABLE (referrer_id BIGINT, referred_id BIGINT, reward_amount NUMERIC, referred_first_name TEXT)
+LANGUAGE sql
+AS $$
+    WITH due AS (
+        SELECT r.id FROM referrals r
+        WHERE NOT r.is_paid
+          AND EXISTS (
+              SELECT 1 FROM payments p
+              WHERE p.user_id = r.referred_id AND p.status = 'completed'
+          )
+        ORDER BY r.id
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ), paid AS (
+        UPDATE referrals r SET reward_amount = p_amount, is_paid = TRUE
+        FROM due
+        WHERE r.id = due.id
+        RETURNING r.referrer_id, r.referred_id, r.reward_amount
+    ), credited AS (
+        UPDATE users u SET referral_balance = u.referral_balance + t.total
+        FROM (SELECT paid.referrer_id, SUM(paid.reward_amount) AS total FROM paid GROUP BY paid.referrer_id) t
+        WHERE u.chat_id = t.referrer_id
+    )
+    SELECT paid.referrer_id, paid.referred_id, paid.reward_amount, u.first_name
+    FROM paid
+    LEFT JOIN users u ON u.chat_id = paid.referred_id;
+$$;
+
+-- Дневные итоги выручки по валютам. Обновляются триггером при каждой вставке
+-- завершенного платежа, поэтому отчеты по выручке не читают таблицу payments
+CREATE TABLE IF NOT EXISTS revenue_daily (
+    day DATE NOT NULL,
+    currency TEXT NOT NULL,
+    amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+    payments_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, currency)
+);
+
+CREATE OR REPLACE FUNCTION revenue_daily_on_payment()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.status = 'completed' THEN
+        INSERT INTO revenue_daily (day, currency, amount, payments_count)
+        VALUES ((NEW.created_at AT TIME ZONE 'UTC')::date, NEW.currency, NEW.amount, 1)
+        ON CONFLICT (day, currency) DO UPDATE
+        SET amount = revenue_daily.amount + EXCLUDED.amount,
+            payments_count = revenue_daily.payments_count + 1;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS payments_revenue_daily ON payments;
+CREATE TRIGGER payments_revenue_daily
+AFTER INSERT ON payments
+FOR EACH ROW EXECUTE FUNCTION revenue_daily_on_payment();
+
+-- Полный пересчет дневных итогов по таблице payments
+-- (после ручных правок платежей или при первом развертывании). Возвращает число строк
+CREATE OR REPLACE FUNCTION rebuild_revenue_daily()
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_rows INTEGER;
+BEGIN
+    LOCK TABLE revenue_daily IN EXCLUSIVE MODE;
+    DELETE FROM revenue_daily;
+
+    INSERT INTO revenue_daily (day, currency, amount, payments_count)
+    SELECT (created_at AT TIME ZONE 'UTC')::date, currency, SUM(amount), COUNT(*)
+    FROM payments
+    WHERE status = 'completed'
+    GROUP BY 1, 2;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION get_total_revenue()
+RETURNS NUMERIC
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(SUM(amount), 0) FROM revenue_daily;
+$$;
+
+-- Пакетное обновление last_activity (буфер отложенной записи)
+CREATE OR REPLACE FUNCTION touch_users(p_chat_ids BIGINT[], p_seen_at TIMESTAMPTZ[])
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE users u SET last_activity = t.seen_at
+    FROM unnest(p_chat_ids, p_seen_at) AS t(chat_id, seen_at)
+    WHERE u.chat_id = t.chat_id;
+$$;
+
+-- Захват или продление аренды: удается, если аренда свободна, истекла
+-- или уже принадлежит p_holder. Время - по часам БД
+CREATE OR REPLACE FUNCTION acquire_lease(p_name TEXT, p_holder TEXT, p_ttl_seconds DOUBLE PRECISION)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_holder TEXT;
+BEGIN
+    INSERT INTO leases (name, holder, expires_at)
+    VALUES (p_name, p_holder, NOW() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (name) DO UPDATE
+        SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+        WHERE leases.holder = EXCLUDED.holder OR leases.expires_at < NOW()
+    RETURNING holder INTO v_holder;
+
+    RETURN v_holder IS NOT NULL;
+END;
+$$;
+
 -- RLS (Row Level Security) политики для безопасности
 ALTER TABLE users ENABLE ROW LEVEL SECURITY;
 ALTER TABLE subscriptions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE payments ENABLE ROW LEVEL SECURITY;
 ALTER TABLE referrals ENABLE ROW LEVEL SECURITY;
+ALTER TABLE revenue_daily ENABLE ROW LEVEL SECURITY;
+ALTER TABLE bot_state ENABLE ROW LEVEL SECURITY;
+ALTER TABLE notification_log ENABLE ROW LEVEL SECURITY;
+ALTER TABLE leases ENABLE ROW LEVEL SECURITY;
 
 -- Политики доступа (можно настроить по необходимости)
 CREATE POLICY "Allow service role access" ON users FOR ALL USING (true);
 CREATE POLICY "Allow service role access" ON subscriptions FOR ALL USING (true);
 CREATE POLICY "Allow service role access" ON payments FOR ALL USING (true);
-CREATE POLICY "Allow service role access" ON referrals FOR ALL USING (true);
\ No newline at end of file
+CREATE POLICY "Allow service role access" ON referrals FOR ALL USING (true);
+CREATE POLICY "Allow service role access" ON revenue_daily FOR ALL USING (true);
+CREATE POLICY "Allow service role access" ON bot_state FOR ALL USING (true);
+CREATE POLICY "Allow service role access" ON notification_log FOR ALL USING (true);
+CREATE POLICY "Allow service role access" ON leases FOR ALL USING (true);
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""
+Хранилища состояний FSM (aiogram)
+"""
+
+from aiogram.fsm.storage.base import BaseStorage
+
+from .base import PipelinedStorage
+from .memory_storage import ExpiringMemoryStorage
+
+__all__ = ['ExpiringMemoryStorage', 'PipelinedStorage', 'create_fsm_storage']
+
+
+def create_fsm_storage(config) -> BaseStorage:
+    """
+    Создает хранилище состояний согласно config.FSM_STORAGE
+    """
+    if config.FSM_STORAGE == "redis":
+        from .redis_storage import RedisFSMStorage
+        return RedisFSMStorage.from_url(config.FSM_REDIS_URL, state_ttl=config.FSM_STATE_TTL)
+
+    if config.FSM_STORAGE == "sqlite":
+        from .sqlite_storage import SQLiteFSMStorage
+        return SQLiteFSMStorage(config.FSM_SQLITE_PATH, state_ttl=config.FSM_STATE_TTL)
+
+    return ExpiringMemoryStorage(
+        default_ttl=config.FSM_STATE_TTL,
+        state_ttls=config.FSM_STATE_TTLS,
+        sweep_interval=config.FSM_SWEEP_INTERVAL
+    )
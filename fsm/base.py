@@ -0,0 +1,83 @@
+"""
+Общая основа хранилищ состояний FSM
+"""
+
+import asyncio
+import logging
+from abc import abstractmethod
+from typing import Any, List, Optional, Sequence, Tuple
+
+from aiogram.fsm.storage.base import BaseStorage
+
+logger = logging.getLogger(__name__)
+
+
+class PipelinedStorage(BaseStorage):
+    """
+    Хранилище FSM, которое объединяет операции в пачки
+
+    Операции, поступившие, пока предыдущая пачка выполняется, копятся
+    и уходят следующей пачкой за одно обращение к бэкенду (один round-trip
+    в Redis, одна транзакция в SQLite). В каждый момент выполняется
+    не больше одной пачки, поэтому порядок операций сохраняется
+    """
+
+    def __init__(self, state_ttl: Optional[float] = None, max_batch: int = 256):
+        # Через сколько секунд без записи состояние удаляется (None - не удалять)
+        self.state_ttl = state_ttl
+        self.max_batch = max_batch
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+        # Статистика
+        self.operations = 0
+        self.batches = 0
+
+    @abstractmethod
+    async def _execute(self, operations: Sequence[Any]) -> List[Any]:
+        """
+        Выполняет пачку операций за одно обращение и возвращает
+        результаты в том же порядке
+        """
+
+    async def _submit(self, operation: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, future))
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                self.operations += len(batch)
+                self.batches += 1
+
+                try:
+                    results = await self._execute([operation for operation, _ in batch])
+                except asyncio.CancelledError:
+                    for _, future in batch + self._pending:
+                        future.cancel()
+                    self._pending.clear()
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка хранилища FSM ({len(batch)} операций): {e}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._flusher = None
+
+    async def _drain(self):
+        """
+        Дожидается выполнения уже принятых операций
+        """
+        while self._flusher is not None:
+            await asyncio.shield(self._flusher)
@@ -0,0 +1,174 @@
+"""
+Хранилище состояний FSM в памяти с удалением брошенных состояний
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import time
+from copy import copy
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    expire_at: float = 0.0
+    size: int = 0
+
+
+def _record_size(state: Optional[str], data: Dict[str, Any]) -> int:
+    size = len(state) if state else 0
+    if data:
+        size += len(json.dumps(data, ensure_ascii=False, default=str).encode())
+    return size
+
+
+class ExpiringMemoryStorage(BaseStorage):
+    """
+    Замена MemoryStorage, в которой состояние живет ограниченное время
+
+    Время жизни отсчитывается от последней записи и зависит от состояния
+    (state_ttls, например короткое для PaymentStates:waiting_for_payment),
+    для остальных - default_ttl. Чтение истекшего состояния возвращает
+    пустой результат, а фоновая задача раз в sweep_interval секунд
+    удаляет истекшие записи по мин-куче времен истечения.
+    В отличие от MemoryStorage, чтение не создает пустых записей,
+    а записи без состояния и данных удаляются сразу
+    """
+
+    def __init__(self, default_ttl: float = 24 * 60 * 60,
+                 state_ttls: Optional[Mapping[str, float]] = None,
+                 sweep_interval: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.default_ttl = default_ttl
+        self.state_ttls = dict(state_ttls or {})
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._records: Dict[StorageKey, _Record] = {}
+        # (время истечения, порядковый номер, ключ); устаревшие элементы
+        # отбрасываются при извлечении
+        self._heap: List[Tuple[float, int, StorageKey]] = []
+        self._seq = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+        # Счетчики для gauge: число живых состояний и их размер в байтах
+        self.live_bytes = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def ttl_for(self, state: Optional[str]) -> float:
+        """
+        Время жизни записи в указанном состоянии
+        """
+        return self.state_ttls.get(state, self.default_ttl) if state else self.default_ttl
+
+    def _get(self, key: StorageKey) -> Optional[_Record]:
+        record = self._records.get(key)
+        if record is not None and record.expire_at <= self._clock():
+            self._remove(key)
+            self.expired += 1
+            return None
+        return record
+
+    def _remove(self, key: StorageKey):
+        record = self._records.pop(key, None)
+        if record is not None:
+            self.live_bytes -= record.size
+
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        self._remove(key)
+        if state is None and not data:
+            return
+
+        expire_at = self._clock() + self.ttl_for(state)
+        size = _record_size(state, data)
+        self._records[key] = _Record(state=state, data=data, expire_at=expire_at, size=size)
+        self.live_bytes += size
+
+        self._seq += 1
+        heapq.heappush(self._heap, (expire_at, self._seq, key))
+        self._compact()
+        self._ensure_sweeper()
+
+    def _compact(self):
+        # Каждая запись добавляет элемент в кучу: пересобираем ее,
+        # когда устаревших элементов становится больше, чем живых
+        if len(self._heap) > 2 * len(self._records) + 1024:
+            self._heap = [(record.expire_at, seq, key) for seq, (key, record) in enumerate(self._records.items())]
+            heapq.heapify(self._heap)
+
+    def sweep(self) -> int:
+        """
+        Удаляет истекшие записи и возвращает их количество
+        """
+        now = self._clock()
+        removed = 0
+        while self._heap and self._heap[0][0] <= now:
+            expire_at, _, key = heapq.heappop(self._heap)
+            record = self._records.get(key)
+            if record is not None and record.expire_at == expire_at:
+                self._remove(key)
+                removed += 1
+        self.expired += removed
+        self._compact()
+        return removed
+
+    async def _run_sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                logger.info(f"FSM: удалено брошенных состояний {removed}, "
+                            f"активных {len(self._records)} ({self.live_bytes / 1024:.1f} КБ)")
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._run_sweeper())
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает число живых состояний, их размер и число удаленных
+        """
+        return {
+            "states": len(self._records),
+            "bytes": self.live_bytes,
+            "expired": self.expired,
+            "heap": len(self._heap)
+        }
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get(key)
+        state = state.state if isinstance(state, State) else state
+        self._put(key, state, record.data if record is not None else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._get(key)
+        self._put(key, record.state if record is not None else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record is not None else {}
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        record = self._get(storage_key)
+        return copy(record.data.get(dict_key, default)) if record is not None else default
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
@@ -0,0 +1,129 @@
+"""
+Хранилище состояний FSM в Redis (или любом сервере с протоколом Redis)
+"""
+
+import json
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from .base import PipelinedStorage
+
+try:
+    from redis.asyncio import Redis
+except ImportError:  # pragma: no cover - зависимость нужна только для этого бэкенда
+    Redis = None
+
+# Операция: команды Redis и функция, которая собирает результат из их ответов
+RedisOperation = Tuple[List[tuple], Callable[[List[Any]], Any]]
+
+
+def _ignore(replies: List[Any]) -> None:
+    return None
+
+
+def _decode(value: Any) -> Any:
+    return json.loads(value) if value is not None else None
+
+
+def _decode_data(replies: List[Any]) -> Dict[str, Any]:
+    return {
+        (field.decode() if isinstance(field, bytes) else field): json.loads(value)
+        for field, value in (replies[-1] or {}).items()
+    }
+
+
+class RedisFSMStorage(PipelinedStorage):
+    """
+    Состояние хранится строкой <prefix>:...:state, данные - хешем
+    <prefix>:...:data (поле на каждый ключ данных, значение в JSON)
+
+    Благодаря хешу update_data и get_value не читают и не переписывают
+    данные целиком: update_data - это HSET нужных полей, и он не теряет
+    параллельные изменения из других процессов. Каждая запись продлевает
+    TTL обоих ключей, поэтому брошенные состояния удаляет сам Redis.
+    Пачка операций отправляется одним пайплайном (за один round-trip)
+    """
+
+    def __init__(self, redis: "Redis", key_builder: Optional[KeyBuilder] = None,
+                 state_ttl: Optional[float] = None, max_batch: int = 256):
+        super().__init__(state_ttl=state_ttl, max_batch=max_batch)
+        self.redis = redis
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisFSMStorage":
+        """
+        Создает хранилище по адресу redis://host:port/db
+        """
+        if Redis is None:
+            raise RuntimeError("Для FSM_STORAGE=redis установите пакет redis")
+        return cls(Redis.from_url(url), **kwargs)
+
+    def _expire(self, key: StorageKey) -> List[tuple]:
+        if self.state_ttl is None:
+            return []
+        ttl = max(1, int(self.state_ttl))
+        return [
+            ("EXPIRE", self.key_builder.build(key, "state"), ttl),
+            ("EXPIRE", self.key_builder.build(key, "data"), ttl)
+        ]
+
+    async def _execute(self, operations: Sequence[RedisOperation]) -> List[Any]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for commands, _ in operations:
+                for command in commands:
+                    pipe.execute_command(*command)
+            replies = await pipe.execute()
+
+        results = []
+        position = 0
+        for commands, collect in operations:
+            results.append(collect(replies[position:position + len(commands)]))
+            position += len(commands)
+        return results
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state_key = self.key_builder.build(key, "state")
+        if state is None:
+            commands = [("DEL", state_key)]
+        else:
+            state = state.state if isinstance(state, State) else state
+            commands = [("SET", state_key, state)] + self._expire(key)
+        await self._submit((commands, _ignore))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        value = await self._submit(([("GET", self.key_builder.build(key, "state"))], lambda replies: replies[0]))
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        data_key = self.key_builder.build(key, "data")
+        commands = [("DEL", data_key)]
+        if data:
+            fields = [item for field, value in data.items() for item in (field, json.dumps(value))]
+            commands += [("HSET", data_key, *fields)] + self._expire(key)
+        await self._submit((commands, _ignore))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return await self._submit(([("HGETALL", self.key_builder.build(key, "data"))], _decode_data))
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        data_key = self.key_builder.build(key, "data")
+        commands = []
+        if data:
+            fields = [item for field, value in data.items() for item in (field, json.dumps(value))]
+            commands += [("HSET", data_key, *fields)] + self._expire(key)
+        commands.append(("HGETALL", data_key))
+        return await self._submit((commands, _decode_data))
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        value = await self._submit((
+            [("HGET", self.key_builder.build(storage_key, "data"), dict_key)],
+            lambda replies: _decode(replies[0])
+        ))
+        return default if value is None else value
+
+    async def close(self) -> None:
+        await self._drain()
+        await self.redis.aclose()
@@ -0,0 +1,167 @@
+"""
+Хранилище состояний FSM в файле SQLite
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from .base import PipelinedStorage
+
+# Операция: функция, которая выполняется над соединением внутри транзакции пачки
+SQLiteOperation = Callable[[sqlite3.Connection, float], Any]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT,
+    expire_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_states_expire_at ON fsm_states (expire_at);
+"""
+
+
+class SQLiteFSMStorage(PipelinedStorage):
+    """
+    Строка на ключ FSM: состояние, данные в JSON и время истечения
+
+    Запросы выполняются в отдельном потоке, пачка операций - одной
+    транзакцией (BEGIN IMMEDIATE), поэтому update_data атомарен и файл
+    можно разделять между процессами. Истекшие строки не читаются
+    и раз в purge_interval секунд удаляются
+
+    Данные сериализуются в JSON до постановки в очередь: несериализуемые
+    данные отклоняются ошибкой у вызывающего и не откатывают всю пачку
+    """
+
+    def __init__(self, path: str, key_builder: Optional[KeyBuilder] = None,
+                 state_ttl: Optional[float] = None, max_batch: int = 256,
+                 purge_interval: float = 300.0):
+        super().__init__(state_ttl=state_ttl, max_batch=max_batch)
+        self.path = path
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True)
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        # У соединения SQLite один поток-владелец
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._connection: Optional[sqlite3.Connection] = None
+
+        # Статистика
+        self.purged = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _expire_at(self, now: float) -> Optional[float]:
+        return now + self.state_ttl if self.state_ttl is not None else None
+
+    def _run_batch(self, operations: Sequence[SQLiteOperation]) -> List[Any]:
+        if self._connection is None:
+            self._connection = self._connect()
+        connection = self._connection
+        now = time.time()
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            results = [operation(connection, now) for operation in operations]
+            if now - self._purged_at >= self.purge_interval:
+                self.purged += connection.execute(
+                    "DELETE FROM fsm_states WHERE expire_at <= ?", (now,)
+                ).rowcount
+                self._purged_at = now
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return results
+
+    async def _execute(self, operations: Sequence[SQLiteOperation]) -> List[Any]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._run_batch, operations)
+
+    @staticmethod
+    def _read_row(connection: sqlite3.Connection, key: str, now: float) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Состояние и данные в JSON (None, если данных нет)
+        """
+        row = connection.execute(
+            "SELECT state, data FROM fsm_states WHERE key = ? AND (expire_at IS NULL OR expire_at > ?)",
+            (key, now)
+        ).fetchone()
+        return (row[0], row[1]) if row is not None else (None, None)
+
+    @classmethod
+    def _read(cls, connection: sqlite3.Connection, key: str, now: float) -> Tuple[Optional[str], Dict[str, Any]]:
+        state, data = cls._read_row(connection, key, now)
+        return state, json.loads(data) if data else {}
+
+    def _write(self, connection: sqlite3.Connection, key: str, now: float,
+               state: Optional[str], data: Optional[str]):
+        if state is None and data is None:
+            connection.execute("DELETE FROM fsm_states WHERE key = ?", (key,))
+            return
+        connection.execute(
+            "INSERT INTO fsm_states (key, state, data, expire_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+            "expire_at = excluded.expire_at",
+            (key, state, data, self._expire_at(now))
+        )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        storage_key = self.key_builder.build(key)
+
+        def operation(connection: sqlite3.Connection, now: float):
+            _, data = self._read_row(connection, storage_key, now)
+            self._write(connection, storage_key, now, state, data)
+
+        await self._submit(operation)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        storage_key = self.key_builder.build(key)
+        return await self._submit(lambda connection, now: self._read(connection, storage_key, now)[0])
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        payload = json.dumps(data) if data else None
+
+        def operation(connection: sqlite3.Connection, now: float):
+            state, _ = self._read_row(connection, storage_key, now)
+            self._write(connection, storage_key, now, state, payload)
+
+        await self._submit(operation)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        storage_key = self.key_builder.build(key)
+        return await self._submit(lambda connection, now: self._read(connection, storage_key, now)[1])
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        storage_key = self.key_builder.build(key)
+        # Проверка сериализуемости до очереди. Объединенные данные внутри
+        # транзакции состоят только из разобранного JSON и всегда сериализуются
+        patch = json.dumps(data)
+
+        def operation(connection: sqlite3.Connection, now: float) -> Dict[str, Any]:
+            state, current = self._read(connection, storage_key, now)
+            current.update(json.loads(patch))
+            self._write(connection, storage_key, now, state, json.dumps(current) if current else None)
+            return current
+
+        return await self._submit(operation)
+
+    async def close(self) -> None:
+        await self._drain()
+        if self._connection is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
@@ -5,26 +5,28 @@
 import logging
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
+from aiogram.utils.callback_answer import CallbackAnswer
 
 from keyboards.inline import get_back_keyboard
+from middlewares.callback_answer import notify_callback_error
+from middlewares.context import UserContext
 
 logger = logging.getLogger(__name__)
-router = Router()
+router = Router(name="menu")
 
 
 @router.callback_query(F.data == "back")
-async def back_handler(callback: CallbackQuery):
+async def back_handler(callback: CallbackQuery, callback_answer: CallbackAnswer, user_context: UserContext):
     """
     Универсальный обработчик кнопки "Назад"
     Перенаправляет к главному меню
     """
     try:
-        from models.user import get_user_subscription_info
         from utils.helpers import format_subscription_info
         from keyboards.inline import get_main_menu_keyboard
         
         # Получаем информацию о подписке
-        subscription_info = await get_user_subscription_info(callback.from_user.id)
+        subscription_info = await user_context.subscription_info()
         
         # Форматируем информацию о пользователе
         user_info = format_subscription_info(
@@ -40,25 +42,22 @@ async def back_handler(callback: CallbackQuery):
             reply_markup=keyboard
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в back_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
 
 
 @router.callback_query(F.data == "main_menu")
-async def main_menu_handler(callback: CallbackQuery):
+async def main_menu_handler(callback: CallbackQuery, callback_answer: CallbackAnswer, user_context: UserContext):
     """
     Обработчик возврата в главное меню (для get_back_keyboard)
     """
     try:
-        from models.user import get_user_subscription_info
         from utils.helpers import format_subscription_info
         from keyboards.inline import get_main_menu_keyboard
         
         # Получаем информацию о подписке
-        subscription_info = await get_user_subscription_info(callback.from_user.id)
+        subscription_info = await user_context.subscription_info()
         
         # Форматируем информацию о пользователе
         user_info = format_subscription_info(
@@ -74,15 +73,13 @@ async def main_menu_handler(callback: CallbackQuery):
             reply_markup=keyboard
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в main_menu_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
 
 
 @router.callback_query(F.data == "cancel")
-async def cancel_handler(callback: CallbackQuery):
+async def cancel_handler(callback: CallbackQuery, callback_answer: CallbackAnswer):
     """
     Обработчик отмены операции
     """
@@ -91,8 +88,7 @@ async def cancel_handler(callback: CallbackQuery):
             "❌ Операция отменена",
             reply_markup=get_back_keyboard()
         )
-        await callback.answer()
         
     except Exception as e:
         logger.error(f"Ошибка в cancel_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
@@ -3,30 +3,33 @@
 """
 
 import logging
-from datetime import datetime, timedelta
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message, PreCheckoutQuery, LabeledPrice
+from aiogram.utils.callback_answer import CallbackAnswer
 from aiogram.fsm.context import FSMContext
 
 from config import config
 from keyboards.inline import get_subscription_keyboard, get_back_keyboard
-from models.subscription import create_or_update_subscription, get_user_subscription
+from middlewares.callback_answer import notify_callback_error
+from middlewares.context import UserContext
+from models.subscription import activate_subscription
 from models.payment import create_payment_record
 from states.payment import PaymentStates
+from storage import parse_timestamp
 from utils.notifications import send_payment_success_notification
 
 logger = logging.getLogger(__name__)
-router = Router()
+router = Router(name="payments")
 
 
 @router.callback_query(F.data == "connect_vpn")
-async def connect_vpn_handler(callback: CallbackQuery):
+async def connect_vpn_handler(callback: CallbackQuery, callback_answer: CallbackAnswer, user_context: UserContext):
     """
     Обработчик подключения VPN
     """
     try:
         # Проверяем активную подписку пользователя
-        subscription = await get_user_subscription(callback.from_user.id)
+        subscription = await user_context.subscription()
         
         if subscription and subscription.get('is_active'):
             # У пользователя есть активная подписка
@@ -79,15 +82,13 @@ async def connect_vpn_handler(callback: CallbackQuery):
             reply_markup=keyboard
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в connect_vpn_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
 
 
 @router.callback_query(F.data == "extend")
-async def extend_subscription_handler(callback: CallbackQuery, state: FSMContext):
+async def extend_subscription_handler(callback: CallbackQuery, callback_answer: CallbackAnswer, state: FSMContext):
     """
     Обработчик продления подписки
     """
@@ -115,15 +116,14 @@ async def extend_subscription_handler(callback: CallbackQuery, state: FSMContext
             reply_markup=keyboard
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в extend_subscription_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
 
 
-@router.callback_query(F.data.startswith("buy_"))
-async def buy_subscription_handler(callback: CallbackQuery, state: FSMContext):
+# Ответ после хендлера: ошибки проверки тарифа и создания счета показываются всплывающим уведомлением
+@router.callback_query(F.data.startswith("buy_"), flags={"callback_answer": {"pre": False}})
+async def buy_subscription_handler(callback: CallbackQuery, callback_answer: CallbackAnswer, state: FSMContext):
     """
     Обработчик покупки подписки
     """
@@ -132,7 +132,7 @@ async def buy_subscription_handler(callback: CallbackQuery, state: FSMContext):
         subscription_type = callback.data.replace("buy_", "")
         
         if subscription_type not in config.SUBSCRIPTION_PRICES:
-            await callback.answer("❌ Неверный тип подписки")
+            await notify_callback_error(callback, callback_answer, "❌ Неверный тип подписки")
             return
         
         # Получаем информацию о тарифе
@@ -173,11 +173,9 @@ async def buy_subscription_handler(callback: CallbackQuery, state: FSMContext):
                 payload=f"subscription_{subscription_type}_{callback.from_user.id}"
             )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в buy_subscription_handler: {e}")
-        await callback.answer("❌ Произошла ошибка при создании счета")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка при создании счета")
 
 
 @router.pre_checkout_query()
@@ -243,17 +241,14 @@ async def successful_payment_handler(message: Message, state: FSMContext):
         # Получаем информацию о подписке
         price_info = config.SUBSCRIPTION_PRICES[subscription_type]
         
-        # Вычисляем дату окончания подписки
-        now = datetime.utcnow()
-        expire_at = now + timedelta(days=price_info["days"])
-        
-        # Создаем или обновляем подписку
-        await create_or_update_subscription(
+        # Деактивация старой и создание новой подписки - один запрос к БД.
+        # Оплаченные дни добавляются к еще не истекшей подписке
+        subscription = await activate_subscription(
             user_id=user_id,
             subscription_type="premium",
-            expire_at=expire_at,
-            is_active=True
+            days=price_info["days"]
         )
+        expire_at = parse_timestamp(subscription["expire_at"])
         
         # Записываем информацию о платеже
         if config.USE_TELEGRAM_STARS:
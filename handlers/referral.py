@@ -5,23 +5,25 @@
 import logging
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
+from aiogram.utils.callback_answer import CallbackAnswer
 
 from config import config
 from keyboards.inline import get_back_keyboard
-from models.user import get_user_referral_stats
+from middlewares.callback_answer import notify_callback_error
+from middlewares.context import UserContext
 
 logger = logging.getLogger(__name__)
-router = Router()
+router = Router(name="referral")
 
 
 @router.callback_query(F.data == "invite")
-async def invite_handler(callback: CallbackQuery):
+async def invite_handler(callback: CallbackQuery, callback_answer: CallbackAnswer, user_context: UserContext):
     """
     Обработчик реферальной системы
     """
     try:
         # Получаем статистику рефералов пользователя
-        referral_stats = await get_user_referral_stats(callback.from_user.id)
+        referral_stats = await user_context.referral_stats()
         
         # Формируем реферальную ссылку
         bot_username = callback.bot.me.username if hasattr(callback.bot, 'me') else "youvpn_bot"
@@ -63,8 +65,6 @@ async def invite_handler(callback: CallbackQuery):
             reply_markup=keyboard
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в invite_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
@@ -2,22 +2,117 @@
 Обработчик команды /start и главного меню
 """
 
+import asyncio
 import logging
 from aiogram import Router, F
 from aiogram.filters import CommandStart
 from aiogram.types import Message, CallbackQuery
+from aiogram.utils.callback_answer import CallbackAnswer
 from aiogram.fsm.context import FSMContext
 
+from config import config
 from keyboards.inline import get_main_menu_keyboard, get_back_keyboard
-from models.user import create_or_get_user, get_user_subscription_info
+from middlewares.callback_answer import notify_callback_error
+from middlewares.context import UserContext
 from utils.helpers import format_subscription_info
 
 logger = logging.getLogger(__name__)
-router = Router()
+router = Router(name="start")
+
+# Тексты статических страниц (website - с адресом сайта из настроек)
+ABOUT_TEXT = """
+О сервисе Escape!
+
+Escape! — это профессиональный VPN-сервис, обеспечивающий:
+
+Безопасность:
+• Шифрование военного уровня
+• Защита от утечек DNS
+• Kill Switch для максимальной безопасности
+
+Глобальное покрытие:
+• Серверы в 50+ странах
+• Высокая скорость соединения
+• Без ограничений трафика
+
+Простота использования:
+• Подключение в один клик
+• Поддержка всех устройств
+• Круглосуточная техническая поддержка
+
+Премиум качество:
+• Стабильная работа
+• Регулярные обновления
+• Гарантия возврата средств
+        """
+
+HELP_TEXT = """
+Поддержка
+
+<b>Часто задаваемые вопросы:</b>
+
+<b>Q: Как подключиться к VPN?</b>
+A: Нажмите кнопку "⚙️ Подключить VPN" и следуйте инструкциям.
+
+<b>Q: Как продлить подписку?</b>
+A: Используйте кнопку "💥 Продлить" в главном меню.
+
+<b>Q: Как получить награду за приглашения?</b>
+A: Пригласите друзей через кнопку "👥 Пригласить" и получите 100₽ за каждого.
+
+<b>Q: Что делать если VPN не работает?</b>
+A: Обратитесь в техподдержку через кнопку "❓ Помощь".
+
+<b>Q: Есть ли ограничения по трафику?</b>
+A: Нет, все тарифы предоставляют безлимитный трафик.
+
+<b>💬 Техподдержка:</b>
+Если у вас остались вопросы, обратитесь к нашей службе поддержки: @sicsemperproteus
+
+Мы работаем 24/7 и всегда готовы помочь!
+        """
+
+REVIEWS_TEXT = """
+⭐ <b>Отзывы наших клиентов</b>
+
+Мы ценим мнение каждого пользователя и постоянно работаем над улучшением сервиса.
+
+📝 <b>Оставить отзыв:</b>
+Поделитесь своим опытом использования Escape! в нашем канале отзывов или напишите в поддержку.
+
+🌟 <b>Ваше мнение важно!</b>
+Все отзывы помогают нам становиться лучше и предоставлять еще более качественный сервис.
+
+📞 <b>Связаться с нами:</b>
+• Техподдержка: @sicsemperproteus
+• Наш сайт: https://escape.ct.ws
+
+Спасибо за выбор Escape! 🚀
+        """
+
+WEBSITE_TEXT = f"""
+🌐 <b>Наш сайт</b>
+
+Посетите наш официальный сайт для получения дополнительной информации:
+
+🔗 <b>Сайт:</b> {config.WEBSITE_URL}
+
+На сайте вы найдете:
+• Подробную информацию о тарифах
+• Инструкции по настройке
+• Последние новости и обновления
+• Техническую документацию
+
+💻 <b>Веб-панель управления</b>
+Через сайт также доступна веб-панель для управления вашей подпиской и настройками VPN.
+
+📱 <b>Мобильные приложения</b>
+Скачайте наши приложения для удобного использования VPN на всех ваших устройствах.
+        """
 
 
 @router.message(CommandStart())
-async def start_command(message: Message, state: FSMContext):
+async def start_command(message: Message, state: FSMContext, user_context: UserContext):
     """
     Обработчик команды /start
     Создает пользователя в БД и показывает главное меню
@@ -26,17 +121,12 @@ async def start_command(message: Message, state: FSMContext):
         # Очищаем состояние FSM
         await state.clear()
         
-        # Получаем или создаем пользователя
-        user = await create_or_get_user(
-            chat_id=message.from_user.id,
-            username=message.from_user.username,
-            first_name=message.from_user.first_name,
-            last_name=message.from_user.last_name
+        # Получаем или создаем пользователя и параллельно загружаем подписку
+        user, subscription_info = await asyncio.gather(
+            user_context.ensure_user(),
+            user_context.subscription_info()
         )
         
-        # Получаем информацию о подписке
-        subscription_info = await get_user_subscription_info(message.from_user.id)
-        
         # Форматируем информацию о пользователе
         user_info = format_subscription_info(
             username=message.from_user.first_name or "Пользователь",
@@ -62,7 +152,7 @@ async def start_command(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "main_menu")
-async def show_main_menu(callback: CallbackQuery, state: FSMContext):
+async def show_main_menu(callback: CallbackQuery, callback_answer: CallbackAnswer, state: FSMContext, user_context: UserContext):
     """
     Возврат к главному меню
     """
@@ -70,8 +160,8 @@ async def show_main_menu(callback: CallbackQuery, state: FSMContext):
         # Очищаем состояние FSM
         await state.clear()
         
-        # Получаем информацию о подписке
-        subscription_info = await get_user_subscription_info(callback.from_user.id)
+        # Получаем информацию о подписке (загрузка начата в UserContextMiddleware)
+        subscription_info = await user_context.subscription_info()
         
         # Форматируем информацию о пользователе
         user_info = format_subscription_info(
@@ -87,180 +177,70 @@ async def show_main_menu(callback: CallbackQuery, state: FSMContext):
             reply_markup=keyboard
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в show_main_menu: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
 
 
 @router.callback_query(F.data == "about")
-async def about_handler(callback: CallbackQuery):
+async def about_handler(callback: CallbackQuery, callback_answer: CallbackAnswer):
     """
     Информация о Escape!
     """
     try:
-        about_text = """
-О сервисе Escape!
-
-Escape! — это профессиональный VPN-сервис, обеспечивающий:
-
-Безопасность:
-• Шифрование военного уровня
-• Защита от утечек DNS
-• Kill Switch для максимальной безопасности
-
-Глобальное покрытие:
-• Серверы в 50+ странах
-• Высокая скорость соединения
-• Без ограничений трафика
-
-Простота использования:
-• Подключение в один клик
-• Поддержка всех устройств
-• Круглосуточная техническая поддержка
-
-Премиум качество:
-• Стабильная работа
-• Регулярные обновления
-• Гарантия возврата средств
-        """
-        
-        keyboard = get_back_keyboard()
-        
         await callback.message.edit_text(
-            text=about_text,
-            reply_markup=keyboard
+            text=ABOUT_TEXT,
+            reply_markup=get_back_keyboard()
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в about_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
 
 
 @router.callback_query(F.data == "help")
-async def help_handler(callback: CallbackQuery):
+async def help_handler(callback: CallbackQuery, callback_answer: CallbackAnswer):
     """
     Помощь пользователю
     """
     try:
-        help_text = """
-Поддержка
-
-<b>Часто задаваемые вопросы:</b>
-
-<b>Q: Как подключиться к VPN?</b>
-A: Нажмите кнопку "⚙️ Подключить VPN" и следуйте инструкциям.
-
-<b>Q: Как продлить подписку?</b>
-A: Используйте кнопку "💥 Продлить" в главном меню.
-
-<b>Q: Как получить награду за приглашения?</b>
-A: Пригласите друзей через кнопку "👥 Пригласить" и получите 100₽ за каждого.
-
-<b>Q: Что делать если VPN не работает?</b>
-A: Обратитесь в техподдержку через кнопку "❓ Помощь".
-
-<b>Q: Есть ли ограничения по трафику?</b>
-A: Нет, все тарифы предоставляют безлимитный трафик.
-
-<b>💬 Техподдержка:</b>
-Если у вас остались вопросы, обратитесь к нашей службе поддержки: @sicsemperproteus
-
-Мы работаем 24/7 и всегда готовы помочь!
-        """
-        
-        keyboard = get_back_keyboard()
-        
         await callback.message.edit_text(
-            text=help_text,
-            reply_markup=keyboard
+            text=HELP_TEXT,
+            reply_markup=get_back_keyboard()
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в help_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
 
 
 @router.callback_query(F.data == "reviews")
-async def reviews_handler(callback: CallbackQuery):
+async def reviews_handler(callback: CallbackQuery, callback_answer: CallbackAnswer):
     """
     Отзывы о сервисе
     """
     try:
-        reviews_text = """
-⭐ <b>Отзывы наших клиентов</b>
-
-Мы ценим мнение каждого пользователя и постоянно работаем над улучшением сервиса.
-
-📝 <b>Оставить отзыв:</b>
-Поделитесь своим опытом использования Escape! в нашем канале отзывов или напишите в поддержку.
-
-🌟 <b>Ваше мнение важно!</b>
-Все отзывы помогают нам становиться лучше и предоставлять еще более качественный сервис.
-
-📞 <b>Связаться с нами:</b>
-• Техподдержка: @sicsemperproteus
-• Наш сайт: https://escape.ct.ws
-
-Спасибо за выбор Escape! 🚀
-        """
-        
-        keyboard = get_back_keyboard()
-        
         await callback.message.edit_text(
-            text=reviews_text,
-            reply_markup=keyboard
+            text=REVIEWS_TEXT,
+            reply_markup=get_back_keyboard()
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в reviews_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
 
 
 @router.callback_query(F.data == "website")
-async def website_handler(callback: CallbackQuery):
+async def website_handler(callback: CallbackQuery, callback_answer: CallbackAnswer):
     """
     Информация о сайте
     """
     try:
-        from config import config
-        
-        website_text = f"""
-🌐 <b>Наш сайт</b>
-
-Посетите наш официальный сайт для получения дополнительной информации:
-
-🔗 <b>Сайт:</b> {config.WEBSITE_URL}
-
-На сайте вы найдете:
-• Подробную информацию о тарифах
-• Инструкции по настройке
-• Последние новости и обновления
-• Техническую документацию
-
-💻 <b>Веб-панель управления</b>
-Через сайт также доступна веб-панель для управления вашей подпиской и настройками VPN.
-
-📱 <b>Мобильные приложения</b>
-Скачайте наши приложения для удобного использования VPN на всех ваших устройствах.
-        """
-        
-        keyboard = get_back_keyboard()
-        
         await callback.message.edit_text(
-            text=website_text,
-            reply_markup=keyboard
+            text=WEBSITE_TEXT,
+            reply_markup=get_back_keyboard()
         )
         
-        await callback.answer()
-        
     except Exception as e:
         logger.error(f"Ошибка в website_handler: {e}")
-        await callback.answer("❌ Произошла ошибка")
+        await notify_callback_error(callback, callback_answer, "❌ Произошла ошибка")
@@ -1,16 +1,63 @@
 """
 Инлайн-клавиатуры для бота
+
+Клавиатуры собираются один раз (подписки - заново при смене цен) и
+отдаются хендлерам одним и тем же неизменяемым объектом
 """
 
+import json
+from typing import Any, Dict, Optional, Tuple
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from pydantic import ConfigDict, PrivateAttr, field_validator
+
 from config import config
 
 
-def get_main_menu_keyboard() -> InlineKeyboardMarkup:
+class FrozenInlineKeyboardButton(InlineKeyboardButton):
     """
-    Главное меню бота (соответствует дизайну из скриншота)
+    Кнопка, которую нельзя изменить после создания
+    (InlineKeyboardButton в aiogram изменяемый)
+    """
+    model_config = ConfigDict(frozen=True)
+
+
+class PrebuiltKeyboard(InlineKeyboardMarkup):
+    """
+    Неизменяемая клавиатура с JSON, сериализованным при первом обращении
+    TracedAiohttpSession отправляет его как есть, не сериализуя клавиатуру заново
+
+    Ряды хранятся кортежами неизменяемых кнопок, поэтому изменить
+    клавиатуру так, чтобы JSON устарел, нельзя
     """
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    model_config = ConfigDict(frozen=True)
+
+    inline_keyboard: Tuple[Tuple[FrozenInlineKeyboardButton, ...], ...]
+
+    _serialized: str = PrivateAttr(default="")
+
+    @field_validator("inline_keyboard", mode="before")
+    @classmethod
+    def _freeze_rows(cls, rows: Any) -> Any:
+        return tuple(
+            tuple(
+                FrozenInlineKeyboardButton.model_validate(button.model_dump(exclude_unset=True))
+                if isinstance(button, InlineKeyboardButton) and not isinstance(button, FrozenInlineKeyboardButton)
+                else button
+                for button in row
+            )
+            for row in rows
+        )
+
+    @property
+    def serialized(self) -> str:
+        if not self._serialized:
+            self._serialized = json.dumps(self.model_dump(warnings=False, exclude_none=True))
+        return self._serialized
+
+
+def _build_main_menu_keyboard() -> PrebuiltKeyboard:
+    keyboard = PrebuiltKeyboard(inline_keyboard=[
         [
             InlineKeyboardButton(
                 text="Подключить VPN",
@@ -47,58 +94,30 @@ def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
-def get_subscription_keyboard() -> InlineKeyboardMarkup:
-    """
-    Клавиатура выбора подписки
-    """
+def _build_subscription_keyboard(prices: Dict[str, Dict[str, Any]]) -> PrebuiltKeyboard:
     currency_symbol = "⭐" if config.USE_TELEGRAM_STARS else "₽"
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    # Кнопка на каждый тариф из конфигурации, в порядке SUBSCRIPTION_PRICES
+    rows = [
         [
             InlineKeyboardButton(
-                text=f"1 месяц — {config.SUBSCRIPTION_PRICES['1_month']['price']}{currency_symbol}",
-                callback_data="buy_1_month"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text=f"2 месяца — {config.SUBSCRIPTION_PRICES['2_months']['price']}{currency_symbol}",
-                callback_data="buy_2_months"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text=f"3 месяца — {config.SUBSCRIPTION_PRICES['3_months']['price']}{currency_symbol}",
-                callback_data="buy_3_months"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text=f"6 месяцев — {config.SUBSCRIPTION_PRICES['6_months']['price']}{currency_symbol}",
-                callback_data="buy_6_months"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text=f"12 месяцев — {config.SUBSCRIPTION_PRICES['12_months']['price']}{currency_symbol}",
-                callback_data="buy_12_months"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                text="Назад",
-                callback_data="back"
+                text=f"{price_info['title']} — {price_info['price']}{currency_symbol}",
+                callback_data=f"buy_{subscription_type}"
             )
         ]
+        for subscription_type, price_info in prices.items()
+    ]
+    rows.append([
+        InlineKeyboardButton(
+            text="Назад",
+            callback_data="back"
+        )
     ])
-    return keyboard
+    return PrebuiltKeyboard(inline_keyboard=rows)
 
 
-def get_back_keyboard() -> InlineKeyboardMarkup:
-    """
-    Простая клавиатура с кнопкой "Назад"
-    """
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+def _build_back_keyboard() -> PrebuiltKeyboard:
+    keyboard = PrebuiltKeyboard(inline_keyboard=[
         [
             InlineKeyboardButton(
                 text="🔙 Назад",
@@ -109,11 +128,8 @@ def get_back_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
-def get_cancel_keyboard() -> InlineKeyboardMarkup:
-    """
-    Клавиатура с кнопкой отмены
-    """
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+def _build_cancel_keyboard() -> PrebuiltKeyboard:
+    keyboard = PrebuiltKeyboard(inline_keyboard=[
         [
             InlineKeyboardButton(
                 text="Отменить",
@@ -124,11 +140,8 @@ def get_cancel_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
-def get_payment_keyboard() -> InlineKeyboardMarkup:
-    """
-    Клавиатура для платежей
-    """
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+def _build_payment_keyboard() -> PrebuiltKeyboard:
+    keyboard = PrebuiltKeyboard(inline_keyboard=[
         [
             InlineKeyboardButton(
                 text="Оплатить",
@@ -143,3 +156,63 @@ def get_payment_keyboard() -> InlineKeyboardMarkup:
         ]
     ])
     return keyboard
+
+
+_main_menu_keyboard = _build_main_menu_keyboard()
+_back_keyboard = _build_back_keyboard()
+_cancel_keyboard = _build_cancel_keyboard()
+_payment_keyboard = _build_payment_keyboard()
+
+# Клавиатура тарифов и словарь цен, из которого она собрана
+_subscription_keyboard: Optional[PrebuiltKeyboard] = None
+_subscription_prices: Optional[Dict[str, Dict[str, Any]]] = None
+
+
+def rebuild_subscription_keyboard():
+    """
+    Пересобирает клавиатуру тарифов по config.SUBSCRIPTION_PRICES
+    Нужна, если цены изменены на месте; замена словаря цен замечается сама
+    """
+    global _subscription_keyboard, _subscription_prices
+    _subscription_prices = config.SUBSCRIPTION_PRICES
+    _subscription_keyboard = _build_subscription_keyboard(_subscription_prices)
+
+
+def get_main_menu_keyboard() -> InlineKeyboardMarkup:
+    """
+    Главное меню бота (соответствует дизайну из скриншота)
+    """
+    return _main_menu_keyboard
+
+
+def get_subscription_keyboard() -> InlineKeyboardMarkup:
+    """
+    Клавиатура выбора подписки
+    """
+    if _subscription_prices is not config.SUBSCRIPTION_PRICES:
+        rebuild_subscription_keyboard()
+    return _subscription_keyboard
+
+
+def get_back_keyboard() -> InlineKeyboardMarkup:
+    """
+    Простая клавиатура с кнопкой "Назад"
+    """
+    return _back_keyboard
+
+
+def get_cancel_keyboard() -> InlineKeyboardMarkup:
+    """
+    Клавиатура с кнопкой отмены
+    """
+    return _cancel_keyboard
+
+
+def get_payment_keyboard() -> InlineKeyboardMarkup:
+    """
+    Клавиатура для платежей
+    """
+    return _payment_keyboard
+
+
+rebuild_subscription_keyboard()
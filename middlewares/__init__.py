@@ -0,0 +1,13 @@
+"""
+Пакет middleware диспетчера
+"""
+
+from .callback_answer import EarlyCallbackAnswerMiddleware, notify_callback_error
+from .context import UserContext, UserContextMiddleware
+from .metrics import HandlerMetricsMiddleware, TelegramApiMetrics
+from .throttling import ThrottlingMiddleware
+
+__all__ = [
+    'EarlyCallbackAnswerMiddleware', 'HandlerMetricsMiddleware', 'TelegramApiMetrics', 'ThrottlingMiddleware',
+    'UserContext', 'UserContextMiddleware', 'notify_callback_error'
+]
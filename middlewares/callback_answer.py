@@ -0,0 +1,93 @@
+"""
+Подтверждение колбэков до выполнения хендлера
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramAPIError
+from aiogram.methods import AnswerCallbackQuery
+from aiogram.types import CallbackQuery, TelegramObject
+from aiogram.utils.callback_answer import CallbackAnswer, CallbackAnswerMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+class EarlyCallbackAnswerMiddleware(CallbackAnswerMiddleware):
+    """
+    Внутренний middleware: отвечает на колбэк сразу, не дожидаясь хендлера,
+    поэтому индикатор загрузки на кнопке исчезает через один запрос к Bot API,
+    а не после запросов к БД и edit_text
+
+    В отличие от CallbackAnswerMiddleware(pre=True), ответ отправляется
+    параллельно с работой хендлера, а его ошибка не прерывает хендлер.
+    Хендлер получает callback_answer; поздний ответ с текстом включается
+    флагом flags={"callback_answer": {"pre": False}}
+    """
+
+    def __init__(self, **kwargs: Any):
+        kwargs.setdefault("pre", True)
+        super().__init__(**kwargs)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+
+        callback_answer = data["callback_answer"] = self.construct_callback_answer(
+            properties=get_flag(data, "callback_answer")
+        )
+
+        answer_task = None
+        if not callback_answer.disabled and callback_answer.answered:
+            answer_task = asyncio.create_task(self._send_answer(event, callback_answer))
+        try:
+            return await handler(event, data)
+        finally:
+            if answer_task is not None:
+                await answer_task
+            elif not callback_answer.disabled:
+                await self._send_answer(event, callback_answer)
+
+    async def _send_answer(self, event: CallbackQuery, callback_answer: CallbackAnswer):
+        try:
+            await self.answer(event, callback_answer)
+        except TelegramAPIError as e:
+            logger.warning(f"Не удалось ответить на колбэк {event.id}: {e}")
+
+    def answer(self, event: CallbackQuery, callback_answer: CallbackAnswer) -> AnswerCallbackQuery:
+        # Без записи в лог на каждый колбэк, в отличие от базового класса
+        return event.answer(
+            text=callback_answer.text,
+            show_alert=callback_answer.show_alert,
+            url=callback_answer.url,
+            cache_time=callback_answer.cache_time
+        )
+
+
+async def notify_callback_error(callback: CallbackQuery, callback_answer: CallbackAnswer, text: str):
+    """
+    Сообщение об ошибке в хендлере колбэка
+
+    Если колбэк еще не подтвержден (флаг {"callback_answer": {"pre": False}}),
+    текст уходит во всплывающем уведомлении. После раннего ответа второй
+    ответ Telegram не примет, поэтому текст отправляется сообщением в чат
+    """
+    if not callback_answer.answered and not callback_answer.disabled:
+        callback_answer.text = text
+        return
+
+    if callback.message is None:
+        # Колбэк inline-сообщения: писать некуда
+        logger.debug(f"Колбэк {callback.id} уже подтвержден, ошибка не показана: {text}")
+        return
+    try:
+        await callback.message.answer(text)
+    except TelegramAPIError as e:
+        logger.warning(f"Не удалось сообщить об ошибке колбэка {callback.id}: {e}")
@@ -0,0 +1,143 @@
+"""
+Контекст пользователя для одного апдейта
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject, User
+
+from models.user import (
+    create_or_get_user, get_user, build_subscription_info, build_referral_stats
+)
+from models.subscription import get_user_subscription
+
+logger = logging.getLogger(__name__)
+
+# Какие данные начинать загружать сразу для колбэков главного меню
+PREFETCH_BY_CALLBACK = {
+    "main_menu": ("subscription",),
+    "back": ("subscription",),
+    "connect_vpn": ("subscription",),
+    "invite": ("user",),
+}
+
+
+# Загрузчики данных контекста по имени
+LOADERS: Dict[str, Callable[["UserContext"], Awaitable[Any]]] = {
+    "user": lambda context: get_user(context.chat_id),
+    "subscription": lambda context: get_user_subscription(context.chat_id),
+}
+
+
+class UserContext:
+    """
+    Строка пользователя и активная подписка в рамках одного апдейта
+    Каждая загрузка выполняется не больше одного раза и только когда
+    данные понадобились хендлеру (или были запрошены через prefetch)
+    """
+
+    def __init__(self, tg_user: User):
+        self.tg_user = tg_user
+        self.chat_id = tg_user.id
+        self._tasks: Dict[str, asyncio.Future] = {}
+
+    def _load(self, name: str) -> asyncio.Future:
+        task = self._tasks.get(name)
+        if task is None:
+            task = self._tasks[name] = asyncio.ensure_future(LOADERS[name](self))
+        return task
+
+    async def ensure_user(self) -> Dict[str, Any]:
+        """
+        Создает или обновляет пользователя (для /start)
+        Результат становится строкой пользователя этого апдейта
+        """
+        task = self._tasks.get("ensure_user")
+        if task is None:
+            task = self._tasks["ensure_user"] = asyncio.ensure_future(create_or_get_user(
+                chat_id=self.chat_id,
+                username=self.tg_user.username,
+                first_name=self.tg_user.first_name,
+                last_name=self.tg_user.last_name
+            ))
+            self._tasks.setdefault("user", task)
+        return await task
+
+    async def user(self) -> Optional[Dict[str, Any]]:
+        """
+        Строка пользователя из БД
+        """
+        return await self._load("user")
+
+    async def subscription(self) -> Optional[Dict[str, Any]]:
+        """
+        Активная подписка пользователя
+        """
+        return await self._load("subscription")
+
+    async def subscription_info(self) -> Dict[str, Any]:
+        """
+        Информация о подписке для главного меню
+        """
+        return build_subscription_info(await self.subscription())
+
+    async def referral_stats(self) -> Dict[str, Any]:
+        """
+        Статистика рефералов (из той же строки пользователя)
+        """
+        try:
+            user_data = await self.user()
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики рефералов для {self.chat_id}: {e}")
+            user_data = None
+        return build_referral_stats(user_data)
+
+    def prefetch(self, *names: str):
+        """
+        Запускает загрузки в фоне, не дожидаясь их
+        """
+        for name in names:
+            self._load(name)
+
+    def close(self):
+        """
+        Отменяет загрузки, которые так и не понадобились
+        """
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Ошибку невостребованной загрузки не пробрасываем
+                task.exception()
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Внешний middleware: создает UserContext и передает его
+    хендлерам в параметре user_context
+    """
+
+    def __init__(self, prefetch: Optional[Dict[str, tuple]] = None):
+        self.prefetch = PREFETCH_BY_CALLBACK if prefetch is None else prefetch
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        tg_user = data.get("event_from_user")
+        if tg_user is None:
+            return await handler(event, data)
+
+        context = UserContext(tg_user)
+        if isinstance(event, CallbackQuery) and event.data in self.prefetch:
+            context.prefetch(*self.prefetch[event.data])
+
+        data["user_context"] = context
+        try:
+            return await handler(event, data)
+        finally:
+            context.close()
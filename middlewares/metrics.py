@@ -0,0 +1,96 @@
+"""
+Метрики хендлеров и вызовов Telegram Bot API
+"""
+
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from utils.metrics import MAX_LABEL_SETS, handler_duration, handler_errors, telegram_duration, telegram_errors
+
+
+def event_key(event: TelegramObject) -> str:
+    """
+    Ключ апдейта для меток: команда, callback_data или тип содержимого
+    """
+    if isinstance(event, CallbackQuery):
+        return event.data or ""
+    if isinstance(event, Message):
+        if event.text and event.text.startswith("/"):
+            return event.text.split(maxsplit=1)[0].split("@", 1)[0]
+        return event.content_type
+    return type(event).__name__
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware: гистограмма времени и счетчик ошибок
+    по роутеру, типу события и ключу (команда или callback_data)
+    """
+
+    def __init__(self):
+        # (роутер, тип события, ключ) -> (гистограмма, счетчик ошибок)
+        self._children: Dict[Tuple[str, str, str], Tuple[Any, Any]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        router = data.get("event_router")
+        update = data.get("event_update")
+        labels = (
+            router.name if router is not None else "",
+            update.event_type if update is not None else type(event).__name__,
+            event_key(event)
+        )
+        children = self._children.get(labels)
+        if children is None:
+            children = (handler_duration.labels(*labels), handler_errors.labels(*labels))
+            # callback_data присылает клиент: произвольные значения не кэшируем
+            if len(self._children) < MAX_LABEL_SETS:
+                self._children[labels] = children
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            children[1].inc()
+            raise
+        finally:
+            children[0].observe(time.perf_counter() - started)
+
+
+class TelegramApiMetrics(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: время и ошибки по методам Bot API
+    """
+
+    def __init__(self):
+        self._children: Dict[str, Tuple[Any, Any]] = {}
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        children = self._children.get(name)
+        if children is None:
+            children = self._children[name] = (telegram_duration.labels(name), telegram_errors.labels(name))
+
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            children[1].inc()
+            raise
+        finally:
+            children[0].observe(time.perf_counter() - started)
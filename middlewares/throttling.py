@@ -0,0 +1,177 @@
+"""
+Ограничение частоты запросов пользователя (анти-флуд)
+"""
+
+import logging
+import time
+from array import array
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from middlewares.metrics import event_key
+from utils.metrics import throttled_total
+
+logger = logging.getLogger(__name__)
+
+# Правило по умолчанию для ключей, не подходящих ни под один префикс
+DEFAULT_RULE = "*"
+
+THROTTLED_TEXT = "⏳ Слишком часто, подождите немного"
+
+
+class TokenBuckets:
+    """
+    Token bucket на каждого пользователя: до capacity запросов подряд,
+    затем rate запросов в секунду
+
+    Состояние хранится в двух массивах double (токены и время обновления),
+    словарь только отображает id пользователя в номер ячейки.
+    Полное ведро не отличается от отсутствующего, поэтому evict()
+    освобождает ячейки пользователей, которые успели восстановиться
+    """
+    __slots__ = ("capacity", "rate", "_slots", "_tokens", "_updated", "_free")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._slots: Dict[int, int] = {}
+        self._tokens = array("d")
+        self._updated = array("d")
+        self._free: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def consume(self, user_id: int, now: float) -> float:
+        """
+        Списывает токен. Возвращает 0, если запрос разрешен,
+        иначе через сколько секунд появится следующий токен
+        """
+        slot = self._slots.get(user_id)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self._tokens[slot] = self.capacity - 1
+                self._updated[slot] = now
+            else:
+                slot = len(self._tokens)
+                self._tokens.append(self.capacity - 1)
+                self._updated.append(now)
+            self._slots[user_id] = slot
+            return 0.0
+
+        tokens = min(self.capacity, self._tokens[slot] + (now - self._updated[slot]) * self.rate)
+        self._updated[slot] = now
+        if tokens >= 1:
+            self._tokens[slot] = tokens - 1
+            return 0.0
+        self._tokens[slot] = tokens
+        return (1 - tokens) / self.rate
+
+    def evict(self, now: float) -> int:
+        """
+        Освобождает ячейки восстановившихся пользователей, возвращает их число
+        """
+        tokens, updated, capacity, rate = self._tokens, self._updated, self.capacity, self.rate
+        full = [
+            user_id for user_id, slot in self._slots.items()
+            if tokens[slot] + (now - updated[slot]) * rate >= capacity
+        ]
+        for user_id in full:
+            self._free.append(self._slots.pop(user_id))
+
+        # Если освободилась большая часть массивов - сжимаем их
+        if len(self._free) > 1024 and len(self._free) > len(self._slots):
+            slots = self._slots
+            self._tokens = array("d", (tokens[slot] for slot in slots.values()))
+            self._updated = array("d", (updated[slot] for slot in slots.values()))
+            self._slots = {user_id: index for index, user_id in enumerate(slots)}
+            self._free = []
+        return len(full)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware: ограничивает частоту запросов каждого пользователя
+
+    limits - правила {префикс: (запросов подряд, за сколько секунд они
+    восстанавливаются)}, префикс сравнивается с callback_data или командой,
+    выбирается самый длинный подходящий, DEFAULT_RULE - для остальных.
+    Ограниченный запрос не доходит до хендлеров и БД: колбэк получает
+    короткий ответ, сообщение пропускается. Ограничиваются только колбэки
+    и текстовые сообщения: служебные сообщения (successful_payment и другие)
+    проходят всегда, иначе оплата после серии сообщений была бы потеряна
+    """
+
+    def __init__(self, limits: Mapping[str, Tuple[float, float]],
+                 sweep_interval: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._next_sweep = clock() + sweep_interval
+        # (префикс, ведра, счетчик) от самого длинного префикса к короткому
+        self._rules = [
+            (prefix, TokenBuckets(burst, burst / period), throttled_total.labels(prefix))
+            for prefix, (burst, period) in sorted(limits.items(), key=lambda item: -len(item[0]))
+            if prefix != DEFAULT_RULE
+        ]
+        self._default = None
+        if DEFAULT_RULE in limits:
+            burst, period = limits[DEFAULT_RULE]
+            self._default = (DEFAULT_RULE, TokenBuckets(burst, burst / period), throttled_total.labels(DEFAULT_RULE))
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for _, buckets, _ in self._all_rules())
+
+    def _all_rules(self):
+        return self._rules + [self._default] if self._default is not None else self._rules
+
+    @staticmethod
+    def _is_limited(event: TelegramObject) -> bool:
+        if isinstance(event, CallbackQuery):
+            return True
+        return isinstance(event, Message) and bool(event.text) and event.successful_payment is None
+
+    def _match(self, key: str) -> Optional[tuple]:
+        for rule in self._rules:
+            if key.startswith(rule[0]):
+                return rule
+        return self._default
+
+    def _sweep(self, now: float):
+        self._next_sweep = now + self.sweep_interval
+        evicted = sum(buckets.evict(now) for _, buckets, _ in self._all_rules())
+        if evicted:
+            logger.debug(f"Анти-флуд: освобождено {evicted} ведер, осталось {len(self)}")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        tg_user = data.get("event_from_user")
+        rule = None
+        if tg_user is not None and self._is_limited(event):
+            rule = self._match(event_key(event))
+        if rule is None:
+            return await handler(event, data)
+
+        now = self._clock()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        retry_after = rule[1].consume(tg_user.id, now)
+        if not retry_after:
+            return await handler(event, data)
+
+        rule[2].inc()
+        if isinstance(event, CallbackQuery):
+            try:
+                await event.answer(THROTTLED_TEXT)
+            except TelegramAPIError as e:
+                logger.debug(f"Не удалось ответить на ограниченный колбэк {tg_user.id}: {e}")
+        return None
@@ -0,0 +1,40 @@
+"""
+Модель журнала уведомлений
+"""
+
+import logging
+from typing import List, Set
+from storage import NotificationKey
+from utils.cache import TTLCache, MISSING
+from utils.database import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Ключи, которые уже записаны в журнал: повторные проверки не обращаются к БД.
+# Предупреждения об одной подписке приходят в пределах нескольких дней
+notification_index = TTLCache(maxsize=100000, ttl=7 * 24 * 60 * 60)
+
+
+async def claim_notifications(keys: List[NotificationKey]) -> Set[NotificationKey]:
+    """
+    Отмечает уведомления (user_id, subscription_id, kind) как отправленные
+    и возвращает те, которые нужно отправить сейчас (их еще не было в журнале)
+    """
+    fresh = [key for key in dict.fromkeys(keys) if notification_index.get(key) is MISSING]
+    if not fresh:
+        return set()
+    
+    try:
+        storage = await get_storage()
+        
+        claimed = await storage.claim_notifications(fresh)
+        
+    except Exception as e:
+        # Без журнала лучше отправить повторно, чем не предупредить вовсе
+        logger.error(f"Ошибка при записи в журнал уведомлений: {e}")
+        return set(fresh)
+    
+    for key in fresh:
+        notification_index.set(key, True)
+    
+    return set(claimed)
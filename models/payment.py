@@ -4,8 +4,8 @@
 
 import logging
 from datetime import datetime
-from typing import Optional, Dict, Any
-from utils.database import get_supabase_client
+from typing import Optional, Dict, Any, AsyncIterator, List
+from utils.database import get_storage
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +18,7 @@ async def create_payment_record(user_id: int, amount: float, currency: str,
     Создает запись о платеже в базе данных
     """
     try:
-        supabase = get_supabase_client()
+        storage = await get_storage()
         
         payment_data = {
             "user_id": user_id,
@@ -31,13 +31,10 @@ async def create_payment_record(user_id: int, amount: float, currency: str,
             "created_at": datetime.utcnow().isoformat()
         }
         
-        result = supabase.table("payments").insert(payment_data).execute()
+        payment = await storage.insert_payment(payment_data)
         
-        if result.data:
-            logger.info(f"Создана запись о платеже: пользователь {user_id}, сумма {amount} {currency}")
-            return result.data[0]
-        else:
-            raise Exception("Не удалось создать запись о платеже")
+        logger.info(f"Создана запись о платеже: пользователь {user_id}, сумма {amount} {currency}")
+        return payment
             
     except Exception as e:
         logger.error(f"Ошибка при создании записи о платеже для {user_id}: {e}")
@@ -49,11 +46,9 @@ async def get_user_payments(user_id: int, limit: int = 10) -> list:
     Получает историю платежей пользователя
     """
     try:
-        supabase = get_supabase_client()
+        storage = await get_storage()
         
-        result = supabase.table("payments").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(limit).execute()
-        
-        return result.data if result.data else []
+        return await storage.get_user_payments(user_id, limit)
         
     except Exception as e:
         logger.error(f"Ошибка при получении платежей пользователя {user_id}: {e}")
@@ -65,11 +60,9 @@ async def get_payment_by_charge_id(telegram_payment_charge_id: str) -> Optional[
     Получает платеж по Telegram charge ID
     """
     try:
-        supabase = get_supabase_client()
-        
-        result = supabase.table("payments").select("*").eq("telegram_payment_charge_id", telegram_payment_charge_id).execute()
+        storage = await get_storage()
         
-        return result.data[0] if result.data else None
+        return await storage.get_payment_by_charge_id(telegram_payment_charge_id)
         
     except Exception as e:
         logger.error(f"Ошибка при получении платежа по charge_id {telegram_payment_charge_id}: {e}")
@@ -81,29 +74,67 @@ async def get_total_revenue() -> float:
     Получает общую выручку
     """
     try:
-        supabase = get_supabase_client()
-        
-        result = supabase.table("payments").select("amount").eq("status", "completed").execute()
+        storage = await get_storage()
         
-        total = sum(payment["amount"] for payment in result.data) if result.data else 0
-        return total
+        return await storage.get_total_revenue()
         
     except Exception as e:
         logger.error(f"Ошибка при получении общей выручки: {e}")
         return 0
 
 
+async def get_revenue_by_period(start_date: datetime, end_date: datetime) -> Dict[str, Dict[str, Any]]:
+    """
+    Выручка за период по валютам (по дневным итогам, с точностью до дня UTC):
+    {currency: {"amount": ..., "payments_count": ...}}
+    """
+    try:
+        storage = await get_storage()
+        
+        revenue: Dict[str, Dict[str, Any]] = {}
+        for row in await storage.get_revenue_by_day(start_date.date(), end_date.date()):
+            totals = revenue.setdefault(row["currency"], {"amount": 0.0, "payments_count": 0})
+            totals["amount"] += float(row["amount"])
+            totals["payments_count"] += row["payments_count"]
+        
+        return revenue
+        
+    except Exception as e:
+        logger.error(f"Ошибка при получении выручки за период {start_date} - {end_date}: {e}")
+        return {}
+
+
+async def rebuild_revenue_rollups() -> int:
+    """
+    Пересчитывает дневные итоги выручки по всем платежам
+    """
+    storage = await get_storage()
+    
+    rows = await storage.rebuild_revenue_daily()
+    logger.info(f"Дневные итоги выручки пересчитаны: {rows} строк")
+    return rows
+
+
 async def get_payments_by_period(start_date: datetime, end_date: datetime) -> list:
     """
     Получает платежи за определенный период
     """
     try:
-        supabase = get_supabase_client()
+        storage = await get_storage()
         
-        result = supabase.table("payments").select("*").gte("created_at", start_date.isoformat()).lte("created_at", end_date.isoformat()).eq("status", "completed").execute()
-        
-        return result.data if result.data else []
+        return await storage.get_payments_by_period(start_date, end_date)
         
     except Exception as e:
         logger.error(f"Ошибка при получении платежей за период {start_date} - {end_date}: {e}")
         return []
+
+
+async def iter_payments_by_period(start_date: datetime, end_date: datetime,
+                                  page_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Платежи за период страницами по page_size (без загрузки всего периода в память)
+    """
+    storage = await get_storage()
+    
+    async for page in storage.iter_payments_by_period(start_date, end_date, page_size):
+        yield page
@@ -3,12 +3,84 @@
 """
 
 import logging
-from datetime import datetime
-from typing import Optional, Dict, Any
-from utils.database import get_supabase_client
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, AsyncIterator, Callable, List
+from config import config
+from utils.cache import TTLCache, MISSING
+from utils.database import get_storage, read_flight
 
 logger = logging.getLogger(__name__)
 
+# Кэш активных подписок: user_id -> строка подписки или None.
+# Сбрасывается при любом изменении подписки пользователя в этом процессе
+subscription_cache = TTLCache(
+    maxsize=config.SUBSCRIPTION_CACHE_SIZE,
+    ttl=config.SUBSCRIPTION_CACHE_TTL
+)
+
+# Обработчики изменений подписок в этом процессе (например, планировщик истечения).
+# Вызываются с новой строкой подписки после активации или деактивации
+subscription_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+
+def _notify_listeners(subscription: Dict[str, Any]):
+    for listener in subscription_listeners:
+        try:
+            listener(subscription)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике изменения подписки {subscription.get('id')}: {e}")
+
+
+async def _get_active_subscription(user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Читает активную подписку через кэш
+    """
+    subscription = subscription_cache.get(user_id)
+    if subscription is not MISSING:
+        return subscription
+    
+    token = subscription_cache.token()
+    storage = await get_storage()
+    
+    # Параллельные промахи по одному пользователю выполняют один запрос
+    subscription = await read_flight.do(
+        ("subscriptions", user_id),
+        lambda: storage.get_active_subscription(user_id)
+    )
+    subscription_cache.set(user_id, subscription, token)
+    
+    return subscription
+
+
+def invalidate_subscription(user_id: int):
+    """
+    Сбрасывает кэш и незавершенное чтение подписки пользователя
+    """
+    subscription_cache.invalidate(user_id)
+    read_flight.forget(("subscriptions", user_id))
+
+
+async def activate_subscription(user_id: int, subscription_type: Optional[str] = None,
+                              days: Optional[int] = None,
+                              expire_at: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Атомарно заменяет активную подписку пользователя новой (один запрос к БД)
+    days продлевает от текущей даты окончания, expire_at задает ее явно
+    """
+    storage = await get_storage()
+    
+    try:
+        subscription = await storage.activate_subscription(
+            user_id, subscription_type=subscription_type, days=days, expire_at=expire_at
+        )
+    finally:
+        invalidate_subscription(user_id)
+    
+    _notify_listeners(subscription)
+    logger.info(f"Активирована подписка для пользователя {user_id}: "
+                f"{subscription['subscription_type']} до {subscription['expire_at']}")
+    return subscription
+
 
 async def create_or_update_subscription(user_id: int, subscription_type: str, 
                                       expire_at: datetime, is_active: bool = True) -> Dict[str, Any]:
@@ -16,27 +88,24 @@ async def create_or_update_subscription(user_id: int, subscription_type: str,
     Создает новую подписку или обновляет существующую
     """
     try:
-        supabase = get_supabase_client()
+        if is_active:
+            return await activate_subscription(user_id, subscription_type, expire_at=expire_at)
         
-        # Деактивируем все предыдущие подписки пользователя
-        supabase.table("subscriptions").update({"is_active": False}).eq("user_id", user_id).execute()
+        storage = await get_storage()
         
-        # Создаем новую подписку
+        # Неактивная подписка не заменяет текущую, просто сохраняем запись
         subscription_data = {
             "user_id": user_id,
             "subscription_type": subscription_type,
             "expire_at": expire_at.isoformat(),
-            "is_active": is_active,
+            "is_active": False,
             "created_at": datetime.utcnow().isoformat()
         }
         
-        result = supabase.table("subscriptions").insert(subscription_data).execute()
+        subscription = await storage.insert_subscription(subscription_data)
         
-        if result.data:
-            logger.info(f"Создана подписка для пользователя {user_id}: {subscription_type} до {expire_at}")
-            return result.data[0]
-        else:
-            raise Exception("Не удалось создать подписку")
+        logger.info(f"Создана подписка для пользователя {user_id}: {subscription_type} до {expire_at}")
+        return subscription
             
     except Exception as e:
         logger.error(f"Ошибка при создании/обновлении подписки для {user_id}: {e}")
@@ -48,12 +117,9 @@ async def get_user_subscription(user_id: int) -> Optional[Dict[str, Any]]:
     Получает активную подписку пользователя
     """
     try:
-        supabase = get_supabase_client()
-        
-        result = supabase.table("subscriptions").select("*").eq("user_id", user_id).eq("is_active", True).execute()
+        subscription = await _get_active_subscription(user_id)
         
-        if result.data:
-            subscription = result.data[0]
+        if subscription:
             
             # Проверяем, не истекла ли подписка
             expire_at = datetime.fromisoformat(subscription["expire_at"].replace("Z", "+00:00"))
@@ -78,11 +144,15 @@ async def deactivate_subscription(subscription_id: int) -> bool:
     Деактивирует подписку
     """
     try:
-        supabase = get_supabase_client()
+        storage = await get_storage()
         
-        result = supabase.table("subscriptions").update({"is_active": False}).eq("id", subscription_id).execute()
+        result = await storage.update_subscription(subscription_id, {"is_active": False})
         
-        return bool(result.data)
+        if result:
+            invalidate_subscription(result["user_id"])
+            _notify_listeners(result)
+        
+        return bool(result)
         
     except Exception as e:
         logger.error(f"Ошибка при деактивации подписки {subscription_id}: {e}")
@@ -94,53 +164,59 @@ async def get_expiring_subscriptions(days_before: int = 3) -> list:
     Получает подписки, которые истекают в ближайшие дни
     """
     try:
-        supabase = get_supabase_client()
+        storage = await get_storage()
         
         # Вычисляем дату, до которой ищем истекающие подписки
-        from datetime import timedelta
         target_date = datetime.utcnow() + timedelta(days=days_before)
         
-        result = supabase.table("subscriptions").select("*, users(chat_id, first_name)").eq("is_active", True).lt("expire_at", target_date.isoformat()).execute()
-        
-        return result.data if result.data else []
+        return await storage.get_expiring_subscriptions(target_date)
         
     except Exception as e:
         logger.error(f"Ошибка при получении истекающих подписок: {e}")
         return []
 
 
+async def iter_expiring_subscriptions(days_before: int = 3,
+                                      page_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Активные подписки, истекающие в ближайшие дни, страницами по page_size
+    Память не зависит от количества подписок
+    """
+    now = datetime.utcnow()
+    async for page in iter_subscriptions_expiring_between(now, now + timedelta(days=days_before), page_size):
+        yield page
+
+
+async def iter_subscriptions_expiring_between(after: datetime, before: datetime,
+                                              page_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Активные подписки с after <= expire_at < before страницами по page_size
+    """
+    storage = await get_storage()
+    
+    async for page in storage.iter_expiring_subscriptions(after, before, page_size):
+        yield page
+
+
+async def iter_subscriptions_created_after(after: datetime,
+                                           page_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Активные подписки, созданные после after, страницами по page_size
+    """
+    storage = await get_storage()
+    
+    async for page in storage.iter_subscriptions_created_after(after, page_size):
+        yield page
+
+
 async def extend_subscription(user_id: int, days: int) -> bool:
     """
     Продлевает существующую подписку на указанное количество дней
+    (или создает новую, если активной подписки нет)
     """
     try:
-        supabase = get_supabase_client()
-        
-        # Получаем активную подписку
-        subscription = await get_user_subscription(user_id)
-        
-        if subscription:
-            # Продлеваем существующую подписку
-            expire_at = datetime.fromisoformat(subscription["expire_at"].replace("Z", "+00:00"))
-            new_expire_at = expire_at + timedelta(days=days)
-            
-            supabase.table("subscriptions").update({
-                "expire_at": new_expire_at.isoformat()
-            }).eq("id", subscription["id"]).execute()
-            
-            return True
-        else:
-            # Нет активной подписки, создаем новую
-            from datetime import timedelta
-            expire_at = datetime.utcnow() + timedelta(days=days)
-            
-            await create_or_update_subscription(
-                user_id=user_id,
-                subscription_type="premium",
-                expire_at=expire_at
-            )
-            
-            return True
+        await activate_subscription(user_id, days=days)
+        return True
         
     except Exception as e:
         logger.error(f"Ошибка при продлении подписки для {user_id}: {e}")
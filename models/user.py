@@ -4,108 +4,165 @@
 
 import logging
 from datetime import datetime
-from typing import Optional, Dict, Any
-from utils.database import get_supabase_client
+from typing import Optional, Dict, Any, List
+from config import config
+from models.subscription import get_user_subscription
+from utils.database import get_storage, read_flight
+from utils.write_behind import WriteBehindBuffer
 
 logger = logging.getLogger(__name__)
 
 
+async def _flush_activity(activity: Dict[int, str]):
+    storage = await get_storage()
+    await storage.touch_users(activity)
+
+
+# Буфер отложенной записи last_activity (chat_id -> время последней активности)
+activity_buffer = WriteBehindBuffer(
+    name="last_activity",
+    flush=_flush_activity,
+    interval=config.ACTIVITY_FLUSH_INTERVAL,
+    max_size=config.ACTIVITY_FLUSH_SIZE
+)
+
+
+async def _flush_blocked(blocked: Dict[int, bool]):
+    storage = await get_storage()
+    await storage.block_users(list(blocked))
+
+
+# Буфер пользователей, заблокировавших бота (chat_id -> True)
+blocked_buffer = WriteBehindBuffer(
+    name="is_blocked",
+    flush=_flush_blocked,
+    interval=config.ACTIVITY_FLUSH_INTERVAL,
+    max_size=config.ACTIVITY_FLUSH_SIZE
+)
+
+
+def mark_user_blocked(chat_id: int):
+    """
+    Отмечает, что пользователь заблокировал бота (TelegramForbiddenError)
+    В БД попадает пачкой через blocked_buffer
+    """
+    blocked_buffer.put(chat_id, True)
+
+
+def touch_user_activity(chat_id: int):
+    """
+    Отмечает активность пользователя
+    В БД попадает пачкой через activity_buffer
+    """
+    activity_buffer.put(chat_id, datetime.utcnow().isoformat())
+
+
 async def create_or_get_user(chat_id: int, username: Optional[str] = None, 
                            first_name: Optional[str] = None, 
                            last_name: Optional[str] = None) -> Dict[str, Any]:
     """
     Создает нового пользователя или возвращает существующего
+    Выполняется одним атомарным upsert по chat_id, поэтому параллельные
+    /start от одного пользователя не приводят к ошибке дубликата
     """
     try:
-        supabase = get_supabase_client()
-        
-        # Проверяем, существует ли пользователь
-        result = supabase.table("users").select("*").eq("chat_id", chat_id).execute()
-        
-        if result.data:
-            # Пользователь существует, обновляем информацию
-            user_data = {
-                "username": username,
-                "first_name": first_name,
-                "last_name": last_name,
-                "last_activity": datetime.utcnow().isoformat()
-            }
-            
-            updated_result = supabase.table("users").update(user_data).eq("chat_id", chat_id).execute()
-            return updated_result.data[0] if updated_result.data else result.data[0]
-        else:
-            # Создаем нового пользователя
-            user_data = {
-                "chat_id": chat_id,
-                "username": username,
-                "first_name": first_name,
-                "last_name": last_name,
-                "created_at": datetime.utcnow().isoformat(),
-                "last_activity": datetime.utcnow().isoformat(),
-                "referral_balance": 0,
-                "invited_count": 0
-            }
-            
-            new_result = supabase.table("users").insert(user_data).execute()
-            return new_result.data[0] if new_result.data else user_data
+        storage = await get_storage()
+        
+        # Поля, которые обновляются у существующего пользователя.
+        # created_at, last_activity, referral_balance и invited_count при
+        # вставке заполняются значениями по умолчанию из схемы БД.
+        user_data = {
+            "chat_id": chat_id,
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            # Пользователь снова написал боту - значит, он его разблокировал
+            "is_blocked": False
+        }
+        
+        # Отметка о блокировке из буфера (в том числе уже записываемая)
+        # не должна попасть в БД после этого upsert
+        await blocked_buffer.discard(chat_id)
+        user = await storage.upsert_user(user_data)
+        
+        # last_activity обновляется пачкой, а не отдельной записью на каждый вызов
+        touch_user_activity(chat_id)
+        
+        return user
             
     except Exception as e:
         logger.error(f"Ошибка при создании/получении пользователя {chat_id}: {e}")
         raise
 
 
+async def get_user(chat_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Получает пользователя по chat_id
+    Параллельные запросы одного пользователя объединяются в один
+    """
+    storage = await get_storage()
+    
+    return await read_flight.do(("users", chat_id), lambda: storage.get_user(chat_id))
+
+
+def build_subscription_info(subscription: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Формирует информацию о подписке из строки активной подписки
+    """
+    if subscription:
+        expire_at = datetime.fromisoformat(subscription["expire_at"].replace("Z", "+00:00"))
+        now = datetime.utcnow().replace(tzinfo=expire_at.tzinfo)
+        
+        # Подписка активна
+        days_left = (expire_at - now).days
+        return {
+            "is_active": True,
+            "subscription_type": subscription["subscription_type"],
+            "expire_at": expire_at,
+            "days_left": days_left
+        }
+    
+    # Нет активной подписки
+    return {
+        "is_active": False,
+        "subscription_type": None,
+        "expire_at": None,
+        "days_left": 0
+    }
+
+
 async def get_user_subscription_info(chat_id: int) -> Optional[Dict[str, Any]]:
     """
     Получает информацию о подписке пользователя
+    Подписка читается через кэш models.subscription.subscription_cache
     """
     try:
-        supabase = get_supabase_client()
-        
-        # Получаем активную подписку пользователя
-        result = supabase.table("subscriptions").select("*").eq("user_id", chat_id).eq("is_active", True).execute()
+        # Получаем активную подписку пользователя (истекшая деактивируется)
+        subscription = await get_user_subscription(chat_id)
         
-        if result.data:
-            subscription = result.data[0]
-            
-            # Проверяем, не истекла ли подписка
-            expire_at = datetime.fromisoformat(subscription["expire_at"].replace("Z", "+00:00"))
-            now = datetime.utcnow().replace(tzinfo=expire_at.tzinfo)
-            
-            if expire_at > now:
-                # Подписка активна
-                days_left = (expire_at - now).days
-                return {
-                    "is_active": True,
-                    "subscription_type": subscription["subscription_type"],
-                    "expire_at": expire_at,
-                    "days_left": days_left
-                }
-            else:
-                # Подписка истекла, деактивируем
-                supabase.table("subscriptions").update({"is_active": False}).eq("id", subscription["id"]).execute()
-                return {
-                    "is_active": False,
-                    "subscription_type": None,
-                    "expire_at": None,
-                    "days_left": 0
-                }
-        else:
-            # Нет активной подписки
-            return {
-                "is_active": False,
-                "subscription_type": None,
-                "expire_at": None,
-                "days_left": 0
-            }
+        return build_subscription_info(subscription)
             
     except Exception as e:
         logger.error(f"Ошибка при получении информации о подписке для {chat_id}: {e}")
+        return build_subscription_info(None)
+
+
+def build_referral_stats(user_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Формирует статистику рефералов из строки пользователя
+    """
+    if user_data:
         return {
-            "is_active": False,
-            "subscription_type": None,
-            "expire_at": None,
-            "days_left": 0
+            "invited_count": user_data.get("invited_count", 0),
+            "earned_amount": user_data.get("referral_balance", 0),
+            "available_balance": user_data.get("referral_balance", 0)
         }
+    
+    return {
+        "invited_count": 0,
+        "earned_amount": 0,
+        "available_balance": 0
+    }
 
 
 async def get_user_referral_stats(chat_id: int) -> Dict[str, Any]:
@@ -113,62 +170,36 @@ async def get_user_referral_stats(chat_id: int) -> Dict[str, Any]:
     Получает статистику рефералов пользователя
     """
     try:
-        supabase = get_supabase_client()
-        
         # Получаем пользователя
-        result = supabase.table("users").select("referral_balance, invited_count").eq("chat_id", chat_id).execute()
-        
-        if result.data:
-            user_data = result.data[0]
-            return {
-                "invited_count": user_data.get("invited_count", 0),
-                "earned_amount": user_data.get("referral_balance", 0),
-                "available_balance": user_data.get("referral_balance", 0)
-            }
-        else:
-            return {
-                "invited_count": 0,
-                "earned_amount": 0,
-                "available_balance": 0
-            }
+        user_data = await get_user(chat_id)
+        
+        return build_referral_stats(user_data)
             
     except Exception as e:
         logger.error(f"Ошибка при получении статистики рефералов для {chat_id}: {e}")
-        return {
-            "invited_count": 0,
-            "earned_amount": 0,
-            "available_balance": 0
-        }
+        return build_referral_stats(None)
 
 
 async def process_referral(referred_user_id: int, referrer_user_id: int) -> bool:
     """
     Обрабатывает реферальное приглашение
+    Проверка, привязка к рефереру, запись в журнал и увеличение счетчика
+    выполняются атомарно на стороне БД одним запросом
     """
     try:
-        from config import config
-        supabase = get_supabase_client()
-        
         # Проверяем, что пользователь не приглашал сам себя
         if referred_user_id == referrer_user_id:
             return False
         
-        # Проверяем, что пользователь еще не был приглашен
-        result = supabase.table("users").select("referred_by").eq("chat_id", referred_user_id).execute()
+        storage = await get_storage()
         
-        if result.data and result.data[0].get("referred_by"):
-            # Пользователь уже был приглашен
-            return False
-        
-        # Обновляем информацию о реферале
-        supabase.table("users").update({"referred_by": referrer_user_id}).eq("chat_id", referred_user_id).execute()
+        # None - пользователь уже был приглашен
+        referral = await storage.register_referral(referrer_user_id, referred_user_id)
         
-        # Увеличиваем счетчик приглашений у реферера
-        supabase.table("users").update({
-            "invited_count": supabase.rpc("increment_invited_count", {"user_chat_id": referrer_user_id})
-        }).eq("chat_id", referrer_user_id).execute()
+        read_flight.forget(("users", referred_user_id))
+        read_flight.forget(("users", referrer_user_id))
         
-        return True
+        return referral is not None
         
     except Exception as e:
         logger.error(f"Ошибка при обработке реферала {referred_user_id} -> {referrer_user_id}: {e}")
@@ -177,25 +208,37 @@ async def process_referral(referred_user_id: int, referrer_user_id: int) -> bool
 
 async def add_referral_reward(user_id: int, amount: float) -> bool:
     """
-    Добавляет реферальную награду пользователю
+    Добавляет реферальную награду пользователю (атомарно на стороне БД)
     """
     try:
-        supabase = get_supabase_client()
+        storage = await get_storage()
         
-        # Получаем текущий баланс
-        result = supabase.table("users").select("referral_balance").eq("chat_id", user_id).execute()
-        
-        if result.data:
-            current_balance = result.data[0].get("referral_balance", 0)
-            new_balance = current_balance + amount
-            
-            # Обновляем баланс
-            supabase.table("users").update({"referral_balance": new_balance}).eq("chat_id", user_id).execute()
-            
-            return True
+        balance = await storage.add_referral_reward(user_id, amount)
+        read_flight.forget(("users", user_id))
         
-        return False
+        return balance is not None
         
     except Exception as e:
         logger.error(f"Ошибка при добавлении реферальной награды пользователю {user_id}: {e}")
         return False
+
+
+async def settle_referral_rewards(amount: float, limit: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Начисляет награды за всех приглашенных, оплативших подписку, одним запросом
+    Возвращает начисленные награды
+    """
+    try:
+        storage = await get_storage()
+        
+        settled = await storage.settle_referral_rewards(amount, limit)
+        for reward in settled:
+            read_flight.forget(("users", reward["referrer_id"]))
+        
+        if settled:
+            logger.info(f"Начислено реферальных наград: {len(settled)}")
+        return settled
+        
+    except Exception as e:
+        logger.error(f"Ошибка при начислении реферальных наград: {e}")
+        return []
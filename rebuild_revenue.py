@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Пересчет дневных итогов выручки (таблица revenue_daily) по всем платежам
+Запуск: python rebuild_revenue.py
+"""
+
+import asyncio
+import logging
+
+from models.payment import rebuild_revenue_rollups
+from utils.database import close_storage
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+
+async def main():
+    try:
+        rows = await rebuild_revenue_rollups()
+        print(f"✅ Пересчитано дневных итогов: {rows}")
+    finally:
+        await close_storage()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,8 @@
+"""
+Пакет хранилищ данных
+Реализации подключаются лениво, чтобы не тянуть необязательные зависимости
+"""
+
+from .base import Storage, NotificationKey, TIMESTAMP_COLUMNS, parse_timestamp
+
+__all__ = ['Storage', 'NotificationKey', 'TIMESTAMP_COLUMNS', 'parse_timestamp']
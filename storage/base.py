@@ -0,0 +1,298 @@
+"""
+Интерфейс хранилища данных бота
+Все модели работают с БД только через методы Storage
+"""
+
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timezone
+from typing import Optional, Dict, Any, AsyncIterator, List, Sequence, Tuple, Union
+
+# Колонки, которые читают потоковые выборки (iter_*) по умолчанию
+PAYMENT_STREAM_COLUMNS = ("id", "user_id", "amount", "currency", "subscription_type", "created_at")
+# Все колонки таблицы payments
+PAYMENT_COLUMNS = (
+    "id", "user_id", "amount", "currency", "telegram_payment_charge_id",
+    "provider_payment_charge_id", "subscription_type", "status", "created_at"
+)
+SUBSCRIPTION_STREAM_COLUMNS = ("id", "user_id", "subscription_type", "expire_at")
+
+# Ключ журнала уведомлений: (user_id, subscription_id, kind)
+NotificationKey = Tuple[int, int, str]
+
+# Колонки с временными метками (во всех реализациях возвращаются строками ISO 8601)
+TIMESTAMP_COLUMNS = frozenset({"created_at", "last_activity", "expire_at"})
+
+
+def parse_timestamp(value: Union[str, datetime]) -> datetime:
+    """
+    Преобразует временную метку в datetime с часовым поясом UTC
+    Метки без часового пояса считаются UTC (как их пишут модели)
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class Storage(ABC):
+    """
+    Хранилище пользователей, подписок, платежей и рефералов
+
+    Строки возвращаются словарями в формате PostgREST:
+    временные метки - строки ISO 8601, суммы - float
+    """
+
+    # ----- Пользователи -----
+
+    @abstractmethod
+    async def get_user(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Получает пользователя по chat_id
+        """
+
+    @abstractmethod
+    async def insert_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Создает пользователя и возвращает созданную строку
+        """
+
+    @abstractmethod
+    async def upsert_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Атомарно создает пользователя или обновляет переданные поля
+        существующего (конфликт по chat_id), возвращает итоговую строку
+        """
+
+    @abstractmethod
+    async def update_user(self, chat_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Обновляет пользователя и возвращает обновленную строку
+        """
+
+    @abstractmethod
+    async def touch_users(self, activity: Dict[int, str]):
+        """
+        Пакетно обновляет last_activity (chat_id -> временная метка ISO)
+        одним запросом
+        """
+
+    @abstractmethod
+    async def block_users(self, chat_ids: List[int]):
+        """
+        Пакетно отмечает пользователей, заблокировавших бота (is_blocked)
+        """
+
+    @abstractmethod
+    async def count_users(self) -> int:
+        """
+        Возвращает количество пользователей
+        """
+
+    # ----- Подписки -----
+
+    @abstractmethod
+    async def get_active_subscription(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Получает активную подписку пользователя
+        """
+
+    @abstractmethod
+    async def insert_subscription(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Создает подписку и возвращает созданную строку
+        """
+
+    @abstractmethod
+    async def activate_subscription(self, user_id: int, subscription_type: Optional[str] = None,
+                                    days: Optional[int] = None,
+                                    expire_at: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Атомарно деактивирует текущую подписку пользователя и создает новую
+        (функция activate_subscription в БД)
+
+        days - продлить от текущего expire_at (или от текущего момента),
+        expire_at - установить дату окончания явно,
+        subscription_type None - сохранить тип текущей подписки
+        """
+
+    @abstractmethod
+    async def update_subscription(self, subscription_id: int,
+                                  data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Обновляет подписку и возвращает обновленную строку
+        """
+
+    @abstractmethod
+    async def deactivate_user_subscriptions(self, user_id: int) -> int:
+        """
+        Деактивирует все подписки пользователя, возвращает их количество
+        """
+
+    @abstractmethod
+    async def get_expiring_subscriptions(self, before: datetime) -> List[Dict[str, Any]]:
+        """
+        Получает активные подписки, истекающие раньше before,
+        вместе с вложенным пользователем users(chat_id, first_name)
+        """
+
+    @abstractmethod
+    def iter_expiring_subscriptions(self, after: datetime, before: datetime, page_size: int = 1000,
+                                    columns: Sequence[str] = SUBSCRIPTION_STREAM_COLUMNS
+                                    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Активные подписки с after <= expire_at < before страницами по page_size
+        (с вложенным users(chat_id, first_name)). Keyset-пагинация по (expire_at, id)
+        Подписки пользователей, заблокировавших бота, не возвращаются
+        """
+
+    @abstractmethod
+    def iter_subscriptions_created_after(self, after: datetime, page_size: int = 1000,
+                                         columns: Sequence[str] = SUBSCRIPTION_STREAM_COLUMNS
+                                         ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Активные подписки с created_at > after страницами по page_size.
+        Keyset-пагинация по (created_at, id), created_at всегда в выборке.
+        Подписки пользователей, заблокировавших бота, не возвращаются
+        """
+
+    @abstractmethod
+    async def deactivate_expired_subscriptions(self, now: datetime) -> int:
+        """
+        Деактивирует истекшие подписки, возвращает их количество
+        """
+
+    # ----- Платежи -----
+
+    @abstractmethod
+    async def insert_payment(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Создает запись о платеже и возвращает созданную строку
+        """
+
+    @abstractmethod
+    async def get_user_payments(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        """
+        Получает последние платежи пользователя
+        """
+
+    @abstractmethod
+    async def get_payment_by_charge_id(self, telegram_payment_charge_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Получает платеж по Telegram charge ID
+        """
+
+    @abstractmethod
+    async def get_total_revenue(self) -> float:
+        """
+        Возвращает сумму всех завершенных платежей (по дневным итогам)
+        """
+
+    @abstractmethod
+    async def get_revenue_by_day(self, start_day: date, end_day: date) -> List[Dict[str, Any]]:
+        """
+        Дневные итоги выручки за дни start_day..end_day включительно
+        (day, currency, amount, payments_count)
+        """
+
+    @abstractmethod
+    async def rebuild_revenue_daily(self) -> int:
+        """
+        Пересчитывает дневные итоги по всем платежам, возвращает число строк
+        """
+
+    async def get_payments_by_period(self, start_date: datetime, end_date: datetime,
+                                     page_size: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Получает завершенные платежи за период
+        Читается страницами через iter_payments_by_period (индекс по (created_at, id)),
+        а не одним запросом на весь период
+        """
+        return [
+            payment
+            async for page in self.iter_payments_by_period(start_date, end_date, page_size, PAYMENT_COLUMNS)
+            for payment in page
+        ]
+
+    @abstractmethod
+    def iter_payments_by_period(self, start_date: datetime, end_date: datetime, page_size: int = 1000,
+                                columns: Sequence[str] = PAYMENT_STREAM_COLUMNS
+                                ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Завершенные платежи за период страницами по page_size
+        Keyset-пагинация по (created_at, id)
+        """
+
+    # ----- Рефералы -----
+
+    @abstractmethod
+    async def register_referral(self, referrer_id: int, referred_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Атомарно привязывает приглашенного к рефереру, записывает приглашение
+        в журнал и увеличивает invited_count реферера (функция register_referral в БД).
+        None, если пользователь уже был приглашен
+        """
+
+    @abstractmethod
+    async def add_referral_reward(self, chat_id: int, amount: float) -> Optional[float]:
+        """
+        Атомарно увеличивает реферальный баланс, возвращает новый баланс
+        (None, если пользователя нет)
+        """
+
+    @abstractmethod
+    async def settle_referral_rewards(self, amount: float, limit: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Одним запросом начисляет награды за приглашения, по которым у друга есть
+        завершенный платеж (status = 'completed'), и возвращает их (referrer_id,
+        referred_id, reward_amount, referred_first_name)
+        """
+
+    @abstractmethod
+    async def get_referrals(self, referrer_id: int) -> List[Dict[str, Any]]:
+        """
+        Получает приглашения пользователя
+        """
+
+    # ----- Журнал уведомлений -----
+
+    @abstractmethod
+    async def claim_notifications(self, keys: List[NotificationKey]) -> List[NotificationKey]:
+        """
+        Записывает уведомления (user_id, subscription_id, kind) в журнал
+        и возвращает только те, которых там еще не было
+        """
+
+    # ----- Служебное состояние бота -----
+
+    @abstractmethod
+    async def get_state(self, key: str) -> Optional[str]:
+        """
+        Читает значение из таблицы bot_state
+        """
+
+    @abstractmethod
+    async def set_state(self, key: str, value: str):
+        """
+        Сохраняет значение в таблицу bot_state
+        """
+
+    # ----- Аренды (выбор лидера) -----
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """
+        Захватывает или продлевает аренду name на ttl секунд
+        Успешно, если аренда свободна, истекла или уже принадлежит holder
+        """
+
+    @abstractmethod
+    async def release_lease(self, name: str, holder: str):
+        """
+        Освобождает аренду, если она принадлежит holder
+        """
+
+    async def close(self):
+        """
+        Освобождает ресурсы хранилища
+        """
@@ -0,0 +1,153 @@
+"""
+Замер времени запросов к хранилищу
+"""
+
+import functools
+import inspect
+import time
+from typing import Any, AsyncIterator, Dict
+
+from utils.metrics import storage_duration, storage_errors
+
+from .base import Storage
+
+# Таблица, к которой обращается метод Storage (метка table)
+METHOD_TABLES: Dict[str, str] = {
+    **dict.fromkeys((
+        "get_user", "insert_user", "upsert_user", "update_user",
+        "touch_users", "block_users", "count_users"
+    ), "users"),
+    **dict.fromkeys((
+        "get_active_subscription", "insert_subscription", "activate_subscription",
+        "update_subscription", "deactivate_user_subscriptions", "get_expiring_subscriptions",
+        "iter_expiring_subscriptions", "iter_subscriptions_created_after",
+        "deactivate_expired_subscriptions"
+    ), "subscriptions"),
+    **dict.fromkeys((
+        "insert_payment", "get_user_payments", "get_payment_by_charge_id",
+        "get_payments_by_period", "iter_payments_by_period"
+    ), "payments"),
+    **dict.fromkeys(("get_total_revenue", "get_revenue_by_day", "rebuild_revenue_daily"), "revenue_daily"),
+    **dict.fromkeys((
+        "register_referral", "add_referral_reward", "settle_referral_rewards", "get_referrals"
+    ), "referrals"),
+    "claim_notifications": "notification_log",
+    "get_state": "bot_state",
+    "set_state": "bot_state",
+    "acquire_lease": "leases",
+    "release_lease": "leases",
+}
+
+
+def _instrumented(name: str):
+    """
+    Метод InstrumentedStorage: передает вызов обернутому хранилищу и
+    записывает время и ошибки (для потоковых iter_* - каждой страницы)
+    """
+    table = METHOD_TABLES[name]
+    base_method = getattr(Storage, name)
+    # Дочерние метрики создаются при первом вызове
+    children = []
+
+    def metrics():
+        if not children:
+            children.extend((storage_duration.labels(table, name), storage_errors.labels(table, name)))
+        return children
+
+    if inspect.iscoroutinefunction(base_method):
+        @functools.wraps(base_method, updated=())
+        async def method(self, *args, **kwargs):
+            duration, errors = metrics()
+            started = time.perf_counter()
+            try:
+                return await getattr(self.storage, name)(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                duration.observe(time.perf_counter() - started)
+    else:
+        @functools.wraps(base_method, updated=())
+        async def method(self, *args, **kwargs) -> AsyncIterator[Any]:
+            duration, errors = metrics()
+            iterator = getattr(self.storage, name)(*args, **kwargs).__aiter__()
+            while True:
+                started = time.perf_counter()
+                try:
+                    page = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    duration.observe(time.perf_counter() - started)
+                yield page
+
+    return method
+
+
+class InstrumentedStorage(Storage):
+    """
+    Обертка над Storage: время и ошибки каждого вызова по таблице и методу
+    (для потоковых iter_* - каждой страницы). Остальные атрибуты
+    передаются обернутому хранилищу
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+
+    def __getattr__(self, name: str) -> Any:
+        # Атрибуты конкретной реализации (например, pool у PostgresStorage)
+        return getattr(self.storage, name)
+
+    # ----- Пользователи -----
+
+    get_user = _instrumented("get_user")
+    insert_user = _instrumented("insert_user")
+    upsert_user = _instrumented("upsert_user")
+    update_user = _instrumented("update_user")
+    touch_users = _instrumented("touch_users")
+    block_users = _instrumented("block_users")
+    count_users = _instrumented("count_users")
+
+    # ----- Подписки -----
+
+    get_active_subscription = _instrumented("get_active_subscription")
+    insert_subscription = _instrumented("insert_subscription")
+    activate_subscription = _instrumented("activate_subscription")
+    update_subscription = _instrumented("update_subscription")
+    deactivate_user_subscriptions = _instrumented("deactivate_user_subscriptions")
+    get_expiring_subscriptions = _instrumented("get_expiring_subscriptions")
+    iter_expiring_subscriptions = _instrumented("iter_expiring_subscriptions")
+    iter_subscriptions_created_after = _instrumented("iter_subscriptions_created_after")
+    deactivate_expired_subscriptions = _instrumented("deactivate_expired_subscriptions")
+
+    # ----- Платежи -----
+
+    insert_payment = _instrumented("insert_payment")
+    get_user_payments = _instrumented("get_user_payments")
+    get_payment_by_charge_id = _instrumented("get_payment_by_charge_id")
+    get_total_revenue = _instrumented("get_total_revenue")
+    get_revenue_by_day = _instrumented("get_revenue_by_day")
+    rebuild_revenue_daily = _instrumented("rebuild_revenue_daily")
+    get_payments_by_period = _instrumented("get_payments_by_period")
+    iter_payments_by_period = _instrumented("iter_payments_by_period")
+
+    # ----- Рефералы -----
+
+    register_referral = _instrumented("register_referral")
+    add_referral_reward = _instrumented("add_referral_reward")
+    settle_referral_rewards = _instrumented("settle_referral_rewards")
+    get_referrals = _instrumented("get_referrals")
+
+    # ----- Служебные таблицы -----
+
+    claim_notifications = _instrumented("claim_notifications")
+    get_state = _instrumented("get_state")
+    set_state = _instrumented("set_state")
+    acquire_lease = _instrumented("acquire_lease")
+    release_lease = _instrumented("release_lease")
+
+    async def close(self):
+        await self.storage.close()
@@ -0,0 +1,435 @@
+"""
+Хранилище в памяти процесса
+Используется для офлайн-тестов и нагрузочных прогонов хендлеров без сети
+"""
+
+import asyncio
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, Dict, Any, AsyncIterator, Iterable, List, Sequence, Set, Tuple
+
+from .base import (
+    Storage, NotificationKey, TIMESTAMP_COLUMNS, PAYMENT_STREAM_COLUMNS, SUBSCRIPTION_STREAM_COLUMNS, parse_timestamp
+)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _normalize(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Приводит временные метки к виду, который возвращает PostgREST
+    """
+    row = dict(data)
+    for key in TIMESTAMP_COLUMNS:
+        if row.get(key) is not None:
+            row[key] = parse_timestamp(row[key]).isoformat()
+    return row
+
+
+def _project(row: Dict[str, Any], columns: Iterable[str]) -> Dict[str, Any]:
+    return {column: row.get(column) for column in columns}
+
+
+class InMemoryStorage(Storage):
+    """
+    Реализация Storage на словарях
+
+    latency - искусственная задержка на каждый вызов (имитация сетевого
+    round-trip), roundtrips - счетчик вызовов хранилища
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.roundtrips = 0
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.subscriptions: Dict[int, Dict[str, Any]] = {}
+        self.payments: Dict[int, Dict[str, Any]] = {}
+        self.referrals: Dict[int, Dict[str, Any]] = {}
+        # (day, currency) -> дневной итог, как таблица revenue_daily
+        self.revenue_daily: Dict[tuple, Dict[str, Any]] = {}
+        self.state: Dict[str, str] = {}
+        self.notification_log: Set[NotificationKey] = set()
+        # name -> (holder, время истечения), как таблица leases
+        self.leases: Dict[str, Tuple[str, float]] = {}
+        self._ids: Dict[str, int] = {}
+
+    async def _roundtrip(self):
+        self.roundtrips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _next_id(self, table: str) -> int:
+        self._ids[table] = self._ids.get(table, 0) + 1
+        return self._ids[table]
+
+    # ----- Пользователи -----
+
+    async def get_user(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        await self._roundtrip()
+        user = self.users.get(chat_id)
+        return dict(user) if user else None
+
+    async def insert_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        await self._roundtrip()
+        if data["chat_id"] in self.users:
+            raise ValueError(f"duplicate key value violates unique constraint: chat_id={data['chat_id']}")
+        return self._insert_user(data)
+
+    async def upsert_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        await self._roundtrip()
+        user = self.users.get(data["chat_id"])
+        if user is None:
+            return self._insert_user(data)
+        user.update(_normalize(data))
+        return dict(user)
+
+    def _insert_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        user = {
+            "id": self._next_id("users"),
+            "username": None,
+            "first_name": None,
+            "last_name": None,
+            "created_at": _now(),
+            "last_activity": _now(),
+            "referral_balance": 0,
+            "invited_count": 0,
+            "referred_by": None,
+            "is_blocked": False
+        }
+        user.update(_normalize(data))
+        self.users[user["chat_id"]] = user
+        return dict(user)
+
+    async def update_user(self, chat_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        await self._roundtrip()
+        user = self.users.get(chat_id)
+        if user is None:
+            return None
+        user.update(_normalize(data))
+        return dict(user)
+
+    async def touch_users(self, activity: Dict[int, str]):
+        await self._roundtrip()
+        for chat_id, seen_at in activity.items():
+            user = self.users.get(chat_id)
+            if user is not None:
+                user["last_activity"] = parse_timestamp(seen_at).isoformat()
+
+    async def block_users(self, chat_ids: List[int]):
+        await self._roundtrip()
+        for chat_id in chat_ids:
+            user = self.users.get(chat_id)
+            if user is not None:
+                user["is_blocked"] = True
+
+    async def count_users(self) -> int:
+        await self._roundtrip()
+        return len(self.users)
+
+    # ----- Подписки -----
+
+    async def get_active_subscription(self, user_id: int) -> Optional[Dict[str, Any]]:
+        await self._roundtrip()
+        for subscription in self.subscriptions.values():
+            if subscription["user_id"] == user_id and subscription["is_active"]:
+                return dict(subscription)
+        return None
+
+    async def insert_subscription(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        await self._roundtrip()
+        subscription = {"id": self._next_id("subscriptions"), "is_active": True, "created_at": _now()}
+        subscription.update(_normalize(data))
+        self.subscriptions[subscription["id"]] = subscription
+        return dict(subscription)
+
+    async def activate_subscription(self, user_id: int, subscription_type: Optional[str] = None,
+                                    days: Optional[int] = None,
+                                    expire_at: Optional[datetime] = None) -> Dict[str, Any]:
+        await self._roundtrip()
+        now = datetime.now(timezone.utc)
+        current = None
+        for subscription in self.subscriptions.values():
+            if subscription["user_id"] == user_id and subscription["is_active"]:
+                current = subscription
+                subscription["is_active"] = False
+
+        if days is not None:
+            base = max(now, parse_timestamp(current["expire_at"])) if current else now
+            expire_at = base + timedelta(days=days)
+
+        subscription = {
+            "id": self._next_id("subscriptions"),
+            "user_id": user_id,
+            "subscription_type": subscription_type or (current["subscription_type"] if current else "premium"),
+            "expire_at": parse_timestamp(expire_at).isoformat(),
+            "is_active": True,
+            "created_at": now.isoformat()
+        }
+        self.subscriptions[subscription["id"]] = subscription
+        return dict(subscription)
+
+    async def update_subscription(self, subscription_id: int,
+                                  data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        await self._roundtrip()
+        subscription = self.subscriptions.get(subscription_id)
+        if subscription is None:
+            return None
+        subscription.update(_normalize(data))
+        return dict(subscription)
+
+    async def deactivate_user_subscriptions(self, user_id: int) -> int:
+        await self._roundtrip()
+        count = 0
+        for subscription in self.subscriptions.values():
+            if subscription["user_id"] == user_id and subscription["is_active"]:
+                subscription["is_active"] = False
+                count += 1
+        return count
+
+    async def get_expiring_subscriptions(self, before: datetime) -> List[Dict[str, Any]]:
+        await self._roundtrip()
+        before = parse_timestamp(before)
+        rows = []
+        for subscription in self.subscriptions.values():
+            if subscription["is_active"] and parse_timestamp(subscription["expire_at"]) < before:
+                user = self.users.get(subscription["user_id"])
+                if user is None:
+                    continue
+                row = dict(subscription)
+                row["users"] = {"chat_id": user["chat_id"], "first_name": user["first_name"]}
+                rows.append(row)
+        return rows
+
+    async def iter_expiring_subscriptions(self, after: datetime, before: datetime, page_size: int = 1000,
+                                          columns: Sequence[str] = SUBSCRIPTION_STREAM_COLUMNS
+                                          ) -> AsyncIterator[List[Dict[str, Any]]]:
+        columns = dict.fromkeys(("id", "expire_at", *columns))
+        before = parse_timestamp(before)
+        cursor = (parse_timestamp(after), 0)
+        while True:
+            await self._roundtrip()
+            matches = sorted(
+                ((parse_timestamp(s["expire_at"]), s["id"]), s) for s in self.subscriptions.values()
+                if s["is_active"] and s["user_id"] in self.users
+                and not self.users[s["user_id"]]["is_blocked"]
+                and (parse_timestamp(s["expire_at"]), s["id"]) > cursor
+                and parse_timestamp(s["expire_at"]) < before
+            )[:page_size]
+            if not matches:
+                return
+            cursor = matches[-1][0]
+            page = []
+            for _, subscription in matches:
+                user = self.users[subscription["user_id"]]
+                row = _project(subscription, columns)
+                row["users"] = {"chat_id": user["chat_id"], "first_name": user["first_name"]}
+                page.append(row)
+            yield page
+            if len(matches) < page_size:
+                return
+
+    async def iter_subscriptions_created_after(self, after: datetime, page_size: int = 1000,
+                                               columns: Sequence[str] = SUBSCRIPTION_STREAM_COLUMNS
+                                               ) -> AsyncIterator[List[Dict[str, Any]]]:
+        columns = dict.fromkeys(("id", "created_at", *columns))
+        after = parse_timestamp(after)
+        cursor = (after, 0)
+        while True:
+            await self._roundtrip()
+            matches = sorted(
+                ((parse_timestamp(s["created_at"]), s["id"]), s) for s in self.subscriptions.values()
+                if s["is_active"] and s["user_id"] in self.users
+                and not self.users[s["user_id"]]["is_blocked"]
+                and parse_timestamp(s["created_at"]) > after
+                and (parse_timestamp(s["created_at"]), s["id"]) > cursor
+            )[:page_size]
+            if not matches:
+                return
+            cursor = matches[-1][0]
+            yield [_project(subscription, columns) for _, subscription in matches]
+            if len(matches) < page_size:
+                return
+
+    async def deactivate_expired_subscriptions(self, now: datetime) -> int:
+        await self._roundtrip()
+        now = parse_timestamp(now)
+        count = 0
+        for subscription in self.subscriptions.values():
+            if subscription["is_active"] and parse_timestamp(subscription["expire_at"]) < now:
+                subscription["is_active"] = False
+                count += 1
+        return count
+
+    # ----- Платежи -----
+
+    async def insert_payment(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        await self._roundtrip()
+        charge_id = data["telegram_payment_charge_id"]
+        if any(p["telegram_payment_charge_id"] == charge_id for p in self.payments.values()):
+            raise ValueError(f"duplicate key value violates unique constraint: {charge_id}")
+        payment = {"id": self._next_id("payments"), "status": "completed", "created_at": _now()}
+        payment.update(_normalize(data))
+        self.payments[payment["id"]] = payment
+        self._add_revenue(payment)
+        return dict(payment)
+
+    def _add_revenue(self, payment: Dict[str, Any]):
+        # Аналог триггера payments_revenue_daily
+        if payment["status"] != "completed":
+            return
+        day = parse_timestamp(payment["created_at"]).date().isoformat()
+        row = self.revenue_daily.setdefault((day, payment["currency"]), {
+            "day": day, "currency": payment["currency"], "amount": 0.0, "payments_count": 0
+        })
+        row["amount"] += payment["amount"]
+        row["payments_count"] += 1
+
+    async def get_user_payments(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        await self._roundtrip()
+        payments = [dict(p) for p in self.payments.values() if p["user_id"] == user_id]
+        payments.sort(key=lambda p: parse_timestamp(p["created_at"]), reverse=True)
+        return payments[:limit]
+
+    async def get_payment_by_charge_id(self, telegram_payment_charge_id: str) -> Optional[Dict[str, Any]]:
+        await self._roundtrip()
+        for payment in self.payments.values():
+            if payment["telegram_payment_charge_id"] == telegram_payment_charge_id:
+                return dict(payment)
+        return None
+
+    async def get_total_revenue(self) -> float:
+        await self._roundtrip()
+        return sum(row["amount"] for row in self.revenue_daily.values())
+
+    async def get_revenue_by_day(self, start_day: date, end_day: date) -> List[Dict[str, Any]]:
+        await self._roundtrip()
+        start, end = start_day.isoformat(), end_day.isoformat()
+        return sorted(
+            (dict(row) for (day, _), row in self.revenue_daily.items() if start <= day <= end),
+            key=lambda row: row["day"]
+        )
+
+    async def rebuild_revenue_daily(self) -> int:
+        await self._roundtrip()
+        self.revenue_daily = {}
+        for payment in self.payments.values():
+            self._add_revenue(payment)
+        return len(self.revenue_daily)
+
+    async def iter_payments_by_period(self, start_date: datetime, end_date: datetime, page_size: int = 1000,
+                                      columns: Sequence[str] = PAYMENT_STREAM_COLUMNS
+                                      ) -> AsyncIterator[List[Dict[str, Any]]]:
+        columns = dict.fromkeys(("id", "created_at", *columns))
+        end_date = parse_timestamp(end_date)
+        cursor = (parse_timestamp(start_date), 0)
+        while True:
+            await self._roundtrip()
+            matches = sorted(
+                ((parse_timestamp(p["created_at"]), p["id"]), p) for p in self.payments.values()
+                if p["status"] == "completed"
+                and (parse_timestamp(p["created_at"]), p["id"]) > cursor
+                and parse_timestamp(p["created_at"]) <= end_date
+            )[:page_size]
+            if not matches:
+                return
+            cursor = matches[-1][0]
+            yield [_project(payment, columns) for _, payment in matches]
+            if len(matches) < page_size:
+                return
+
+    # ----- Рефералы -----
+
+    async def register_referral(self, referrer_id: int, referred_id: int) -> Optional[Dict[str, Any]]:
+        await self._roundtrip()
+        referred = self.users.get(referred_id)
+        if referred is None or referred.get("referred_by") or referred_id == referrer_id:
+            return None
+        referrer = self.users.get(referrer_id)
+        if referrer is None:
+            raise KeyError(f"Пользователь {referrer_id} не найден")
+
+        referred["referred_by"] = referrer_id
+        referrer["invited_count"] += 1
+        referral = {
+            "id": self._next_id("referrals"),
+            "referrer_id": referrer_id,
+            "referred_id": referred_id,
+            "reward_amount": 0.0,
+            "is_paid": False,
+            "created_at": _now()
+        }
+        self.referrals[referral["id"]] = referral
+        return dict(referral)
+
+    async def add_referral_reward(self, chat_id: int, amount: float) -> Optional[float]:
+        await self._roundtrip()
+        user = self.users.get(chat_id)
+        if user is None:
+            return None
+        user["referral_balance"] += amount
+        return user["referral_balance"]
+
+    async def settle_referral_rewards(self, amount: float, limit: int = 1000) -> List[Dict[str, Any]]:
+        await self._roundtrip()
+        payers = {payment["user_id"] for payment in self.payments.values() if payment["status"] == "completed"}
+        settled = []
+        for referral in sorted(self.referrals.values(), key=lambda r: r["id"]):
+            if len(settled) >= limit:
+                break
+            if referral["is_paid"] or referral["referred_id"] not in payers:
+                continue
+            referral["reward_amount"] = amount
+            referral["is_paid"] = True
+            self.users[referral["referrer_id"]]["referral_balance"] += amount
+            settled.append({
+                "referrer_id": referral["referrer_id"],
+                "referred_id": referral["referred_id"],
+                "reward_amount": amount,
+                "referred_first_name": self.users.get(referral["referred_id"], {}).get("first_name")
+            })
+        return settled
+
+    async def get_referrals(self, referrer_id: int) -> List[Dict[str, Any]]:
+        await self._roundtrip()
+        referrals = [dict(r) for r in self.referrals.values() if r["referrer_id"] == referrer_id]
+        referrals.sort(key=lambda r: parse_timestamp(r["created_at"]), reverse=True)
+        return referrals
+
+    # ----- Журнал уведомлений -----
+
+    async def claim_notifications(self, keys: List[NotificationKey]) -> List[NotificationKey]:
+        await self._roundtrip()
+        claimed = []
+        for key in keys:
+            if key not in self.notification_log:
+                self.notification_log.add(key)
+                claimed.append(key)
+        return claimed
+
+    # ----- Служебное состояние бота -----
+
+    async def get_state(self, key: str) -> Optional[str]:
+        await self._roundtrip()
+        return self.state.get(key)
+
+    async def set_state(self, key: str, value: str):
+        await self._roundtrip()
+        self.state[key] = value
+
+    # ----- Аренды (выбор лидера) -----
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        await self._roundtrip()
+        now = time.time()
+        current = self.leases.get(name)
+        if current is not None and current[0] != holder and current[1] >= now:
+            return False
+        self.leases[name] = (holder, now + ttl)
+        return True
+
+    async def release_lease(self, name: str, holder: str):
+        await self._roundtrip()
+        if self.leases.get(name, (None,))[0] == holder:
+            del self.leases[name]
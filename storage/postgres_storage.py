@@ -0,0 +1,365 @@
+"""
+Хранилище на прямом подключении к PostgreSQL (asyncpg)
+Работает с той же схемой, что и Supabase (database_setup.sql),
+но без HTTP-прослойки PostgREST
+"""
+
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional, Dict, Any, AsyncIterator, List, Sequence
+
+from .base import (
+    Storage, NotificationKey, TIMESTAMP_COLUMNS, PAYMENT_STREAM_COLUMNS, SUBSCRIPTION_STREAM_COLUMNS, parse_timestamp
+)
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover - зависимость нужна только для этого бэкенда
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+
+def _to_db(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Приводит значения к типам asyncpg (строки ISO -> datetime)
+    """
+    prepared = {}
+    for key, value in data.items():
+        if key in TIMESTAMP_COLUMNS and value is not None:
+            value = parse_timestamp(value)
+        prepared[key] = value
+    return prepared
+
+
+def _from_db(record) -> Optional[Dict[str, Any]]:
+    """
+    Приводит строку asyncpg к формату PostgREST
+    """
+    if record is None:
+        return None
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, date):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = float(value)
+        row[key] = value
+    return row
+
+
+def _insert_sql(table: str, data: Dict[str, Any]) -> str:
+    columns = ", ".join(data)
+    placeholders = ", ".join(f"${i}" for i in range(1, len(data) + 1))
+    return f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) RETURNING *"
+
+
+def _update_sql(table: str, data: Dict[str, Any], key: str) -> str:
+    assignments = ", ".join(f"{column} = ${i}" for i, column in enumerate(data, start=1))
+    return f"UPDATE {table} SET {assignments} WHERE {key} = ${len(data) + 1} RETURNING *"
+
+
+def _columns_sql(alias: str, columns: Sequence[str], *required: str) -> str:
+    return ", ".join(f"{alias}.{column}" for column in dict.fromkeys((*required, *columns)))
+
+
+class PostgresStorage(Storage):
+    """
+    Реализация Storage через пул соединений asyncpg
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    async def connect(cls, dsn: str, min_size: int = 2, max_size: int = 10,
+                      statement_cache_size: int = 100) -> "PostgresStorage":
+        """
+        Создает пул соединений
+        Для pgbouncer в режиме transaction укажите statement_cache_size=0
+        """
+        if asyncpg is None:
+            raise RuntimeError("Для STORAGE_BACKEND=postgres установите пакет asyncpg")
+
+        pool = await asyncpg.create_pool(
+            dsn,
+            min_size=min_size,
+            max_size=max_size,
+            statement_cache_size=statement_cache_size
+        )
+        logger.info(f"Создан пул соединений PostgreSQL ({min_size}-{max_size})")
+        return cls(pool)
+
+    async def _insert(self, table: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        data = _to_db(data)
+        return _from_db(await self.pool.fetchrow(_insert_sql(table, data), *data.values()))
+
+    async def _update(self, table: str, key: str, key_value: Any,
+                      data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        data = _to_db(data)
+        return _from_db(await self.pool.fetchrow(_update_sql(table, data, key), *data.values(), key_value))
+
+    # ----- Пользователи -----
+
+    async def get_user(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        return _from_db(await self.pool.fetchrow("SELECT * FROM users WHERE chat_id = $1", chat_id))
+
+    async def insert_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._insert("users", data)
+
+    async def upsert_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        data = _to_db(data)
+        assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in data if column != "chat_id")
+        sql = _insert_sql("users", data).replace(
+            " RETURNING *", f" ON CONFLICT (chat_id) DO UPDATE SET {assignments} RETURNING *"
+        )
+        return _from_db(await self.pool.fetchrow(sql, *data.values()))
+
+    async def update_user(self, chat_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await self._update("users", "chat_id", chat_id, data)
+
+    async def touch_users(self, activity: Dict[int, str]):
+        await self.pool.execute(
+            """
+            UPDATE users u SET last_activity = t.seen_at
+            FROM unnest($1::bigint[], $2::timestamptz[]) AS t(chat_id, seen_at)
+            WHERE u.chat_id = t.chat_id
+            """,
+            list(activity.keys()),
+            [parse_timestamp(value) for value in activity.values()]
+        )
+
+    async def block_users(self, chat_ids: List[int]):
+        await self.pool.execute(
+            "UPDATE users SET is_blocked = TRUE WHERE chat_id = ANY($1::bigint[])", chat_ids
+        )
+
+    async def count_users(self) -> int:
+        return await self.pool.fetchval("SELECT count(*) FROM users")
+
+    # ----- Подписки -----
+
+    async def get_active_subscription(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return _from_db(await self.pool.fetchrow(
+            "SELECT * FROM subscriptions WHERE user_id = $1 AND is_active LIMIT 1", user_id
+        ))
+
+    async def insert_subscription(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._insert("subscriptions", data)
+
+    async def activate_subscription(self, user_id: int, subscription_type: Optional[str] = None,
+                                    days: Optional[int] = None,
+                                    expire_at: Optional[datetime] = None) -> Dict[str, Any]:
+        return _from_db(await self.pool.fetchrow(
+            "SELECT * FROM activate_subscription($1, $2, $3, $4)",
+            user_id, subscription_type, days,
+            parse_timestamp(expire_at) if expire_at else None
+        ))
+
+    async def update_subscription(self, subscription_id: int,
+                                  data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await self._update("subscriptions", "id", subscription_id, data)
+
+    async def deactivate_user_subscriptions(self, user_id: int) -> int:
+        status = await self.pool.execute(
+            "UPDATE subscriptions SET is_active = FALSE WHERE user_id = $1 AND is_active", user_id
+        )
+        return int(status.split()[-1])
+
+    async def get_expiring_subscriptions(self, before: datetime) -> List[Dict[str, Any]]:
+        records = await self.pool.fetch(
+            """
+            SELECT s.*, u.chat_id AS _chat_id, u.first_name AS _first_name
+            FROM subscriptions s
+            JOIN users u ON u.chat_id = s.user_id
+            WHERE s.is_active AND s.expire_at < $1
+            """,
+            parse_timestamp(before)
+        )
+        rows = []
+        for record in records:
+            row = _from_db(record)
+            row["users"] = {"chat_id": row.pop("_chat_id"), "first_name": row.pop("_first_name")}
+            rows.append(row)
+        return rows
+
+    async def iter_expiring_subscriptions(self, after: datetime, before: datetime, page_size: int = 1000,
+                                          columns: Sequence[str] = SUBSCRIPTION_STREAM_COLUMNS
+                                          ) -> AsyncIterator[List[Dict[str, Any]]]:
+        query = f"""
+            SELECT {_columns_sql("s", columns, "id", "expire_at")},
+                   u.chat_id AS _chat_id, u.first_name AS _first_name
+            FROM subscriptions s
+            JOIN users u ON u.chat_id = s.user_id
+            WHERE s.is_active AND NOT u.is_blocked
+              AND s.expire_at < $1 AND (s.expire_at, s.id) > ($2, $3)
+            ORDER BY s.expire_at, s.id
+            LIMIT $4
+        """
+        before = parse_timestamp(before)
+        last_expire_at, last_id = parse_timestamp(after), 0
+        while True:
+            records = await self.pool.fetch(query, before, last_expire_at, last_id, page_size)
+            if not records:
+                return
+            last_expire_at, last_id = records[-1]["expire_at"], records[-1]["id"]
+            page = []
+            for record in records:
+                row = _from_db(record)
+                row["users"] = {"chat_id": row.pop("_chat_id"), "first_name": row.pop("_first_name")}
+                page.append(row)
+            yield page
+            if len(records) < page_size:
+                return
+
+    async def iter_subscriptions_created_after(self, after: datetime, page_size: int = 1000,
+                                               columns: Sequence[str] = SUBSCRIPTION_STREAM_COLUMNS
+                                               ) -> AsyncIterator[List[Dict[str, Any]]]:
+        query = f"""
+            SELECT {_columns_sql("s", columns, "id", "created_at")}
+            FROM subscriptions s
+            JOIN users u ON u.chat_id = s.user_id
+            WHERE s.is_active AND NOT u.is_blocked
+              AND s.created_at > $1 AND (s.created_at, s.id) > ($2, $3)
+            ORDER BY s.created_at, s.id
+            LIMIT $4
+        """
+        after = parse_timestamp(after)
+        last_created_at, last_id = after, 0
+        while True:
+            records = await self.pool.fetch(query, after, last_created_at, last_id, page_size)
+            if not records:
+                return
+            last_created_at, last_id = records[-1]["created_at"], records[-1]["id"]
+            yield [_from_db(record) for record in records]
+            if len(records) < page_size:
+                return
+
+    async def deactivate_expired_subscriptions(self, now: datetime) -> int:
+        status = await self.pool.execute(
+            "UPDATE subscriptions SET is_active = FALSE WHERE is_active AND expire_at < $1",
+            parse_timestamp(now)
+        )
+        return int(status.split()[-1])
+
+    # ----- Платежи -----
+
+    async def insert_payment(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._insert("payments", data)
+
+    async def get_user_payments(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        records = await self.pool.fetch(
+            "SELECT * FROM payments WHERE user_id = $1 ORDER BY created_at DESC LIMIT $2",
+            user_id, limit
+        )
+        return [_from_db(record) for record in records]
+
+    async def get_payment_by_charge_id(self, telegram_payment_charge_id: str) -> Optional[Dict[str, Any]]:
+        return _from_db(await self.pool.fetchrow(
+            "SELECT * FROM payments WHERE telegram_payment_charge_id = $1", telegram_payment_charge_id
+        ))
+
+    async def get_total_revenue(self) -> float:
+        total = await self.pool.fetchval("SELECT get_total_revenue()")
+        return float(total)
+
+    async def get_revenue_by_day(self, start_day: date, end_day: date) -> List[Dict[str, Any]]:
+        records = await self.pool.fetch(
+            "SELECT * FROM revenue_daily WHERE day >= $1 AND day <= $2 ORDER BY day",
+            start_day, end_day
+        )
+        return [_from_db(record) for record in records]
+
+    async def rebuild_revenue_daily(self) -> int:
+        return await self.pool.fetchval("SELECT rebuild_revenue_daily()")
+
+    async def iter_payments_by_period(self, start_date: datetime, end_date: datetime, page_size: int = 1000,
+                                      columns: Sequence[str] = PAYMENT_STREAM_COLUMNS
+                                      ) -> AsyncIterator[List[Dict[str, Any]]]:
+        query = f"""
+            SELECT {_columns_sql("p", columns, "id", "created_at")}
+            FROM payments p
+            WHERE p.status = 'completed' AND p.created_at <= $1 AND (p.created_at, p.id) > ($2, $3)
+            ORDER BY p.created_at, p.id
+            LIMIT $4
+        """
+        end_date = parse_timestamp(end_date)
+        last_created_at, last_id = parse_timestamp(start_date), 0
+        while True:
+            records = await self.pool.fetch(query, end_date, last_created_at, last_id, page_size)
+            if not records:
+                return
+            last_created_at, last_id = records[-1]["created_at"], records[-1]["id"]
+            yield [_from_db(record) for record in records]
+            if len(records) < page_size:
+                return
+
+    # ----- Рефералы -----
+
+    async def register_referral(self, referrer_id: int, referred_id: int) -> Optional[Dict[str, Any]]:
+        return _from_db(await self.pool.fetchrow(
+            "SELECT * FROM register_referral($1, $2)", referrer_id, referred_id
+        ))
+
+    async def add_referral_reward(self, chat_id: int, amount: float) -> Optional[float]:
+        balance = await self.pool.fetchval(
+            "SELECT add_referral_reward($1, $2)", chat_id, Decimal(str(amount))
+        )
+        return float(balance) if balance is not None else None
+
+    async def settle_referral_rewards(self, amount: float, limit: int = 1000) -> List[Dict[str, Any]]:
+        rows = await self.pool.fetch(
+            "SELECT * FROM settle_referral_rewards($1, $2)", Decimal(str(amount)), limit
+        )
+        return [_from_db(row) for row in rows]
+
+    async def get_referrals(self, referrer_id: int) -> List[Dict[str, Any]]:
+        records = await self.pool.fetch(
+            "SELECT * FROM referrals WHERE referrer_id = $1 ORDER BY created_at DESC", referrer_id
+        )
+        return [_from_db(record) for record in records]
+
+    # ----- Журнал уведомлений -----
+
+    async def claim_notifications(self, keys: List[NotificationKey]) -> List[NotificationKey]:
+        if not keys:
+            return []
+        user_ids, subscription_ids, kinds = zip(*keys)
+        records = await self.pool.fetch(
+            """
+            INSERT INTO notification_log (user_id, subscription_id, kind)
+            SELECT * FROM unnest($1::bigint[], $2::integer[], $3::text[])
+            ON CONFLICT DO NOTHING
+            RETURNING user_id, subscription_id, kind
+            """,
+            list(user_ids), list(subscription_ids), list(kinds)
+        )
+        return [(record["user_id"], record["subscription_id"], record["kind"]) for record in records]
+
+    # ----- Служебное состояние бота -----
+
+    async def get_state(self, key: str) -> Optional[str]:
+        return await self.pool.fetchval("SELECT value FROM bot_state WHERE key = $1", key)
+
+    async def set_state(self, key: str, value: str):
+        await self.pool.execute(
+            """
+            INSERT INTO bot_state (key, value, updated_at) VALUES ($1, $2, NOW())
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+            """,
+            key, value
+        )
+
+    # ----- Аренды (выбор лидера) -----
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        return await self.pool.fetchval("SELECT acquire_lease($1, $2, $3)", name, holder, float(ttl))
+
+    async def release_lease(self, name: str, holder: str):
+        await self.pool.execute("DELETE FROM leases WHERE name = $1 AND holder = $2", name, holder)
+
+    async def close(self):
+        await self.pool.close()
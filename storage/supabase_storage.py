@@ -0,0 +1,257 @@
+"""
+Хранилище на Supabase (PostgREST поверх HTTP)
+"""
+
+from datetime import date, datetime
+from typing import Optional, Dict, Any, AsyncIterator, List, Sequence
+from supabase import AsyncClient
+
+from .base import Storage, NotificationKey, PAYMENT_STREAM_COLUMNS, SUBSCRIPTION_STREAM_COLUMNS
+
+
+def _quote(value: Any) -> str:
+    """
+    Экранирует значение для фильтров or=(...) PostgREST
+    (в ISO-времени есть символы ":" и "+")
+    """
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _keyset_filter(column: str, value: Any, last_id: int) -> str:
+    """
+    Условие (column, id) > (value, last_id) в синтаксисе PostgREST
+    """
+    return f"{column}.gt.{_quote(value)},and({column}.eq.{_quote(value)},id.gt.{last_id})"
+
+
+def _select(columns: Sequence[str], *required: str) -> str:
+    return ", ".join(dict.fromkeys((*required, *columns)))
+
+
+class SupabaseStorage(Storage):
+    """
+    Реализация Storage через асинхронный клиент Supabase
+    """
+
+    def __init__(self, client: AsyncClient):
+        self.client = client
+
+    # ----- Пользователи -----
+
+    async def get_user(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        result = await self.client.table("users").select("*").eq("chat_id", chat_id).execute()
+        return result.data[0] if result.data else None
+
+    async def insert_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        result = await self.client.table("users").insert(data).execute()
+        return result.data[0] if result.data else data
+
+    async def upsert_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Один запрос: INSERT ... ON CONFLICT (chat_id) DO UPDATE только по переданным колонкам
+        result = await self.client.table("users").upsert(data, on_conflict="chat_id").execute()
+        return result.data[0] if result.data else data
+
+    async def update_user(self, chat_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        result = await self.client.table("users").update(data).eq("chat_id", chat_id).execute()
+        return result.data[0] if result.data else None
+
+    async def touch_users(self, activity: Dict[int, str]):
+        await self.client.rpc("touch_users", {
+            "p_chat_ids": list(activity.keys()),
+            "p_seen_at": list(activity.values())
+        }).execute()
+
+    async def block_users(self, chat_ids: List[int]):
+        await self.client.table("users").update({"is_blocked": True}).in_("chat_id", chat_ids).execute()
+
+    async def count_users(self) -> int:
+        result = await self.client.table("users").select("count", count="exact").execute()
+        return result.count or 0
+
+    # ----- Подписки -----
+
+    async def get_active_subscription(self, user_id: int) -> Optional[Dict[str, Any]]:
+        result = await self.client.table("subscriptions").select("*").eq("user_id", user_id).eq("is_active", True).execute()
+        return result.data[0] if result.data else None
+
+    async def insert_subscription(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        result = await self.client.table("subscriptions").insert(data).execute()
+        if not result.data:
+            raise Exception("Не удалось создать подписку")
+        return result.data[0]
+
+    async def activate_subscription(self, user_id: int, subscription_type: Optional[str] = None,
+                                    days: Optional[int] = None,
+                                    expire_at: Optional[datetime] = None) -> Dict[str, Any]:
+        result = await self.client.rpc("activate_subscription", {
+            "p_user_id": user_id,
+            "p_subscription_type": subscription_type,
+            "p_days": days,
+            "p_expire_at": expire_at.isoformat() if expire_at else None
+        }).execute()
+        if not result.data:
+            raise Exception("Не удалось активировать подписку")
+        return result.data[0] if isinstance(result.data, list) else result.data
+
+    async def update_subscription(self, subscription_id: int,
+                                  data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        result = await self.client.table("subscriptions").update(data).eq("id", subscription_id).execute()
+        return result.data[0] if result.data else None
+
+    async def deactivate_user_subscriptions(self, user_id: int) -> int:
+        result = await self.client.table("subscriptions").update({"is_active": False}).eq("user_id", user_id).eq("is_active", True).execute()
+        return len(result.data) if result.data else 0
+
+    async def get_expiring_subscriptions(self, before: datetime) -> List[Dict[str, Any]]:
+        result = await self.client.table("subscriptions").select("*, users(chat_id, first_name)").eq("is_active", True).lt("expire_at", before.isoformat()).execute()
+        return result.data if result.data else []
+
+    async def iter_expiring_subscriptions(self, after: datetime, before: datetime, page_size: int = 1000,
+                                          columns: Sequence[str] = SUBSCRIPTION_STREAM_COLUMNS
+                                          ) -> AsyncIterator[List[Dict[str, Any]]]:
+        select = _select(columns, "id", "expire_at") + ", users!inner(chat_id, first_name)"
+        last_expire_at, last_id = after.isoformat(), 0
+        while True:
+            result = await self.client.table("subscriptions").select(select).eq("is_active", True).eq("users.is_blocked", False).lt("expire_at", before.isoformat()).or_(_keyset_filter("expire_at", last_expire_at, last_id)).order("expire_at").order("id").limit(page_size).execute()
+            page = result.data or []
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            last_expire_at, last_id = page[-1]["expire_at"], page[-1]["id"]
+
+    async def iter_subscriptions_created_after(self, after: datetime, page_size: int = 1000,
+                                               columns: Sequence[str] = SUBSCRIPTION_STREAM_COLUMNS
+                                               ) -> AsyncIterator[List[Dict[str, Any]]]:
+        select = _select(columns, "id", "created_at") + ", users!inner(is_blocked)"
+        after = after.isoformat()
+        last_created_at, last_id = after, 0
+        while True:
+            result = await self.client.table("subscriptions").select(select).eq("is_active", True).eq("users.is_blocked", False).gt("created_at", after).or_(_keyset_filter("created_at", last_created_at, last_id)).order("created_at").order("id").limit(page_size).execute()
+            page = result.data or []
+            if not page:
+                return
+            for row in page:
+                row.pop("users", None)
+            yield page
+            if len(page) < page_size:
+                return
+            last_created_at, last_id = page[-1]["created_at"], page[-1]["id"]
+
+    async def deactivate_expired_subscriptions(self, now: datetime) -> int:
+        result = await self.client.table("subscriptions").update({
+            "is_active": False
+        }).lt("expire_at", now.isoformat()).eq("is_active", True).execute()
+        return len(result.data) if result.data else 0
+
+    # ----- Платежи -----
+
+    async def insert_payment(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        result = await self.client.table("payments").insert(data).execute()
+        if not result.data:
+            raise Exception("Не удалось создать запись о платеже")
+        return result.data[0]
+
+    async def get_user_payments(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        result = await self.client.table("payments").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(limit).execute()
+        return result.data if result.data else []
+
+    async def get_payment_by_charge_id(self, telegram_payment_charge_id: str) -> Optional[Dict[str, Any]]:
+        result = await self.client.table("payments").select("*").eq("telegram_payment_charge_id", telegram_payment_charge_id).execute()
+        return result.data[0] if result.data else None
+
+    async def get_total_revenue(self) -> float:
+        result = await self.client.rpc("get_total_revenue").execute()
+        return float(result.data or 0)
+
+    async def get_revenue_by_day(self, start_day: date, end_day: date) -> List[Dict[str, Any]]:
+        result = await self.client.table("revenue_daily").select("*").gte("day", start_day.isoformat()).lte("day", end_day.isoformat()).order("day").execute()
+        return result.data if result.data else []
+
+    async def rebuild_revenue_daily(self) -> int:
+        result = await self.client.rpc("rebuild_revenue_daily").execute()
+        return int(result.data or 0)
+
+    async def iter_payments_by_period(self, start_date: datetime, end_date: datetime, page_size: int = 1000,
+                                      columns: Sequence[str] = PAYMENT_STREAM_COLUMNS
+                                      ) -> AsyncIterator[List[Dict[str, Any]]]:
+        select = _select(columns, "id", "created_at")
+        last_created_at, last_id = start_date.isoformat(), 0
+        while True:
+            result = await self.client.table("payments").select(select).eq("status", "completed").lte("created_at", end_date.isoformat()).or_(_keyset_filter("created_at", last_created_at, last_id)).order("created_at").order("id").limit(page_size).execute()
+            page = result.data or []
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            last_created_at, last_id = page[-1]["created_at"], page[-1]["id"]
+
+    # ----- Рефералы -----
+
+    async def register_referral(self, referrer_id: int, referred_id: int) -> Optional[Dict[str, Any]]:
+        result = await self.client.rpc("register_referral", {
+            "p_referrer_id": referrer_id,
+            "p_referred_id": referred_id
+        }).execute()
+        return result.data[0] if result.data else None
+
+    async def add_referral_reward(self, chat_id: int, amount: float) -> Optional[float]:
+        result = await self.client.rpc("add_referral_reward", {
+            "p_chat_id": chat_id,
+            "p_amount": amount
+        }).execute()
+        return float(result.data) if result.data is not None else None
+
+    async def settle_referral_rewards(self, amount: float, limit: int = 1000) -> List[Dict[str, Any]]:
+        result = await self.client.rpc("settle_referral_rewards", {
+            "p_amount": amount,
+            "p_limit": limit
+        }).execute()
+        return result.data or []
+
+    async def get_referrals(self, referrer_id: int) -> List[Dict[str, Any]]:
+        result = await self.client.table("referrals").select("*").eq("referrer_id", referrer_id).order("created_at", desc=True).execute()
+        return result.data if result.data else []
+
+    # ----- Журнал уведомлений -----
+
+    async def claim_notifications(self, keys: List[NotificationKey]) -> List[NotificationKey]:
+        if not keys:
+            return []
+        # ignore_duplicates: в ответе только вставленные строки
+        result = await self.client.table("notification_log").upsert(
+            [{"user_id": user_id, "subscription_id": subscription_id, "kind": kind}
+             for user_id, subscription_id, kind in keys],
+            on_conflict="user_id,subscription_id,kind",
+            ignore_duplicates=True
+        ).execute()
+        return [(row["user_id"], row["subscription_id"], row["kind"]) for row in result.data or []]
+
+    # ----- Служебное состояние бота -----
+
+    async def get_state(self, key: str) -> Optional[str]:
+        result = await self.client.table("bot_state").select("value").eq("key", key).limit(1).execute()
+        return result.data[0]["value"] if result.data else None
+
+    async def set_state(self, key: str, value: str):
+        await self.client.table("bot_state").upsert({
+            "key": key,
+            "value": value,
+            "updated_at": datetime.utcnow().isoformat()
+        }, on_conflict="key").execute()
+
+    # ----- Аренды (выбор лидера) -----
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        # Сравнение со временем БД, а не реплик: часы реплик могут расходиться
+        result = await self.client.rpc("acquire_lease", {
+            "p_name": name,
+            "p_holder": holder,
+            "p_ttl_seconds": ttl
+        }).execute()
+        return bool(result.data)
+
+    async def release_lease(self, name: str, holder: str):
+        await self.client.table("leases").delete().eq("name", name).eq("holder", holder).execute()
@@ -0,0 +1,102 @@
+"""
+Тесты планировщика событий истечения подписок
+"""
+
+import asyncio
+import unittest
+from datetime import datetime, timezone
+
+from utils.expiry_scheduler import EXPIRED, ExpiryScheduler
+
+
+def timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+class ExpirySchedulerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.now = 1000.0
+        self.state = {}
+        self.fired = []
+        self.failures = 0
+        self.subscriptions = [{"id": 1, "user_id": 7, "created_at": timestamp(0), "expire_at": timestamp(1010)}]
+        self.created_after = []
+        self.scheduler = ExpiryScheduler(
+            self.load, self.fire, self.get_state, self.set_state,
+            load_created=self.load_created, warning_days=(),
+            resync_interval=100, clock=lambda: self.now
+        )
+        self.task = asyncio.create_task(self.scheduler.run())
+        await self.advance(0)
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+
+    async def load(self, after, before):
+        yield [s for s in self.subscriptions if after.isoformat() <= s["expire_at"] < before.isoformat()]
+
+    async def load_created(self, after):
+        self.created_after.append(after.timestamp())
+        yield [s for s in self.subscriptions if s["created_at"] > after.isoformat()]
+
+    async def fire(self, events):
+        self.fired.append((self.now, [event["kind"] for event in events]))
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("storage unavailable")
+
+    async def get_state(self, key):
+        return self.state.get(key)
+
+    async def set_state(self, key, value):
+        self.state[key] = value
+
+    async def advance(self, seconds: float):
+        self.now += seconds
+        self.scheduler._wakeup.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    async def test_expired_event_fires_once(self):
+        await self.advance(15)
+        await self.advance(60)
+        self.assertEqual(self.fired, [(1015, [EXPIRED])])
+        self.assertEqual(float(self.state[ExpiryScheduler.STATE_KEY]), 1075)
+
+    async def test_failed_fire_is_retried_without_advancing_position(self):
+        self.failures = 2
+        await self.advance(15)
+        self.assertEqual(self.scheduler.fired_until, 1000)
+        self.assertNotIn(ExpiryScheduler.STATE_KEY, self.state)
+
+        # До истечения задержки повтора события не отправляются
+        await self.advance(1)
+        self.assertEqual(len(self.fired), 1)
+
+        await self.advance(ExpiryScheduler.RETRY_MIN)
+        self.assertEqual(len(self.fired), 2)
+        self.assertEqual(self.scheduler.fired_until, 1000)
+
+        await self.advance(2 * ExpiryScheduler.RETRY_MIN)
+        self.assertEqual([kinds for _, kinds in self.fired], [[EXPIRED]] * 3)
+        self.assertEqual(self.scheduler.fired_until, self.now)
+        self.assertEqual(float(self.state[ExpiryScheduler.STATE_KEY]), self.now)
+        self.assertEqual(len(self.scheduler), 0)
+
+    async def test_resync_reads_only_new_subscriptions(self):
+        # Подписка другого пользователя, активированная в другом процессе
+        self.subscriptions.append({"id": 2, "user_id": 8, "created_at": timestamp(1050), "expire_at": timestamp(5000)})
+        await self.advance(100)
+        self.assertEqual(self.created_after, [1000 - ExpiryScheduler.RESYNC_OVERLAP])
+        self.assertEqual(self.scheduler._active[8], (2, 5000))
+
+        await self.advance(100)
+        self.assertEqual(self.created_after[-1], 1050 - ExpiryScheduler.RESYNC_OVERLAP)
+
+        await self.advance(4000)
+        self.assertIn((self.now, [EXPIRED]), self.fired)
+
+
+if __name__ == "__main__":
+    unittest.main()
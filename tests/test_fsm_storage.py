@@ -0,0 +1,125 @@
+"""
+Тесты хранилищ состояний FSM (Redis и SQLite)
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm.sqlite_storage import SQLiteFSMStorage
+
+try:
+    from fakeredis import FakeAsyncRedis
+    from fsm.redis_storage import RedisFSMStorage
+except ImportError:
+    FakeAsyncRedis = None
+
+
+def make_key(user_id: int = 42) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+class FSMStorageTestMixin:
+    """
+    Общие проверки: наследники создают self.storage в asyncSetUp
+    """
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+
+    async def test_state_and_data_round_trip(self):
+        key = make_key()
+        await self.storage.set_state(key, "PaymentStates:waiting_for_payment")
+        await self.storage.set_data(key, {"tariff": "1_month", "price": 125})
+
+        self.assertEqual(await self.storage.get_state(key), "PaymentStates:waiting_for_payment")
+        self.assertEqual(await self.storage.get_data(key), {"tariff": "1_month", "price": 125})
+
+        updated = await self.storage.update_data(key, {"price": 300, "days": 30})
+        self.assertEqual(updated, {"tariff": "1_month", "price": 300, "days": 30})
+        self.assertEqual(await self.storage.get_data(key), updated)
+
+        await self.storage.set_state(key, None)
+        await self.storage.set_data(key, {})
+        self.assertIsNone(await self.storage.get_state(key))
+        self.assertEqual(await self.storage.get_data(key), {})
+
+    async def test_concurrent_operations_share_batches(self):
+        keys = [make_key(user_id) for user_id in range(100)]
+        await asyncio.gather(*(self.storage.set_data(key, {"user": key.user_id}) for key in keys))
+        self.assertLess(self.storage.batches, len(keys))
+
+        data = await asyncio.gather(*(self.storage.get_data(key) for key in keys))
+        self.assertEqual(data, [{"user": key.user_id} for key in keys])
+
+    async def test_unserializable_data_fails_only_its_caller(self):
+        good, bad = make_key(1), make_key(2)
+        results = await asyncio.gather(
+            self.storage.set_data(good, {"tariff": "1_month"}),
+            self.storage.set_data(bad, {"value": object()}),
+            self.storage.update_data(bad, {"value": object()}),
+            return_exceptions=True
+        )
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], TypeError)
+        self.assertIsInstance(results[2], TypeError)
+        self.assertEqual(await self.storage.get_data(good), {"tariff": "1_month"})
+
+
+@unittest.skipIf(FakeAsyncRedis is None, "нужны пакеты redis и fakeredis")
+class RedisFSMStorageTest(FSMStorageTestMixin, unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.redis = FakeAsyncRedis()
+        self.storage = RedisFSMStorage(self.redis, state_ttl=60)
+
+    async def test_writes_refresh_ttl(self):
+        key = make_key()
+        await self.storage.set_state(key, "PaymentStates:waiting_for_payment")
+        await self.storage.set_data(key, {"tariff": "1_month"})
+
+        state_key = self.storage.key_builder.build(key, "state")
+        data_key = self.storage.key_builder.build(key, "data")
+        self.assertTrue(0 < await self.redis.ttl(state_key) <= 60)
+        self.assertTrue(0 < await self.redis.ttl(data_key) <= 60)
+
+        await self.redis.expire(data_key, 5)
+        await self.storage.update_data(key, {"price": 125})
+        self.assertGreater(await self.redis.ttl(data_key), 5)
+
+
+class SQLiteFSMStorageTest(FSMStorageTestMixin, unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "fsm.sqlite3")
+        self.storage = SQLiteFSMStorage(self.path, state_ttl=60)
+
+    async def test_expired_state_is_not_read(self):
+        key = make_key()
+        await self.storage.set_state(key, "PaymentStates:waiting_for_payment")
+        await self.storage.set_data(key, {"tariff": "1_month"})
+
+        with mock.patch("fsm.sqlite_storage.time.time", return_value=time.time() + 61):
+            self.assertIsNone(await self.storage.get_state(key))
+            self.assertEqual(await self.storage.get_data(key), {})
+
+    async def test_state_survives_reopen(self):
+        key = make_key()
+        await self.storage.set_state(key, "PaymentStates:waiting_for_payment")
+        await self.storage.update_data(key, {"tariff": "1_month"})
+        await self.storage.close()
+
+        self.storage = SQLiteFSMStorage(self.path, state_ttl=60)
+        self.assertEqual(await self.storage.get_state(key), "PaymentStates:waiting_for_payment")
+        self.assertEqual(await self.storage.get_data(key), {"tariff": "1_month"})
+
+
+if __name__ == "__main__":
+    unittest.main()
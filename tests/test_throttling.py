@@ -0,0 +1,71 @@
+"""
+Тесты анти-флуда
+"""
+
+import asyncio
+import os
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from aiogram.types import Message, SuccessfulPayment, User  # noqa: E402
+
+from middlewares.throttling import ThrottlingMiddleware  # noqa: E402
+
+USER = User(id=42, is_bot=False, first_name="Test")
+
+
+def make_message(message_id: int, **content) -> Message:
+    return Message.model_validate({
+        "message_id": message_id,
+        "date": 0,
+        "chat": {"id": USER.id, "type": "private"},
+        "from": USER.model_dump(),
+        **content
+    })
+
+
+class ThrottlingMiddlewareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.middleware = ThrottlingMiddleware({"*": (10, 5)}, clock=lambda: self.now)
+        self.handled = []
+
+    async def handler(self, event, data):
+        self.handled.append(event)
+        return True
+
+    def feed(self, event):
+        return asyncio.run(self.middleware(self.handler, event, {"event_from_user": USER}))
+
+    def test_text_messages_over_limit_are_dropped(self):
+        for index in range(12):
+            self.feed(make_message(index, text="hi"))
+        self.assertEqual(len(self.handled), 10)
+
+    def test_successful_payment_after_burst_reaches_handler(self):
+        for index in range(10):
+            self.feed(make_message(index, text="hi"))
+
+        payment = make_message(100, successful_payment=SuccessfulPayment(
+            currency="XTR",
+            total_amount=125,
+            invoice_payload=f"subscription_1_month_{USER.id}",
+            telegram_payment_charge_id="charge",
+            provider_payment_charge_id="provider"
+        ).model_dump())
+        self.assertTrue(self.feed(payment))
+        self.assertIs(self.handled[-1], payment)
+
+    def test_bucket_refills_over_time(self):
+        for index in range(10):
+            self.feed(make_message(index, text="hi"))
+        self.now = 0.5
+        self.feed(make_message(10, text="hi"))
+        self.assertEqual(len(self.handled), 11)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+Тесты буфера отложенной записи
+"""
+
+import asyncio
+import unittest
+
+from utils.write_behind import WriteBehindBuffer
+
+
+class WriteBehindBufferTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.written = []
+        self.release = asyncio.Event()
+        self.fail = False
+        self.buffer = WriteBehindBuffer("test", self.flush)
+
+    async def flush(self, batch):
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("storage unavailable")
+        self.written.append(dict(batch))
+
+    async def test_discard_removes_pending_entry(self):
+        self.buffer.put(1, True)
+        await self.buffer.discard(1)
+        self.release.set()
+        await self.buffer.flush()
+        self.assertEqual(self.written, [])
+
+    async def test_discard_waits_for_in_flight_flush(self):
+        self.buffer.put(1, True)
+        flush = asyncio.create_task(self.buffer.flush())
+        await asyncio.sleep(0)
+
+        discard = asyncio.create_task(self.buffer.discard(1))
+        await asyncio.sleep(0)
+        self.assertFalse(discard.done())
+
+        self.release.set()
+        await discard
+        # Запись уже в БД: следующая запись по ключу ляжет после нее
+        self.assertEqual(self.written, [{1: True}])
+        await flush
+
+    async def test_discarded_entry_is_not_restored_after_failed_flush(self):
+        self.fail = True
+        self.buffer.put(1, True)
+        self.buffer.put(2, True)
+        flush = asyncio.create_task(self.buffer.flush())
+        await asyncio.sleep(0)
+
+        discard = asyncio.create_task(self.buffer.discard(1))
+        await asyncio.sleep(0)
+        self.release.set()
+        await asyncio.gather(flush, discard)
+
+        self.assertEqual(self.buffer._pending, {2: True})
+
+
+if __name__ == "__main__":
+    unittest.main()
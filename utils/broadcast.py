@@ -0,0 +1,227 @@
+"""
+Массовая рассылка с учетом лимитов Telegram
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Union
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Задание рассылки: chat_id и функция, которая отправляет сообщение в этот чат
+BroadcastJob = Tuple[int, Callable[[], Awaitable[Any]]]
+
+
+async def _iterate(jobs: Union[Iterable[BroadcastJob], AsyncIterable[BroadcastJob]]):
+    if hasattr(jobs, "__aiter__"):
+        async for job in jobs:
+            yield job
+    else:
+        for job in jobs:
+            yield job
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: не больше rate операций в секунду
+    с допустимым всплеском capacity
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        # Ожидающие получают токены по очереди
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """
+        Ждет, пока не освободится токен
+        """
+        async with self._lock:
+            while True:
+                now = self._clock()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Останавливает выдачу токенов на seconds секунд (после RetryAfter)
+        """
+        now = self._clock()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = now
+
+
+class Broadcaster:
+    """
+    Рассылка через пул из workers задач:
+    - общий лимит rate сообщений в секунду (token bucket);
+    - не чаще одного сообщения в per_chat_interval секунд в один чат;
+    - при TelegramRetryAfter вся рассылка ждет указанное время, частота
+      снижается и постепенно восстанавливается после успешных отправок;
+    - заблокировавшие бота пользователи считаются отдельно от ошибок
+
+    bucket - общий ограничитель для нескольких рассылок, идущих одновременно
+    (по умолчанию у рассылки свой)
+    """
+
+    # Во сколько раз снижать частоту после RetryAfter
+    BACKOFF_FACTOR = 0.8
+    # После скольких успешных отправок подряд повышать частоту и на сколько
+    RECOVER_AFTER = 100
+    RECOVER_FACTOR = 1.1
+
+    def __init__(self, rate: float = 30.0, per_chat_interval: float = 1.0,
+                 workers: int = 16, max_retries: int = 3,
+                 on_blocked: Optional[Callable[[int], Any]] = None,
+                 bucket: Optional[TokenBucket] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_rate = rate
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        # Вызывается с chat_id пользователя, заблокировавшего бота
+        self.on_blocked = on_blocked
+        self._clock = clock
+        self._bucket = bucket if bucket is not None else TokenBucket(rate, clock=clock)
+        # chat_id -> время последней отправки в чат
+        self._last_sent: Dict[int, float] = {}
+        self._success_streak = 0
+
+        # Статистика
+        self.delivered = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retried = 0
+        self.elapsed = 0.0
+
+    async def _wait_chat(self, chat_id: int):
+        # Сразу занимаем следующее окно чата, чтобы параллельные отправки
+        # в тот же чат выстроились друг за другом
+        now = self._clock()
+        last_sent = self._last_sent.get(chat_id)
+        slot = now if last_sent is None else max(now, last_sent + self.per_chat_interval)
+        self._last_sent[chat_id] = slot
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _on_retry_after(self, seconds: float):
+        self._bucket.pause(seconds)
+        self._bucket.rate = max(1.0, self._bucket.rate * self.BACKOFF_FACTOR)
+        self._success_streak = 0
+        logger.warning(f"Превышен лимит Telegram: пауза {seconds}с, "
+                       f"частота снижена до {self._bucket.rate:.1f} сообщ./с")
+
+    def _on_success(self):
+        self._success_streak += 1
+        if self._success_streak >= self.RECOVER_AFTER and self._bucket.rate < self.max_rate:
+            self._bucket.rate = min(self.max_rate, self._bucket.rate * self.RECOVER_FACTOR)
+            self._success_streak = 0
+
+    async def _send(self, chat_id: int, send: Callable[[], Awaitable[Any]]):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat(chat_id)
+            await self._bucket.acquire()
+
+            try:
+                await send()
+            except TelegramRetryAfter as e:
+                self._on_retry_after(e.retry_after)
+                if attempt < self.max_retries:
+                    self.retried += 1
+                    continue
+                self.failed += 1
+                logger.error(f"Сообщение пользователю {chat_id} не отправлено после {attempt + 1} попыток")
+            except TelegramForbiddenError:
+                self.blocked += 1
+                logger.warning(f"Пользователь {chat_id} заблокировал бота")
+                if self.on_blocked is not None:
+                    self.on_blocked(chat_id)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка при отправке сообщения пользователю {chat_id}: {e}")
+            else:
+                self.delivered += 1
+                self._on_success()
+            return
+
+    async def _worker(self, queue: "asyncio.Queue[Optional[BroadcastJob]]"):
+        while True:
+            job = await queue.get()
+            try:
+                if job is None:
+                    return
+                await self._send(*job)
+            finally:
+                queue.task_done()
+
+    def _forget_idle_chats(self):
+        # Паузы между сообщениями в один чат нужны только per_chat_interval секунд
+        threshold = self._clock() - self.per_chat_interval
+        self._last_sent = {chat_id: sent for chat_id, sent in self._last_sent.items() if sent > threshold}
+
+    async def run(self, jobs: Union[Iterable[BroadcastJob], AsyncIterable[BroadcastJob]]) -> Dict[str, Any]:
+        """
+        Выполняет рассылку и возвращает статистику
+        Задания читаются по мере отправки, поэтому их можно передавать
+        асинхронным генератором поверх потоковой выборки из БД
+        """
+        started = self._clock()
+        queue: "asyncio.Queue[Optional[BroadcastJob]]" = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+
+        try:
+            queued = 0
+            async for job in _iterate(jobs):
+                await queue.put(job)
+                queued += 1
+                if queued % 1000 == 0:
+                    self._forget_idle_chats()
+
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.elapsed += self._clock() - started
+
+        stats = self.stats()
+        logger.info(f"Рассылка завершена: доставлено {stats['delivered']}, заблокировали {stats['blocked']}, "
+                    f"ошибок {stats['failed']}, {stats['throughput']:.1f} сообщ./с")
+        return stats
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает счетчики доставки и фактическую скорость рассылки
+        """
+        return {
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "retried": self.retried,
+            "elapsed": self.elapsed,
+            "throughput": self.delivered / self.elapsed if self.elapsed else 0.0,
+            "rate": self._bucket.rate
+        }
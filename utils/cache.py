@@ -0,0 +1,99 @@
+"""
+Кэш в памяти процесса
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# Маркер отсутствия значения (None - допустимое закэшированное значение)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU-кэш ограниченного размера с временем жизни записей
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        # Увеличивается при каждой инвалидации, см. token()
+        self._epoch = 0
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Возвращает значение или MISSING, если его нет или оно устарело
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        value, expires_at = entry
+        if expires_at <= self._clock():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def token(self) -> int:
+        """
+        Метка состояния кэша, которую нужно получить до чтения из БД
+        и передать в set(): если за время чтения была инвалидация,
+        прочитанное (возможно, устаревшее) значение не сохранится
+        """
+        return self._epoch
+
+    def set(self, key: Hashable, value: Any, token: Optional[int] = None):
+        """
+        Сохраняет значение, вытесняя самые давно использованные записи
+        """
+        if token is not None and token != self._epoch:
+            return
+
+        self._data[key] = (value, self._clock() + self.ttl)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """
+        Удаляет значение из кэша
+        """
+        self._epoch += 1
+        self.invalidations += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._epoch += 1
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Возвращает счетчики попаданий и промахов
+        """
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
@@ -2,39 +2,112 @@
 Утилиты для работы с базой данных Supabase
 """
 
+import asyncio
 import logging
-from supabase import create_client, Client
+from typing import Optional
+from supabase import acreate_client, AsyncClient
 from config import config
+from storage import Storage
+from storage.instrumented import InstrumentedStorage
+from utils.singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
-# Глобальный клиент Supabase
-_supabase_client: Client = None
+# Глобальный асинхронный клиент Supabase
+_supabase_client: Optional[AsyncClient] = None
+_supabase_client_lock = asyncio.Lock()
 
+# Глобальное хранилище данных
+_storage: Optional[Storage] = None
+_storage_lock = asyncio.Lock()
 
-def get_supabase_client() -> Client:
+# Объединение одинаковых параллельных чтений из хранилища
+read_flight = SingleFlight()
+
+
+async def get_supabase_client() -> AsyncClient:
     """
-    Получает клиент Supabase (singleton)
+    Получает асинхронный клиент Supabase (singleton)
+    Запросы выполняются через httpx.AsyncClient и не блокируют event loop
     """
     global _supabase_client
     
     if _supabase_client is None:
-        _supabase_client = create_client(config.SUPABASE_URL, config.SUPABASE_KEY)
+        async with _supabase_client_lock:
+            if _supabase_client is None:
+                _supabase_client = await acreate_client(config.SUPABASE_URL, config.SUPABASE_KEY)
     
     return _supabase_client
 
 
+async def _create_storage() -> Storage:
+    """
+    Создает хранилище согласно config.STORAGE_BACKEND
+    """
+    if config.STORAGE_BACKEND == "postgres":
+        from storage.postgres_storage import PostgresStorage
+        return await PostgresStorage.connect(
+            config.DATABASE_URL,
+            min_size=config.DATABASE_POOL_MIN_SIZE,
+            max_size=config.DATABASE_POOL_MAX_SIZE,
+            statement_cache_size=config.DATABASE_STATEMENT_CACHE_SIZE
+        )
+    
+    if config.STORAGE_BACKEND == "memory":
+        from storage.memory_storage import InMemoryStorage
+        return InMemoryStorage()
+    
+    from storage.supabase_storage import SupabaseStorage
+    return SupabaseStorage(await get_supabase_client())
+
+
+async def get_storage() -> Storage:
+    """
+    Получает хранилище данных (singleton)
+    """
+    global _storage
+    
+    if _storage is None:
+        async with _storage_lock:
+            if _storage is None:
+                storage = await _create_storage()
+                logger.info(f"Хранилище данных: {type(storage).__name__}")
+                # Время запросов по таблицам для /metrics
+                _storage = InstrumentedStorage(storage)
+    
+    return _storage
+
+
+def set_storage(storage: Optional[Storage]):
+    """
+    Подменяет хранилище (для бенчмарков и офлайн-прогонов)
+    """
+    global _storage
+    _storage = storage
+
+
+async def close_storage():
+    """
+    Закрывает хранилище при остановке бота
+    """
+    global _storage
+    
+    if _storage is not None:
+        await _storage.close()
+        _storage = None
+
+
 async def init_database():
     """
     Инициализирует базу данных и создает необходимые таблицы
     """
     try:
-        supabase = get_supabase_client()
+        storage = await get_storage()
         
         # Проверяем подключение к базе данных
         try:
-            result = supabase.table("users").select("count", count="exact").execute()
-            logger.info(f"Подключение к Supabase успешно. Пользователей в БД: {result.count}")
+            users_count = await storage.count_users()
+            logger.info(f"Подключение к базе данных успешно. Пользователей в БД: {users_count}")
         except Exception as table_error:
             logger.warning(f"Таблица users не существует: {table_error}")
             logger.info("Создайте таблицы в Supabase Dashboard используя database_setup.sql")
@@ -52,7 +125,7 @@ async def create_tables_if_not_exist():
     Создает таблицы в Supabase, если они не существуют
     """
     try:
-        supabase = get_supabase_client()
+        supabase = await get_supabase_client()
         
         # SQL для создания таблиц
         create_users_table = """
@@ -128,17 +201,22 @@ async def cleanup_expired_subscriptions():
     """
     try:
         from datetime import datetime
-        supabase = get_supabase_client()
-        
-        now = datetime.utcnow().isoformat()
+        storage = await get_storage()
         
         # Деактивируем истекшие подписки
-        result = supabase.table("subscriptions").update({
-            "is_active": False
-        }).lt("expire_at", now).eq("is_active", True).execute()
+        deactivated = await storage.deactivate_expired_subscriptions(datetime.utcnow())
         
-        if result.data:
-            logger.info(f"Деактивировано истекших подписок: {len(result.data)}")
+        if deactivated:
+            logger.info(f"Деактивировано истекших подписок: {deactivated}")
         
     except Exception as e:
         logger.error(f"Ошибка при очистке истекших подписок: {e}")
+
+
+async def run_subscription_cleanup(interval: float = 60 * 60):
+    """
+    Деактивирует истекшие подписки раз в interval секунд
+    """
+    while True:
+        await cleanup_expired_subscriptions()
+        await asyncio.sleep(interval)
@@ -0,0 +1,307 @@
+"""
+Планировщик событий истечения подписок
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from storage import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# Событие истечения подписки - "expired"
+EXPIRED = "expired"
+
+
+def warning_kind(days: int) -> str:
+    """
+    Тип события предупреждения за days дней
+    """
+    return f"warning_{days}d"
+
+
+class ExpiryScheduler:
+    """
+    Мин-куча событий (предупреждения за N дней и истечение), упорядоченных
+    по времени срабатывания
+
+    В памяти держатся только подписки, события которых наступают в ближайшие
+    horizon секунд: окно догружается из БД по мере движения времени.
+    Позиция fired_until (до какого момента все события обработаны)
+    сохраняется в БД, после перезапуска догружаются только подписки
+    с expire_at после нее - без полного сканирования.
+
+    Изменения подписок в этом процессе передаются в on_subscription_changed,
+    устаревшие события из кучи отбрасываются при извлечении. Изменения в
+    других процессах (WORKERS > 1) и репликах сюда не приходят. Активация
+    и продление всегда создают новую строку подписки, поэтому раз в
+    resync_interval секунд из БД читаются только подписки, созданные после
+    прошлого перечитывания (load_created), а не все загруженное окно.
+    Деактивации не перечитываются: fire перепроверяет подписку перед отправкой
+
+    Если fire завершился ошибкой, события возвращаются в кучу и
+    повторяются с экспоненциальной задержкой, а fired_until не сдвигается
+    до успешной отправки: после перезапуска они будут загружены снова
+    """
+
+    STATE_KEY = "expiry_scheduler.fired_until"
+
+    # Задержка повтора после ошибки fire: от RETRY_MIN, удваивается до RETRY_MAX
+    RETRY_MIN = 5.0
+    RETRY_MAX = 300.0
+
+    # Перечитывание захватывает и последние RESYNC_OVERLAP секунд до прошлого:
+    # created_at - время начала транзакции, строка могла стать видна позже
+    RESYNC_OVERLAP = 60.0
+
+    def __init__(self,
+                 load: Callable[[datetime, datetime], AsyncIterator[List[Dict[str, Any]]]],
+                 fire: Callable[[List[Dict[str, Any]]], Awaitable[Any]],
+                 get_state: Callable[[str], Awaitable[Optional[str]]],
+                 set_state: Callable[[str, str], Awaitable[Any]],
+                 load_created: Optional[Callable[[datetime], AsyncIterator[List[Dict[str, Any]]]]] = None,
+                 warning_days: Sequence[int] = (3, 1),
+                 horizon: float = DAY,
+                 resync_interval: float = 15 * 60,
+                 clock: Callable[[], float] = time.time):
+        self._load_func = load
+        self._fire_func = fire
+        self._get_state = get_state
+        self._set_state = set_state
+        self._load_created_func = load_created
+        # (тип события, за сколько секунд до expire_at)
+        self.offsets: List[Tuple[str, float]] = (
+            [(warning_kind(days), days * DAY) for days in sorted(set(warning_days), reverse=True)]
+            + [(EXPIRED, 0.0)]
+        )
+        self._max_offset = max(offset for _, offset in self.offsets)
+        self.horizon = horizon
+        self.resync_interval = resync_interval
+        self._clock = clock
+
+        # (время срабатывания, порядковый номер, событие)
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._seq = 0
+        # user_id -> (id подписки, expire_at) - актуальная подписка пользователя в окне
+        self._active: Dict[int, Tuple[int, float]] = {}
+        # Все события до этого момента обработаны
+        self.fired_until: Optional[float] = None
+        # Подписки с expire_at до этого момента загружены в кучу
+        self._loaded_until = 0.0
+        self._resynced_at = 0.0
+        # Подписки, созданные до этого момента (по created_at), уже учтены
+        self._resync_cursor = 0.0
+        # Повтор после ошибки fire: не раньше _retry_at, текущая задержка
+        self._retry_at = 0.0
+        self._retry_delay = 0.0
+        self._wakeup = asyncio.Event()
+
+        # Статистика
+        self.fired = 0
+        self.stale = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _push(self, fire_at: float, event: Dict[str, Any]):
+        self._seq += 1
+        heapq.heappush(self._heap, (fire_at, self._seq, event))
+
+    def _schedule(self, subscription: Dict[str, Any], not_before: float):
+        user_id = subscription["user_id"]
+        expire_at = parse_timestamp(subscription["expire_at"]).timestamp()
+        current = (subscription["id"], expire_at)
+        if self._active.get(user_id) == current:
+            return
+
+        self._active[user_id] = current
+        for kind, offset in self.offsets:
+            fire_at = expire_at - offset
+            if fire_at <= not_before:
+                continue
+            self._push(fire_at, {
+                "kind": kind,
+                "subscription_id": subscription["id"],
+                "user_id": user_id,
+                "expire_at": subscription["expire_at"]
+            })
+
+    def _is_current(self, event: Dict[str, Any]) -> bool:
+        current = self._active.get(event["user_id"])
+        return (
+            current is not None
+            and current[0] == event["subscription_id"]
+            and current[1] == parse_timestamp(event["expire_at"]).timestamp()
+        )
+
+    async def _load(self, until: float):
+        """
+        Догружает подписки, события которых наступают до until
+        """
+        bound = until + self._max_offset
+        if bound <= self._loaded_until:
+            return
+
+        after = datetime.fromtimestamp(self._loaded_until, timezone.utc)
+        before = datetime.fromtimestamp(bound, timezone.utc)
+        loaded = 0
+        async for page in self._load_func(after, before):
+            for subscription in page:
+                self._schedule(subscription, self.fired_until)
+            loaded += len(page)
+
+        self._loaded_until = bound
+        logger.info(f"Планировщик истечения: загружено подписок {loaded}, событий в очереди {len(self._heap)}")
+
+    async def _resync(self, now: float):
+        """
+        Догружает подписки, созданные после прошлого перечитывания (в том числе
+        в других процессах): они получают события, а прежние события
+        пользователя становятся устаревшими. Подписки за пределами
+        загруженного окна будут загружены вместе с ним
+        """
+        self._resynced_at = now
+        after = datetime.fromtimestamp(self._resync_cursor - self.RESYNC_OVERLAP, timezone.utc)
+        not_before = max(self.fired_until, now)
+        cursor = self._resync_cursor
+        created = 0
+        async for page in self._load_created_func(after):
+            for subscription in page:
+                cursor = max(cursor, parse_timestamp(subscription["created_at"]).timestamp())
+                if parse_timestamp(subscription["expire_at"]).timestamp() < self._loaded_until:
+                    self._schedule(subscription, not_before)
+            created += len(page)
+        self._resync_cursor = cursor
+        if created:
+            logger.debug(f"Планировщик истечения: новых подписок с прошлого перечитывания {created}")
+
+    def on_subscription_changed(self, subscription: Dict[str, Any]):
+        """
+        Учитывает новую, продленную или деактивированную подписку
+        """
+        self._active.pop(subscription["user_id"], None)
+
+        if self.fired_until is None or not subscription.get("is_active", True):
+            return
+        if parse_timestamp(subscription["expire_at"]).timestamp() >= self._loaded_until:
+            # Будет загружена вместе со следующим окном
+            return
+
+        # События, время которых уже прошло, для новой подписки не отправляем
+        self._schedule(subscription, max(self.fired_until, self._clock()))
+        self._wakeup.set()
+
+    def _pop_due(self, now: float) -> List[Dict[str, Any]]:
+        due: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        while self._heap and self._heap[0][0] <= now:
+            _, _, event = heapq.heappop(self._heap)
+            if not self._is_current(event):
+                self.stale += 1
+                continue
+            # После простоя может наступить сразу несколько событий одной подписки:
+            # отправляем только последнее из них
+            due[(event["user_id"], event["subscription_id"])] = event
+        return list(due.values())
+
+    async def _fire(self, due: List[Dict[str, Any]], now: float) -> bool:
+        """
+        Отправляет наступившие события. При ошибке возвращает их в кучу
+        и откладывает следующую попытку
+        """
+        try:
+            await self._fire_func(due)
+        except Exception as e:
+            self.failed += len(due)
+            self._retry_delay = min(max(self._retry_delay * 2, self.RETRY_MIN), self.RETRY_MAX)
+            self._retry_at = now + self._retry_delay
+            for event in due:
+                self._push(now, event)
+            logger.error(
+                f"Ошибка при обработке событий истечения подписок: {e}, "
+                f"повтор через {self._retry_delay:.0f} с"
+            )
+            return False
+
+        self.fired += len(due)
+        self._retry_delay = 0.0
+        for event in due:
+            # Подписка истекла - больше событий по ней не будет
+            if event["kind"] == EXPIRED and self._is_current(event):
+                self._active.pop(event["user_id"], None)
+        return True
+
+    async def start(self):
+        """
+        Восстанавливает позицию из БД и загружает первое окно
+        """
+        now = self._clock()
+        state = await self._get_state(self.STATE_KEY)
+        self.fired_until = float(state) if state else now
+        self._loaded_until = self.fired_until
+        self._resynced_at = self._resync_cursor = now
+        await self._load(now + self.horizon)
+
+    async def run(self):
+        """
+        Основной цикл: спит до ближайшего события и обрабатывает наступившие
+        """
+        if self.fired_until is None:
+            await self.start()
+
+        while True:
+            now = self._clock()
+
+            # Окно догружается заранее, на половине горизонта
+            if self._loaded_until - self._max_offset < now + self.horizon / 2:
+                await self._load(now + self.horizon)
+            elif self._load_created_func is not None and now - self._resynced_at >= self.resync_interval:
+                try:
+                    await self._resync(now)
+                except Exception as e:
+                    logger.error(f"Ошибка при перечитывании окна планировщика: {e}")
+
+            fired = False
+            if now >= self._retry_at:
+                due = self._pop_due(now)
+                fired = bool(due) and await self._fire(due, now)
+
+            # Пока есть неотправленные события, позиция не сдвигается
+            if not self._retry_delay and (fired or now - self.fired_until >= 60):
+                self.fired_until = now
+                try:
+                    await self._set_state(self.STATE_KEY, repr(now))
+                except Exception as e:
+                    logger.error(f"Не удалось сохранить позицию планировщика: {e}")
+
+            next_load = self._loaded_until - self._max_offset - self.horizon / 2
+            next_event = self._heap[0][0] if self._heap else next_load
+            if self._retry_delay:
+                next_event = max(next_event, self._retry_at)
+            next_resync = self._resynced_at + self.resync_interval if self._load_created_func else next_load
+            timeout = max(0.0, min(next_event, next_load, next_resync) - self._clock())
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает размер очереди и количество обработанных событий
+        """
+        return {
+            "queued": len(self._heap),
+            "tracked": len(self._active),
+            "fired": self.fired,
+            "stale": self.stale,
+            "failed": self.failed,
+            "fired_until": self.fired_until
+        }
@@ -0,0 +1,142 @@
+"""
+Выбор лидера среди реплик бота через аренду в БД
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, List, Optional
+
+from config import config
+from utils.database import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+def default_holder() -> str:
+    """
+    Идентификатор процесса: хост, pid и случайный суффикс
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaderElector:
+    """
+    Аренда name в БД с продлением (heartbeat)
+
+    Реплика, захватившая аренду, запускает jobs и продлевает ее каждые
+    renew_interval секунд, остальные пытаются захватить ее с тем же
+    интервалом. Если продлить аренду не удалось до ее истечения, лидер
+    останавливает jobs сам, не дожидаясь, пока их запустит другая реплика.
+    При остановке аренда освобождается, поэтому другая реплика
+    становится лидером в течение renew_interval секунд; при падении
+    лидера - в течение ttl + renew_interval
+    """
+
+    def __init__(self, name: str,
+                 acquire: Callable[[str, str, float], Awaitable[bool]],
+                 release: Callable[[str, str], Awaitable[Any]],
+                 jobs: List[Callable[[], Awaitable[Any]]],
+                 ttl: float = 15.0, renew_interval: float = 5.0,
+                 holder: Optional[str] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if renew_interval * 2 > ttl:
+            raise ValueError("renew_interval должен быть не больше половины ttl")
+        self.name = name
+        self.holder = holder or default_holder()
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self._acquire = acquire
+        self._release = release
+        self._jobs = jobs
+        self._clock = clock
+        self._tasks: List[asyncio.Task] = []
+        # До какого момента (по локальным часам) лидер может работать: аренда
+        # в БД действует дольше как минимум на время одного запроса продления
+        self._valid_until = 0.0
+
+        # Статистика
+        self.terms = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return bool(self._tasks) and self._clock() < self._valid_until
+
+    def _start_jobs(self):
+        self.terms += 1
+        logger.info(f"Аренда {self.name}: {self.holder} стал лидером, запуск фоновых задач")
+        self._tasks = [asyncio.create_task(job()) for job in self._jobs]
+
+    async def _stop_jobs(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _tick(self):
+        started = self._clock()
+        try:
+            # Зависший запрос не должен держать лидерство дольше аренды
+            acquired = await asyncio.wait_for(self._acquire(self.name, self.holder, self.ttl),
+                                              timeout=self.renew_interval)
+        except Exception as e:
+            logger.error(f"Аренда {self.name}: ошибка при продлении: {e}")
+            acquired = None
+
+        if acquired:
+            # Отсчет от отправки запроса: аренда в БД продлена не раньше этого момента
+            self._valid_until = started + self.ttl - self.renew_interval
+            if not self._tasks:
+                self._start_jobs()
+        elif self._tasks and (acquired is False or self._clock() >= self._valid_until):
+            logger.warning(f"Аренда {self.name}: {self.holder} больше не лидер, остановка фоновых задач")
+            await self._stop_jobs()
+
+    async def run(self):
+        """
+        Цикл захвата и продления аренды до отмены
+        """
+        try:
+            while True:
+                await self._tick()
+                # Лидер успевает проверить аренду до истечения ее запаса
+                timeout = self.renew_interval
+                if self._tasks:
+                    timeout = min(timeout, max(0.0, self._valid_until - self._clock()))
+                await asyncio.sleep(timeout)
+        finally:
+            was_leader = bool(self._tasks)
+            await self._stop_jobs()
+            if was_leader:
+                try:
+                    await asyncio.shield(self._release(self.name, self.holder))
+                    logger.info(f"Аренда {self.name} освобождена")
+                except Exception as e:
+                    logger.error(f"Аренда {self.name}: не удалось освободить: {e}")
+
+
+async def _acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    storage = await get_storage()
+    return await storage.acquire_lease(name, holder, ttl)
+
+
+async def _release_lease(name: str, holder: str):
+    storage = await get_storage()
+    await storage.release_lease(name, holder)
+
+
+def create_leader_elector(name: str, jobs: List[Callable[[], Awaitable[Any]]]) -> LeaderElector:
+    """
+    Выбор лидера через таблицу leases с настройками из config
+    """
+    return LeaderElector(
+        name,
+        acquire=_acquire_lease,
+        release=_release_lease,
+        jobs=jobs,
+        ttl=config.LEADER_LEASE_TTL,
+        renew_interval=config.LEADER_RENEW_INTERVAL
+    )
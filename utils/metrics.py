@@ -0,0 +1,353 @@
+"""
+Метрики в формате Prometheus без внешних зависимостей
+
+Значения хранятся в заранее созданных дочерних объектах по набору меток:
+горячий путь (observe/inc) - это поиск корзины и сложение, без аллокаций
+"""
+
+import logging
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Корзины гистограмм задержек, сек
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Сколько разных наборов меток может быть у метрики, остальные попадают в OTHER
+MAX_LABEL_SETS = 500
+OTHER = "other"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, Any] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """
+        Дочерний объект для набора значений меток (создается один раз)
+        Ссылку на него стоит сохранить и переиспользовать
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(self._children) >= MAX_LABEL_SETS:
+                values = (OTHER,) * len(self.labelnames)
+                child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+        return child
+
+    def snapshot(self) -> List[list]:
+        raise NotImplementedError
+
+    def merge(self, samples: List[list]):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """
+    Монотонно растущий счетчик
+    """
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def snapshot(self) -> List[list]:
+        return [[list(values), child.value] for values, child in self._children.items()]
+
+    def merge(self, samples: List[list]):
+        for values, value in samples:
+            self.labels(*values).inc(value)
+
+    def render(self, lines: List[str]):
+        for values, child in self._children.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}")
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Последняя ячейка - значения больше всех границ (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма с фиксированными корзинами
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def snapshot(self) -> List[list]:
+        return [[list(values), list(child.counts), child.sum] for values, child in self._children.items()]
+
+    def merge(self, samples: List[list]):
+        for values, counts, total in samples:
+            child = self.labels(*values)
+            for index, count in enumerate(counts):
+                child.counts[index] += count
+            child.sum += total
+
+    def render(self, lines: List[str]):
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(bounds, child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение, которое читается функцией collect в момент запроса
+    collect возвращает пары (значения меток, значение)
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Iterable[Tuple[LabelValues, float]]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+        # Значения, присланные другими процессами (merge)
+        self._merged: Dict[LabelValues, float] = {}
+
+    def _values(self) -> Dict[LabelValues, float]:
+        values = dict(self._merged)
+        if self.collect is not None:
+            try:
+                for labels, value in self.collect():
+                    values[tuple(labels)] = values.get(tuple(labels), 0.0) + value
+            except Exception as e:
+                logger.error(f"Ошибка при чтении метрики {self.name}: {e}")
+        return values
+
+    def snapshot(self) -> List[list]:
+        return [[list(values), value] for values, value in self._values().items()]
+
+    def merge(self, samples: List[list]):
+        for values, value in samples:
+            self._merged[tuple(values)] = self._merged.get(tuple(values), 0.0) + value
+
+    def render(self, lines: List[str]):
+        for values, value in self._values().items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+
+
+class CounterFunc(Gauge):
+    """
+    Счетчик, который ведет сам источник (например, hits кэша):
+    значение читается функцией collect, как у Gauge, но только растет
+    """
+    type = "counter"
+
+
+class Registry:
+    """
+    Набор метрик процесса
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def snapshot(self) -> Dict[str, List[list]]:
+        """
+        Значения всех метрик в виде, пригодном для JSON
+        (для передачи супервизору из процессов-обработчиков)
+        """
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def render(self, snapshots: Iterable[Dict[str, List[list]]] = ()) -> str:
+        """
+        Текстовый формат Prometheus. snapshots - значения из других
+        процессов, они суммируются с метриками этого процесса
+        """
+        registry = self
+        snapshots = list(snapshots)
+        if snapshots:
+            registry = Registry()
+            for metric in self._metrics.values():
+                copy = _copy_metric(metric)
+                registry.register(copy).merge(metric.snapshot())
+                for snapshot in snapshots:
+                    copy.merge(snapshot.get(metric.name, []))
+
+        lines: List[str] = []
+        for metric in registry._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            metric.render(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+
+def _copy_metric(metric: _Metric) -> _Metric:
+    if isinstance(metric, Histogram):
+        return Histogram(metric.name, metric.documentation, metric.labelnames, metric.buckets)
+    return type(metric)(metric.name, metric.documentation, metric.labelnames)
+
+
+# ----- Метрики бота -----
+
+registry = Registry()
+
+handler_duration = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта хендлером",
+    ("router", "event", "key")
+))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Необработанные исключения в хендлерах",
+    ("router", "event", "key")
+))
+storage_duration = registry.register(Histogram(
+    "bot_storage_query_duration_seconds", "Время запросов к хранилищу данных",
+    ("table", "operation")
+))
+storage_errors = registry.register(Counter(
+    "bot_storage_errors_total", "Ошибки запросов к хранилищу данных",
+    ("table", "operation")
+))
+telegram_duration = registry.register(Histogram(
+    "bot_telegram_api_duration_seconds", "Время вызовов Telegram Bot API",
+    ("method",)
+))
+telegram_errors = registry.register(Counter(
+    "bot_telegram_api_errors_total", "Ошибки вызовов Telegram Bot API",
+    ("method",)
+))
+telegram_connect_duration = registry.register(Histogram(
+    "bot_telegram_api_connect_seconds", "Установка нового соединения с Bot API (DNS, TCP, TLS)",
+    ("method",)
+))
+telegram_ttfb_duration = registry.register(Histogram(
+    "bot_telegram_api_ttfb_seconds", "Время до первого байта ответа Bot API",
+    ("method",)
+))
+telegram_new_connections = registry.register(Counter(
+    "bot_telegram_api_new_connections_total", "Вызовы Bot API, для которых открывалось новое соединение",
+    ("method",)
+))
+
+
+throttled_total = registry.register(Counter(
+    "bot_throttled_total", "Запросы, отклоненные анти-флудом, по правилу",
+    ("rule",)
+))
+throttle_buckets = registry.register(Gauge(
+    "bot_throttle_buckets", "Пользователей с неполным ведром анти-флуда"
+))
+subscription_cache_hits = registry.register(CounterFunc(
+    "bot_subscription_cache_hits_total", "Попадания в кэш подписок"
+))
+subscription_cache_misses = registry.register(CounterFunc(
+    "bot_subscription_cache_misses_total", "Промахи кэша подписок"
+))
+singleflight_calls = registry.register(CounterFunc(
+    "bot_singleflight_calls_total", "Чтения из хранилища, выполненные через single-flight"
+))
+singleflight_collapsed = registry.register(CounterFunc(
+    "bot_singleflight_collapsed_total", "Чтения, присоединенные к уже выполняющемуся запросу"
+))
+fsm_states = registry.register(Gauge(
+    "bot_fsm_states", "Число состояний FSM в памяти"
+))
+fsm_bytes = registry.register(Gauge(
+    "bot_fsm_state_bytes", "Размер состояний FSM в памяти, байт"
+))
+
+
+def create_metrics_app(snapshots: Optional[Callable[[], Iterable[Dict[str, List[list]]]]] = None) -> web.Application:
+    """
+    aiohttp-приложение с GET /metrics
+    snapshots - значения метрик других процессов (режим супервизора)
+    """
+    async def metrics(request: web.Request) -> web.Response:
+        text = registry.render(snapshots() if snapshots is not None else ())
+        return web.Response(text=text, content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+async def start_metrics_server(host: str, port: int,
+                               snapshots: Optional[Callable[[], Iterable[Dict[str, List[list]]]]] = None) -> web.AppRunner:
+    """
+    Поднимает сервер /metrics, возвращает runner для остановки (runner.cleanup())
+    """
+    runner = web.AppRunner(create_metrics_app(snapshots), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -4,13 +4,24 @@
 
 import logging
 import asyncio
-from datetime import datetime, timedelta
+import math
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, AsyncIterator, Dict, List, Optional
 from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 
 from keyboards.inline import get_main_menu_keyboard
-from models.subscription import get_expiring_subscriptions
-from models.user import add_referral_reward
+from models.subscription import (
+    get_user_subscription, iter_subscriptions_created_after, iter_subscriptions_expiring_between,
+    subscription_listeners
+)
+from models.notification import claim_notifications
+from models.user import add_referral_reward, mark_user_blocked, settle_referral_rewards
+from storage import NotificationKey, parse_timestamp
+from utils.broadcast import Broadcaster, BroadcastJob, TokenBucket
+from utils.database import get_storage
+from utils.expiry_scheduler import DAY, EXPIRED, ExpiryScheduler
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -56,17 +67,17 @@ async def send_payment_success_notification(bot: Bot, user_id: int,
         
     except TelegramForbiddenError:
         logger.warning(f"Пользователь {user_id} заблокировал бота")
+        mark_user_blocked(user_id)
     except Exception as e:
         logger.error(f"Ошибка при отправке уведомления об оплате пользователю {user_id}: {e}")
 
 
-async def send_subscription_expiry_warning(bot: Bot, user_id: int, days_left: int):
+def subscription_expiry_warning_text(days_left: int) -> Optional[str]:
     """
-    Отправляет предупреждение об истечении подписки
+    Текст предупреждения об истечении подписки (None - предупреждать не нужно)
     """
-    try:
-        if days_left == 1:
-            warning_text = """
+    if days_left == 1:
+        return """
 ВНИМАНИЕ! Подписка истекает завтра!
 
 Ваша подписка Escape! истекает завтра. 
@@ -78,8 +89,8 @@ async def send_subscription_expiry_warning(bot: Bot, user_id: int, days_left: in
 
 💡 <b>Совет:</b> Выберите годовую подписку и сэкономьте до 42%!
             """
-        elif days_left <= 3:
-            warning_text = f"""
+    elif days_left <= 3:
+        return f"""
 Подписка истекает через {days_left} дня!
 
 Ваша подписка Escape! скоро истечет.
@@ -88,8 +99,29 @@ async def send_subscription_expiry_warning(bot: Bot, user_id: int, days_left: in
 
 Специальное предложение: При покупке на год максимальная экономия!
             """
-        else:
-            return  # Не отправляем уведомления за более чем 3 дня
+    
+    return None  # Не отправляем уведомления за более чем 3 дня
+
+
+def subscription_expired_text() -> str:
+    """
+    Текст уведомления об истекшей подписке
+    """
+    return """
+Ваша подписка Escape! истекла.
+
+Доступ к VPN приостановлен. Чтобы продолжить пользоваться VPN, нажмите "Купить подписку" в меню и выберите подходящий тариф.
+            """
+
+
+async def send_subscription_expiry_warning(bot: Bot, user_id: int, days_left: int):
+    """
+    Отправляет предупреждение об истечении подписки
+    """
+    try:
+        warning_text = subscription_expiry_warning_text(days_left)
+        if warning_text is None:
+            return
         
         keyboard = get_main_menu_keyboard()
         
@@ -103,21 +135,16 @@ async def send_subscription_expiry_warning(bot: Bot, user_id: int, days_left: in
         
     except TelegramForbiddenError:
         logger.warning(f"Пользователь {user_id} заблокировал бота")
+        mark_user_blocked(user_id)
     except Exception as e:
         logger.error(f"Ошибка при отправке предупреждения пользователю {user_id}: {e}")
 
 
-async def send_referral_reward_notification(bot: Bot, user_id: int, 
-                                          referred_user_name: str, reward_amount: float):
+def referral_reward_text(referred_user_name: str, reward_amount: float) -> str:
     """
-    Отправляет уведомление о реферальной награде
+    Текст уведомления о реферальной награде
     """
-    try:
-        # Добавляем награду на баланс
-        success = await add_referral_reward(user_id, reward_amount)
-        
-        if success:
-            reward_text = f"""
+    return f"""
 🎉 <b>Поздравляем! Вы получили реферальную награду!</b>
 
 👤 <b>Приглашенный пользователь:</b> {referred_user_name}
@@ -130,12 +157,23 @@ async def send_referral_reward_notification(bot: Bot, user_id: int,
 
 Нажмите "Пригласить" чтобы получить вашу реферальную ссылку.
             """
-            
+
+
+async def send_referral_reward_notification(bot: Bot, user_id: int, 
+                                          referred_user_name: str, reward_amount: float):
+    """
+    Отправляет уведомление о реферальной награде
+    """
+    try:
+        # Добавляем награду на баланс
+        success = await add_referral_reward(user_id, reward_amount)
+        
+        if success:
             keyboard = get_main_menu_keyboard()
             
             await bot.send_message(
                 chat_id=user_id,
-                text=reward_text,
+                text=referral_reward_text(referred_user_name, reward_amount),
                 reply_markup=keyboard
             )
             
@@ -143,52 +181,159 @@ async def send_referral_reward_notification(bot: Bot, user_id: int,
         
     except TelegramForbiddenError:
         logger.warning(f"Пользователь {user_id} заблокировал бота")
+        mark_user_blocked(user_id)
     except Exception as e:
         logger.error(f"Ошибка при отправке уведомления о награде пользователю {user_id}: {e}")
 
 
-async def check_expiring_subscriptions_task(bot: Bot):
+# Общий лимит BROADCAST_RATE для всех рассылок процесса (создается при первой рассылке)
+_broadcast_bucket: Optional[TokenBucket] = None
+
+
+def create_broadcaster() -> Broadcaster:
     """
-    Периодическая задача проверки истекающих подписок
+    Рассыльщик с лимитами из конфигурации
+    Рассылки, идущие одновременно (уведомления об истечении и о наградах),
+    делят один token bucket и вместе не превышают BROADCAST_RATE
     """
-    try:
-        # Получаем подписки, истекающие в ближайшие 3 дня
-        expiring_subscriptions = await get_expiring_subscriptions(days_before=3)
+    global _broadcast_bucket
+    if _broadcast_bucket is None:
+        _broadcast_bucket = TokenBucket(config.BROADCAST_RATE)
+    return Broadcaster(
+        rate=config.BROADCAST_RATE,
+        per_chat_interval=config.BROADCAST_PER_CHAT_INTERVAL,
+        workers=config.BROADCAST_WORKERS,
+        on_blocked=mark_user_blocked,
+        bucket=_broadcast_bucket
+    )
+
+
+async def _expiry_event_jobs(bot: Bot, events: List[Dict[str, Any]]) -> AsyncIterator[BroadcastJob]:
+    messages: Dict[NotificationKey, str] = {}
+    
+    for event in events:
+        user_id = event["user_id"]
         
-        for subscription in expiring_subscriptions:
-            user_id = subscription["users"]["chat_id"]
-            expire_at = datetime.fromisoformat(subscription["expire_at"].replace("Z", "+00:00"))
-            now = datetime.utcnow().replace(tzinfo=expire_at.tzinfo)
-            
-            days_left = (expire_at - now).days
-            
-            if days_left <= 3 and days_left > 0:
-                await send_subscription_expiry_warning(bot, user_id, days_left)
-                
-                # Ждем немного между отправками, чтобы не перегружать API
-                await asyncio.sleep(0.1)
+        # Подписка могла быть продлена или отменена в другом процессе
+        subscription = await get_user_subscription(user_id)
         
-        logger.info(f"Проверка истекающих подписок завершена. Найдено: {len(expiring_subscriptions)}")
+        if event["kind"] == EXPIRED:
+            if subscription is not None:
+                continue
+            text = subscription_expired_text()
+        else:
+            if subscription is None or subscription["id"] != event["subscription_id"]:
+                continue
+            seconds_left = (parse_timestamp(subscription["expire_at"]) - datetime.now(timezone.utc)).total_seconds()
+            text = subscription_expiry_warning_text(max(1, math.ceil(seconds_left / DAY)))
+            if text is None:
+                continue
         
-    except Exception as e:
-        logger.error(f"Ошибка при проверке истекающих подписок: {e}")
+        messages[(user_id, event["subscription_id"], event["kind"])] = text
+    
+    # Уже отправленные (в том числе другим процессом) уведомления пропускаем
+    claimed = await claim_notifications(list(messages))
+    keyboard = get_main_menu_keyboard()
+    
+    for key, text in messages.items():
+        if key in claimed:
+            user_id = key[0]
+            yield user_id, partial(bot.send_message, chat_id=user_id, text=text, reply_markup=keyboard)
 
 
-async def start_notification_scheduler(bot: Bot):
+def create_expiry_scheduler(bot: Bot) -> ExpiryScheduler:
     """
-    Запускает планировщик уведомлений
+    Планировщик предупреждений за 3 дня и за 1 день до истечения подписки
+    и уведомления об истечении
     """
-    logger.info("Запуск планировщика уведомлений")
+    async def fire(events: List[Dict[str, Any]]):
+        stats = await create_broadcaster().run(_expiry_event_jobs(bot, events))
+        logger.info(f"События истечения подписок: {len(events)}, отправлено: {stats['delivered']}")
     
+    async def get_state(key: str) -> Optional[str]:
+        return await (await get_storage()).get_state(key)
+    
+    async def set_state(key: str, value: str):
+        await (await get_storage()).set_state(key, value)
+    
+    return ExpiryScheduler(
+        load=iter_subscriptions_expiring_between,
+        fire=fire,
+        get_state=get_state,
+        set_state=set_state,
+        load_created=iter_subscriptions_created_after,
+        warning_days=(3, 1),
+        resync_interval=config.EXPIRY_RESYNC_INTERVAL
+    )
+
+
+async def settle_referral_rewards_task(bot: Bot):
+    """
+    Начисляет награды за приглашенных, оплативших подписку, и уведомляет рефереров
+    """
+    try:
+        settled = await settle_referral_rewards(config.REFERRAL_REWARD_RUBLES)
+        if not settled:
+            return
+        
+        # Награды уже начислены, остается только уведомить
+        keyboard = get_main_menu_keyboard()
+        await create_broadcaster().run(
+            (reward["referrer_id"], partial(
+                bot.send_message,
+                chat_id=reward["referrer_id"],
+                text=referral_reward_text(reward.get("referred_first_name") or "Пользователь",
+                                          reward["reward_amount"]),
+                reply_markup=keyboard
+            ))
+            for reward in settled
+        )
+        
+    except Exception as e:
+        logger.error(f"Ошибка при начислении реферальных наград: {e}")
+
+
+async def _run_expiry_scheduler(scheduler: ExpiryScheduler):
     while True:
         try:
-            # Проверяем истекающие подписки каждые 12 часов
-            await check_expiring_subscriptions_task(bot)
+            await scheduler.run()
+        except Exception as e:
+            logger.error(f"Ошибка в планировщике истечения подписок: {e}")
+            # Перезапускаем через минуту, позиция сохранена в БД
+            await asyncio.sleep(60)
+
+
+async def _referral_rewards_loop(bot: Bot):
+    while True:
+        try:
+            await settle_referral_rewards_task(bot)
             
-            # Ждем 12 часов до следующей проверки
+            # Ждем 12 часов до следующего начисления
             await asyncio.sleep(12 * 60 * 60)  # 12 часов в секундах
             
         except Exception as e:
             logger.error(f"Ошибка в планировщике уведомлений: {e}")
             # Если произошла ошибка, ждем 1 час и пробуем снова
             await asyncio.sleep(60 * 60)
+
+
+async def start_notification_scheduler(bot: Bot):
+    """
+    Запускает планировщик уведомлений
+    Предупреждения об истечении отправляются в момент наступления события.
+    Реферальные награды начисляются раз в 12 часов, только если включен
+    REFERRAL_AUTO_SETTLE: иначе оператор вызывает settle_referral_rewards_task сам
+    """
+    logger.info("Запуск планировщика уведомлений")
+    
+    scheduler = create_expiry_scheduler(bot)
+    subscription_listeners.append(scheduler.on_subscription_changed)
+    
+    tasks = [_run_expiry_scheduler(scheduler)]
+    if config.REFERRAL_AUTO_SETTLE:
+        tasks.append(_referral_rewards_loop(bot))
+    
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        subscription_listeners.remove(scheduler.on_subscription_changed)
@@ -0,0 +1,63 @@
+"""
+Объединение одинаковых параллельных запросов (single-flight)
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Параллельные вызовы do() с одинаковым ключом разделяют один
+    выполняющийся запрос и получают его результат (или исключение)
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+        # Статистика
+        self.calls = 0
+        self.collapsed = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Выполняет func() или присоединяется к уже выполняющемуся вызову
+        """
+        task = self._calls.get(key)
+
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        else:
+            self.collapsed += 1
+
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Исключение уже получили ожидающие, помечаем его обработанным
+        if not task.cancelled():
+            task.exception()
+
+    def forget(self, key: Hashable):
+        """
+        Следующий вызов с этим ключом выполнит новый запрос
+        (нужно после изменения данных, которые читает текущий запрос)
+        """
+        self._calls.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает количество выполненных и объединенных вызовов
+        """
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "collapsed": self.collapsed
+        }
@@ -0,0 +1,173 @@
+"""
+Сессия Bot API с настроенным пулом соединений и трассировкой вызовов
+"""
+
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from aiohttp import ClientSession, FormData, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram import Bot, __version__
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from keyboards.inline import PrebuiltKeyboard
+from utils.metrics import telegram_connect_duration, telegram_new_connections, telegram_ttfb_duration
+
+logger = logging.getLogger(__name__)
+
+
+class CallTiming:
+    """
+    Фазы одного вызова Bot API, сек
+    """
+    __slots__ = ("dns", "connect", "ttfb", "new_connection")
+
+    def __init__(self):
+        self.dns = 0.0
+        self.connect = 0.0
+        self.ttfb = 0.0
+        self.new_connection = False
+
+
+# Замеры текущего вызова: хуки aiohttp выполняются в той же задаче, что и запрос
+_current_call: ContextVar[Optional[CallTiming]] = ContextVar("telegram_call_timing", default=None)
+
+
+async def _on_request_start(session, context, params):
+    context.timing = _current_call.get()
+    context.started = time.perf_counter()
+
+
+async def _on_dns_start(session, context, params):
+    context.dns_started = time.perf_counter()
+
+
+async def _on_dns_end(session, context, params):
+    if context.timing is not None:
+        context.timing.dns += time.perf_counter() - context.dns_started
+
+
+async def _on_connection_start(session, context, params):
+    context.connect_started = time.perf_counter()
+
+
+async def _on_connection_end(session, context, params):
+    if context.timing is not None:
+        context.timing.connect += time.perf_counter() - context.connect_started
+        context.timing.new_connection = True
+
+
+async def _on_request_end(session, context, params):
+    # Заголовки ответа получены - время до первого байта
+    if context.timing is not None:
+        context.timing.ttfb = time.perf_counter() - context.started
+
+
+def create_trace_config() -> TraceConfig:
+    trace_config = TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_dns_resolvehost_start.append(_on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(_on_dns_end)
+    trace_config.on_connection_create_start.append(_on_connection_start)
+    trace_config.on_connection_create_end.append(_on_connection_end)
+    trace_config.on_request_end.append(_on_request_end)
+    return trace_config
+
+
+class TracedAiohttpSession(AiohttpSession):
+    """
+    AiohttpSession с размером пула, кэшем DNS и keep-alive из настроек.
+    Для каждого вызова записывает время установки соединения (DNS, TCP, TLS)
+    и до первого байта ответа по методу Bot API, вызовы дольше
+    slow_call_threshold секунд пишет в лог с разбивкой по фазам.
+    Готовые клавиатуры (PrebuiltKeyboard) отправляет уже сериализованными
+    """
+
+    def __init__(self, limit: int = 100, keepalive_timeout: float = 60.0,
+                 dns_cache_ttl: int = 300, slow_call_threshold: float = 1.0, **kwargs: Any):
+        super().__init__(limit=limit, **kwargs)
+        self._connector_init.update(
+            # Соединения с api.telegram.org переиспользуются между вызовами
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=dns_cache_ttl,
+            # Закрытие оборванных TLS-соединений, иначе они копятся в пуле
+            enable_cleanup_closed=True
+        )
+        self.slow_call_threshold = slow_call_threshold
+        self._trace_config = create_trace_config()
+        # method -> (гистограмма соединения, гистограмма TTFB, счетчик новых соединений)
+        self._children: Dict[str, tuple] = {}
+        self.middleware(self._trace_call)
+
+    async def create_session(self) -> ClientSession:
+        # Копия AiohttpSession.create_session из aiogram 3.20 (версия закреплена
+        # в pyproject.toml): trace_configs передаются только при создании ClientSession
+        if self._should_reset_connector:
+            await self.close()
+
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{__version__}"},
+                trace_configs=[self._trace_config]
+            )
+            self._should_reset_connector = False
+
+        return self._session
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod[TelegramType]) -> FormData:
+        markup = getattr(method, "reply_markup", None)
+        if not isinstance(markup, PrebuiltKeyboard):
+            return super().build_form_data(bot, method)
+
+        # Остальные поля собирает AiohttpSession (пустые поля он пропускает),
+        # клавиатура добавляется готовым JSON без повторной сериализации
+        form = super().build_form_data(bot, method.model_copy(update={"reply_markup": None}))
+        form.add_field("reply_markup", markup.serialized)
+        return form
+
+    async def _trace_call(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        timing = CallTiming()
+        token = _current_call.set(timing)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            total = time.perf_counter() - started
+            _current_call.reset(token)
+            self._record(method.__api_method__, timing, total)
+
+    def _record(self, name: str, timing: CallTiming, total: float):
+        children = self._children.get(name)
+        if children is None:
+            children = self._children[name] = (
+                telegram_connect_duration.labels(name),
+                telegram_ttfb_duration.labels(name),
+                telegram_new_connections.labels(name)
+            )
+
+        if timing.new_connection:
+            # Установка соединения включает разрешение DNS
+            children[0].observe(timing.connect)
+            children[2].inc()
+        if timing.ttfb:
+            children[1].observe(timing.ttfb)
+
+        if total >= self.slow_call_threshold:
+            logger.warning(
+                f"Медленный вызов Bot API {name}: {total:.3f}с "
+                f"(соединение {timing.connect:.3f}с, из них DNS {timing.dns:.3f}с, "
+                f"первый байт {timing.ttfb:.3f}с, "
+                f"{'новое соединение' if timing.new_connection else 'из пула'})"
+            )
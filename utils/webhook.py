@@ -0,0 +1,86 @@
+"""
+Получение апдейтов через webhook (встроенный aiohttp-сервер)
+"""
+
+import asyncio
+import logging
+from typing import Any, List
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+
+class FastAckRequestHandler(SimpleRequestHandler):
+    """
+    Отвечает Telegram сразу после чтения апдейта, обработка идет в фоне
+    При остановке дожидается уже принятых апдейтов
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str,
+                 handle_in_background: bool = True, drain_timeout: float = 30.0, **data: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=handle_in_background,
+                         secret_token=secret_token, **data)
+        self.drain_timeout = drain_timeout
+
+    @property
+    def pending(self) -> int:
+        """
+        Количество апдейтов, которые еще обрабатываются
+        """
+        return len(self._background_feed_update_tasks)
+
+    async def close(self):
+        if self._background_feed_update_tasks:
+            logger.info(f"Ожидание обработки {self.pending} апдейтов перед остановкой")
+            await asyncio.wait(set(self._background_feed_update_tasks), timeout=self.drain_timeout)
+        await super().close()
+
+
+async def _health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, path: str, secret_token: str,
+                       handle_in_background: bool = True) -> web.Application:
+    """
+    aiohttp-приложение с обработчиком апдейтов на path и проверкой
+    X-Telegram-Bot-Api-Secret-Token, плюс GET /health для балансировщика
+    """
+    app = web.Application()
+    FastAckRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token,
+        handle_in_background=handle_in_background
+    ).register(app, path=path)
+    app.router.add_get("/health", _health)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, url: str, path: str, secret_token: str,
+                      host: str, port: int, allowed_updates: List[str]):
+    """
+    Поднимает сервер, регистрирует webhook в Telegram и работает до отмены
+    Несколько реплик за балансировщиком регистрируют один и тот же URL
+    """
+    runner = web.AppRunner(create_webhook_app(dp, bot, path, secret_token))
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info(f"Webhook-сервер слушает {host}:{port}{path}")
+
+    try:
+        await bot.set_webhook(
+            url=url.rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=allowed_updates,
+            drop_pending_updates=False
+        )
+        logger.info(f"Webhook зарегистрирован: {url.rstrip('/')}{path}")
+
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
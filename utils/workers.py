@@ -0,0 +1,443 @@
+"""
+Многопроцессный режим: супервизор принимает апдейты и распределяет их
+по процессам-обработчикам по from_user.id
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot
+
+from utils.metrics import registry, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+# Кадр: длина (4 байта, big-endian) и содержимое
+_FRAME_HEADER = struct.Struct(">I")
+# Апдейт в кадре предваряется ключом распределения, чтобы обработчику
+# не разбирать JSON повторно
+_SHARD_KEY = struct.Struct(">q")
+
+# Как часто обработчики присылают статистику супервизору, сек
+STATS_INTERVAL = 5.0
+
+
+async def write_frame(writer: asyncio.StreamWriter, payload: bytes):
+    writer.write(_FRAME_HEADER.pack(len(payload)) + payload)
+    await writer.drain()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """
+    Читает кадр, None - соединение закрыто
+    """
+    try:
+        header = await reader.readexactly(_FRAME_HEADER.size)
+        return await reader.readexactly(_FRAME_HEADER.unpack(header)[0])
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def shard_key(update: Dict[str, Any]) -> int:
+    """
+    Ключ распределения апдейта: id пользователя, иначе id чата,
+    иначе update_id. Апдейты одного пользователя всегда попадают
+    в один процесс
+    """
+    for name, event in update.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = event.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+
+# ----- Процесс-обработчик -----
+
+class UpdateWorker:
+    """
+    Обрабатывает апдейты, присланные супервизором
+    Апдейты одного пользователя выполняются строго по очереди,
+    разных пользователей - параллельно
+    """
+
+    def __init__(self, index: int, dp, bot: Bot):
+        self.index = index
+        self.dp = dp
+        self.bot = bot
+        # shard_key -> последняя задача пользователя
+        self._tails: Dict[int, asyncio.Task] = {}
+        self._tasks = set()
+
+        # Статистика
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+
+    async def _process(self, key: int, raw: bytes, previous: Optional[asyncio.Task]):
+        from aiogram.types import Update
+
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            update = Update.model_validate_json(raw, context={"bot": self.bot})
+            await self.dp.feed_update(self.bot, update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Обработчик {self.index}: ошибка при обработке апдейта: {e}")
+        finally:
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    def submit(self, frame: bytes):
+        self.received += 1
+        key = _SHARD_KEY.unpack_from(frame)[0]
+        raw = frame[_SHARD_KEY.size:]
+        task = asyncio.create_task(self._process(key, raw, self._tails.get(key)))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker": self.index,
+            "pid": os.getpid(),
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "in_flight": len(self._tasks),
+            "metrics": registry.snapshot()
+        }
+
+    async def _report(self, writer: asyncio.StreamWriter):
+        while True:
+            await write_frame(writer, json.dumps(self.stats()).encode())
+            await asyncio.sleep(STATS_INTERVAL)
+
+    async def serve(self, sock: socket.socket, drain_timeout: float = 30.0):
+        """
+        Читает апдейты из сокета до его закрытия супервизором
+        """
+        reader, writer = await asyncio.open_connection(sock=sock)
+        reporter = asyncio.create_task(self._report(writer))
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                self.submit(frame)
+        finally:
+            if self._tasks:
+                logger.info(f"Обработчик {self.index}: ожидание {len(self._tasks)} апдейтов перед остановкой")
+                await asyncio.wait(set(self._tasks), timeout=drain_timeout)
+            reporter.cancel()
+            writer.close()
+
+
+async def _run_worker(index: int, sock: socket.socket, background: bool):
+    from bot import create_bot, create_dispatcher, start_services, stop_services
+
+    bot = create_bot()
+    dp = create_dispatcher()
+    await start_services(bot, background=background)
+    await dp.emit_startup(bot=bot)
+    try:
+        await UpdateWorker(index, dp, bot).serve(sock)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await stop_services(bot)
+
+
+def worker_main(index: int, sock: socket.socket, background: bool,
+                initializer: Optional[Callable[[], Any]] = None):
+    """
+    Точка входа процесса-обработчика
+    """
+    if initializer is not None:
+        initializer()
+    try:
+        asyncio.run(_run_worker(index, sock, background))
+    except KeyboardInterrupt:
+        pass
+
+
+# ----- Супервизор -----
+
+class WorkerHandle:
+    """
+    Процесс-обработчик со стороны супервизора
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.stats: Dict[str, Any] = {}
+        self.stats_at = 0.0
+        self.restarts = 0
+        # Апдейты, отправленные этому процессу
+        self.sent = 0
+
+    @property
+    def alive(self) -> bool:
+        """
+        Процесс работает и уже прислал статистику (то есть запустился)
+        """
+        return (
+            self.process is not None and self.process.is_alive()
+            and self.writer is not None and self.stats_at > 0
+        )
+
+
+class Supervisor:
+    """
+    Запускает workers процессов-обработчиков и передает им сырые апдейты
+    (JSON без разбора в модели aiogram) по хешу from_user.id.
+    Фоновые задачи (планировщик уведомлений) выполняет процесс 0.
+    Упавший процесс перезапускается, статистика процессов собирается
+    для /health
+    """
+
+    def __init__(self, workers: int, initializer: Optional[Callable[[], Any]] = None):
+        self.workers = [WorkerHandle(index) for index in range(workers)]
+        self.initializer = initializer
+        # spawn: процессы запускаются из работающего event loop
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping = False
+        self.dropped = 0
+
+    async def _start_worker(self, handle: WorkerHandle):
+        handle.stats = {}
+        handle.stats_at = 0.0
+        parent, child = socket.socketpair()
+        handle.process = self._context.Process(
+            target=worker_main,
+            args=(handle.index, child, handle.index == 0, self.initializer),
+            name=f"worker-{handle.index}",
+            daemon=True
+        )
+        handle.process.start()
+        child.close()
+
+        reader, handle.writer = await asyncio.open_connection(sock=parent)
+        # Задача чтения завершается при падении процесса и запускает новую
+        task = asyncio.create_task(self._read_stats(handle, reader))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logger.info(f"Запущен обработчик {handle.index} (pid {handle.process.pid})")
+
+    async def _read_stats(self, handle: WorkerHandle, reader: asyncio.StreamReader):
+        while True:
+            frame = await read_frame(reader)
+            if frame is None:
+                break
+            handle.stats = json.loads(frame)
+            handle.stats_at = time.time()
+
+        handle.writer = None
+        if not self._stopping:
+            logger.error(f"Обработчик {handle.index} завершился, перезапуск")
+            await asyncio.get_running_loop().run_in_executor(None, handle.process.join)
+            handle.restarts += 1
+            await self._start_worker(handle)
+
+    async def start(self):
+        for handle in self.workers:
+            await self._start_worker(handle)
+
+    async def dispatch(self, raw: bytes, update: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Передает апдейт процессу, который отвечает за его пользователя
+        Возвращает False, если процесс недоступен: апдейт не принят,
+        его нужно получить от Telegram повторно
+        """
+        if update is None:
+            update = json.loads(raw)
+        key = shard_key(update)
+        handle = self.workers[key % len(self.workers)]
+        if handle.writer is None:
+            # Процесс перезапускается - ждем, пока он поднимется
+            for _ in range(100):
+                await asyncio.sleep(0.1)
+                if handle.writer is not None:
+                    break
+        try:
+            if handle.writer is None:
+                raise ConnectionError("процесс перезапускается")
+            await write_frame(handle.writer, _SHARD_KEY.pack(key) + raw)
+        except ConnectionError as e:
+            self.dropped += 1
+            logger.error(f"Апдейт {update.get('update_id')} не передан обработчику {handle.index}: {e}")
+            return False
+        handle.sent += 1
+        return True
+
+    async def stop(self, timeout: float = 35.0):
+        """
+        Закрывает сокеты (процессы дорабатывают принятые апдейты) и ждет их
+        """
+        self._stopping = True
+        for handle in self.workers:
+            if handle.writer is not None:
+                handle.writer.close()
+        loop = asyncio.get_running_loop()
+        for handle in self.workers:
+            if handle.process is not None:
+                await loop.run_in_executor(None, handle.process.join, timeout)
+                if handle.process.is_alive():
+                    handle.process.terminate()
+        for task in list(self._tasks):
+            task.cancel()
+
+    def metric_snapshots(self) -> List[Dict[str, List[list]]]:
+        """
+        Последние значения метрик процессов-обработчиков
+        """
+        return [handle.stats["metrics"] for handle in self.workers if "metrics" in handle.stats]
+
+    def health(self) -> Dict[str, Any]:
+        """
+        Сводная статистика: по каждому процессу и суммарно
+        """
+        workers = [
+            {**{name: value for name, value in handle.stats.items() if name != "metrics"},
+             "worker": handle.index, "alive": handle.alive,
+             "restarts": handle.restarts, "sent": handle.sent}
+            for handle in self.workers
+        ]
+        totals = {
+            name: sum(worker.get(name, 0) for worker in workers)
+            for name in ("sent", "received", "processed", "failed", "in_flight")
+        }
+        return {
+            "ok": all(worker["alive"] for worker in workers),
+            "dropped": self.dropped,
+            "totals": totals,
+            "workers": workers
+        }
+
+
+# ----- Прием апдейтов супервизором -----
+
+def create_ingress_app(supervisor: Supervisor, path: Optional[str] = None,
+                       secret_token: Optional[str] = None) -> web.Application:
+    """
+    aiohttp-приложение супервизора: GET /health со статистикой процессов
+    и, если задан path, прием webhook с проверкой секрета.
+    Telegram получает ответ сразу после передачи апдейта обработчику,
+    а если обработчик недоступен - 503, и апдейт будет доставлен повторно
+    """
+    async def health(request: web.Request) -> web.Response:
+        data = supervisor.health()
+        return web.json_response(data, status=200 if data["ok"] else 503)
+
+    async def webhook(request: web.Request) -> web.Response:
+        # Сравнение за постоянное время, как в SimpleRequestHandler aiogram
+        received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(received.encode(), (secret_token or "").encode()):
+            return web.Response(status=401, text="Unauthorized")
+        if not await supervisor.dispatch(await request.read()):
+            return web.Response(status=503, text="Worker unavailable")
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/health", health)
+    if path is not None:
+        app.router.add_post(path, webhook)
+    return app
+
+
+async def poll_updates(supervisor: Supervisor, bot: Bot, allowed_updates: List[str], timeout: int = 30):
+    """
+    Long polling без разбора апдейтов в модели aiogram:
+    супервизор только читает JSON и передает апдейты обработчикам.
+    offset сдвигается только за переданными апдейтами, поэтому
+    непереданный апдейт вернется в следующем getUpdates
+    """
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    offset = None
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout + 10)) as session:
+        while True:
+            params = {"timeout": timeout, "allowed_updates": allowed_updates}
+            if offset is not None:
+                params["offset"] = offset
+            try:
+                async with session.post(url, json=params) as response:
+                    payload = await response.json(loads=json.loads)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if not payload.get("ok"):
+                retry_after = payload.get("parameters", {}).get("retry_after", 5)
+                logger.error(f"getUpdates: {payload.get('description')}")
+                await asyncio.sleep(retry_after)
+                continue
+
+            for update in payload["result"]:
+                if not await supervisor.dispatch(json.dumps(update).encode(), update):
+                    break
+                offset = update["update_id"] + 1
+
+
+async def run_supervisor(bot: Bot, config, allowed_updates: List[str],
+                         initializer: Optional[Callable[[], Any]] = None):
+    """
+    Запускает config.WORKERS процессов и общий прием апдейтов
+    (webhook или long polling) до отмены
+    """
+    supervisor = Supervisor(config.WORKERS, initializer=initializer)
+    await supervisor.start()
+
+    webhook = config.RUN_MODE == "webhook"
+    app = create_ingress_app(
+        supervisor,
+        path=config.WEBHOOK_PATH if webhook else None,
+        secret_token=config.WEBHOOK_SECRET if webhook else None
+    )
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = config.WEBHOOK_PORT if webhook else config.HEALTH_PORT
+    if port:
+        await web.TCPSite(runner, host=config.WEBHOOK_HOST, port=port).start()
+        logger.info(f"Супервизор слушает {config.WEBHOOK_HOST}:{port}")
+    metrics_runner = None
+    if config.METRICS_PORT:
+        # Метрики всех процессов суммируются
+        metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT,
+                                                    snapshots=supervisor.metric_snapshots)
+
+    try:
+        if webhook:
+            await bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET,
+                allowed_updates=allowed_updates,
+                drop_pending_updates=False
+            )
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook(drop_pending_updates=False)
+            await poll_updates(supervisor, bot, allowed_updates)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await runner.cleanup()
+        await supervisor.stop()
@@ -0,0 +1,124 @@
+"""
+Буфер отложенной записи (write-behind)
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Объединяет записи по ключу в памяти и сбрасывает их одной пачкой
+    раз в interval секунд или при накоплении max_size ключей.
+    Для каждого ключа сохраняется только последнее значение
+    """
+
+    def __init__(self, name: str, flush: Callable[[Dict[Hashable, Any]], Awaitable[None]],
+                 interval: float = 30.0, max_size: int = 500):
+        self.name = name
+        self.interval = interval
+        self.max_size = max_size
+        self._flush_func = flush
+        self._pending: Dict[Hashable, Any] = {}
+        # Пачка, которая сейчас записывается, и отозванные из нее ключи
+        self._in_flight: Dict[Hashable, Any] = {}
+        self._withdrawn: Set[Hashable] = set()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # Статистика
+        self.merged = 0
+        self.flushed = 0
+        self.batches = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Добавляет запись в буфер (без обращения к БД)
+        """
+        if key in self._pending:
+            self.merged += 1
+        self._pending[key] = value
+
+        if len(self._pending) >= self.max_size:
+            self._wakeup.set()
+
+    async def discard(self, key: Hashable):
+        """
+        Убирает еще не сброшенную запись. Если она уже записывается,
+        дожидается окончания записи (и не возвращает ее в буфер при ошибке),
+        поэтому следующая запись по этому ключу попадет в БД после нее
+        """
+        self._pending.pop(key, None)
+        if key in self._in_flight:
+            self._withdrawn.add(key)
+            async with self._flush_lock:
+                pass
+
+    def _restore(self, batch: Dict[Hashable, Any]):
+        for key, value in batch.items():
+            if key not in self._withdrawn:
+                self._pending.setdefault(key, value)
+
+    async def flush(self):
+        """
+        Сбрасывает накопленные записи одной пачкой
+        При ошибке записи возвращаются в буфер, если их не перезаписали
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, {}
+            self._in_flight = batch
+
+            try:
+                await self._flush_func(batch)
+                self.flushed += len(batch)
+                self.batches += 1
+            except asyncio.CancelledError:
+                self._restore(batch)
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при сбросе буфера {self.name} ({len(batch)} записей): {e}")
+                self._restore(batch)
+            finally:
+                self._in_flight = {}
+                self._withdrawn = set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """
+        Запускает фоновый сброс буфера
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Запущен буфер {self.name}: каждые {self.interval}с или {self.max_size} записей")
+
+    async def stop(self):
+        """
+        Останавливает фоновый сброс и дописывает остаток
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()